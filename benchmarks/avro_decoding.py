@@ -0,0 +1,67 @@
+"""
+Compares decoding the alerts in tests/examples with fastavro.reader, which
+parses the writer schema of every file, and with avro_reader.read_alert,
+which parses it once per worker.
+
+    python benchmarks/avro_decoding.py
+"""
+
+import glob
+import io
+import os
+import sys
+import timeit
+
+import fastavro
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from stamp_service import avro_reader
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "../tests/examples/avro_test")
+
+
+def load_avros():
+    avros = []
+    for path in sorted(glob.glob(f"{EXAMPLES_PATH}/**/*.avro", recursive=True)):
+        with open(path, "rb") as f:
+            avros.append(f.read())
+    return avros
+
+
+def timing(func, avros):
+    def run():
+        for avro in avros:
+            func(io.BytesIO(avro))
+
+    return min(timeit.repeat(run, number=20, repeat=5)) / 20 / len(avros) * 1e3
+
+
+def cold(cutouts):
+    def read(avro_io):
+        avro_reader._writer_schemas = avro_reader.LRUCache(
+            "avro_schemas", avro_reader.MAX_SCHEMAS, sizeof=lambda entry: 1
+        )
+        return avro_reader.read_alert(avro_io, cutouts)
+
+    return read
+
+
+def main():
+    avros = load_avros()
+    print(f"{len(avros)} alerts, ms per alert")
+    print(
+        f"{'fastavro.reader':>32}: {timing(lambda f: next(fastavro.reader(f)), avros):.3f}"
+    )
+    for name, cutouts in [
+        ("all cutouts", avro_reader.CUTOUT_FIELDS),
+        ("science cutout", ("cutoutScience",)),
+        ("no cutouts", ()),
+    ]:
+        parse = timing(cold(cutouts), avros)
+        cached = timing(lambda f: avro_reader.read_alert(f, cutouts), avros)
+        print(f"{'read_alert, ' + name + ', parse':>32}: {parse:.3f}")
+        print(f"{'read_alert, ' + name + ', cached':>32}: {cached:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares normalization.get_limits with the previous get_max formula on the
+cutouts in tests/examples, one stamp at a time and as stacked batches.
+
+    python benchmarks/normalization.py
+"""
+
+import glob
+import os
+import sys
+import timeit
+
+import fastavro
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from stamp_service import fits2png, normalization, utils
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "../tests/examples/avro_test")
+
+
+def previous_get_max(data, window):
+    x = data.shape[0] // 2
+    y = data.shape[1] // 2
+    center = data[x - window : x + window, y - window : y + window]
+    max_val = np.nanmax(center)
+    min_val = np.nanmin(data) + 0.2 * np.nanmedian(np.abs(data - np.nanmedian(data)))
+    return max_val, min_val
+
+
+def load_alerts():
+    alerts = []
+    for path in sorted(glob.glob(f"{EXAMPLES_PATH}/**/*.avro", recursive=True)):
+        with open(path, "rb") as f:
+            avro = next(fastavro.reader(f))
+        alerts.append(
+            np.stack(
+                [
+                    fits2png._read_compressed_fits(utils.get_stamp_type(avro, s)).data
+                    for s in utils.STAMP_KEYS
+                ]
+            )
+        )
+    return alerts
+
+
+def timing(func):
+    return min(timeit.repeat(func, number=20, repeat=5)) / 20 * 1e3
+
+
+def main():
+    alerts = load_alerts()
+    stamps = [stamp for alert in alerts for stamp in alert]
+
+    for data in stamps:
+        assert previous_get_max(data, 2) == normalization.get_limits(data, 2)
+
+    previous = timing(lambda: [previous_get_max(d, utils.WINDOW) for d in stamps])
+    single = timing(lambda: [normalization.get_limits(d, utils.WINDOW) for d in stamps])
+    batch = timing(
+        lambda: [normalization.get_limits_batch(a, utils.WINDOW) for a in alerts]
+    )
+    print(f"{len(stamps)} stamps, identical results")
+    print(f"previous get_max:  {previous:.3f} ms")
+    print(f"get_limits:        {single:.3f} ms")
+    print(f"get_limits_batch:  {batch:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compares rotation.rotate with scipy.ndimage.rotate, the rotation used
+before for ATLAS stamps, on the cutouts in tests/examples.
+
+Reports the time per rotation and the pixel error after the PNG
+normalization, in gray levels (0-255).
+
+    python benchmarks/rotation.py
+"""
+
+import glob
+import os
+import sys
+import timeit
+
+import fastavro
+import numpy as np
+from scipy import ndimage
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from stamp_service import fits2png, rotation, utils
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "../tests/examples/avro_test")
+ANGLES = [0, 90, 180, 270, 12.1, 37.3, 123.45, 301.7]
+
+
+def load_stamps():
+    stamps = []
+    for path in sorted(glob.glob(f"{EXAMPLES_PATH}/**/*.avro", recursive=True)):
+        with open(path, "rb") as f:
+            avro = next(fastavro.reader(f))
+        for stype in utils.STAMP_KEYS:
+            data = fits2png._read_compressed_fits(utils.get_stamp_type(avro, stype))
+            stamps.append((stype, data.data))
+    return stamps
+
+
+def levels(data, vmin, vmax):
+    return np.clip(np.floor((data - vmin) / (vmax - vmin) * 256), 0, 255)
+
+
+def main():
+    stamps = load_stamps()
+    print(
+        f"{'angle':>8} {'ndimage ms':>11} {'rotation ms':>12} {'max err':>8} {'mean err':>9}"
+    )
+    for angle in ANGLES:
+        errors = []
+        for stype, data in stamps:
+            if stype == "difference":
+                vmax, vmin = np.nanmax(data), np.nanmin(data)
+            else:
+                vmax, vmin = fits2png.get_max(data, utils.WINDOW)
+            expected = levels(ndimage.rotate(data, angle), vmin, vmax)
+            error = np.abs(expected - levels(rotation.rotate(data, angle), vmin, vmax))
+            errors.append(error[~np.isnan(error)])
+        errors = np.concatenate(errors)
+
+        data = stamps[0][1]
+        rotation.rotate(data, angle)  # Build the coordinate map
+        timings = {}
+        for name, func in [("ndimage", ndimage.rotate), ("rotation", rotation.rotate)]:
+            timings[name] = (
+                min(timeit.repeat(lambda: func(data, angle), number=100, repeat=5))
+                / 100
+                * 1e3
+            )
+        print(
+            f"{angle:>8} {timings['ndimage']:>11.3f} {timings['rotation']:>12.3f}"
+            f" {errors.max():>8.0f} {errors.mean():>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
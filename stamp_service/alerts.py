@@ -0,0 +1,73 @@
+import io
+from collections import namedtuple
+
+from . import avro_reader
+from .cache import LRUCache
+
+Alert = namedtuple("Alert", ["raw", "record"])
+
+
+def project(record, cutouts):
+    """
+    Returns a copy of the top level of a record without the cutouts that
+    were not requested. Nested values are shared and must not be modified.
+    """
+    return {
+        key: value
+        for key, value in record.items()
+        if key not in avro_reader.CUTOUT_FIELDS or key in cutouts
+    }
+
+
+def _sizeof(alert):
+    # A decoded record takes about as much memory as its avro file
+    return 2 * len(alert.raw)
+
+
+class AlertCache:
+    """
+    In-process LRU cache of alerts by survey and candid.
+
+    Holds the avro file and the record decoded from it, with every cutout,
+    so the stamp, avro and avro info endpoints share one download and one
+    decode per alert. Bounded by `max_bytes`, 0 disables it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.memory = None
+
+    def init(self, settings=None):
+        settings = settings or {}
+        max_bytes = int(settings.get("max_bytes") or 0)
+        self.memory = LRUCache(self.name, max_bytes, _sizeof) if max_bytes else None
+
+    @property
+    def enabled(self):
+        return self.memory is not None
+
+    def get(self, survey_id, candid):
+        if self.memory is None:
+            return None
+        return self.memory.get((survey_id, str(candid)))
+
+    def add(self, survey_id, candid, raw):
+        """
+        Decodes an avro file and caches it.
+
+        Parameters
+        ----------
+        survey_id : str
+            survey of the alert
+        candid : int or str
+            alert id
+        raw : bytes
+            avro file
+        """
+        alert = Alert(raw, avro_reader.read_alert(io.BytesIO(raw)))
+        if self.memory is not None:
+            self.memory.set((survey_id, str(candid)), alert)
+        return alert
+
+
+alert_cache = AlertCache("decoded_alerts")
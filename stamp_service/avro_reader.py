@@ -0,0 +1,151 @@
+import hashlib
+import io
+import json
+import zlib
+
+import fastavro
+
+from .cache import LRUCache
+
+CUTOUT_FIELDS = ("cutoutScience", "cutoutTemplate", "cutoutDifference")
+MAGIC = b"Obj\x01"
+HEADER_SCHEMA = fastavro.parse_schema(
+    {
+        "type": "record",
+        "name": "org.apache.avro.file.Header",
+        "fields": [
+            {"name": "magic", "type": {"type": "fixed", "name": "Magic", "size": 4}},
+            {"name": "meta", "type": {"type": "map", "values": "bytes"}},
+            {"name": "sync", "type": {"type": "fixed", "name": "Sync", "size": 16}},
+        ],
+    }
+)
+DECOMPRESS = {
+    b"null": lambda data: data,
+    b"deflate": lambda data: zlib.decompress(data, -15),
+}
+
+MAX_SCHEMAS = 16
+
+# Parsed writer schemas by fingerprint, the size of an entry is 1 so the
+# cache holds at most MAX_SCHEMAS schemas
+_writer_schemas = LRUCache("avro_schemas", MAX_SCHEMAS, sizeof=lambda entry: 1)
+
+
+def fingerprint(writer_schema):
+    """
+    SHA-256 of the JSON writer schema stored in an avro file header.
+    """
+    return hashlib.sha256(writer_schema).digest()
+
+
+def project_schema(schema, cutouts):
+    """
+    Returns the prefix of a record schema needed to decode the cutouts.
+
+    Avro records are the concatenation of their fields, so a record can be
+    decoded with the writer schema truncated after its last needed field.
+    The needed fields are the ones that are not cutouts and the given
+    cutouts. Works on both raw and parsed schemas.
+    """
+    needed = [
+        i
+        for i, field in enumerate(schema["fields"])
+        if field["name"] not in CUTOUT_FIELDS or field["name"] in cutouts
+    ]
+    projected = dict(schema)
+    projected["fields"] = schema["fields"][: max(needed, default=-1) + 1]
+    return projected
+
+
+def _schema_entry(writer_schema):
+    key = fingerprint(writer_schema)
+    entry = _writer_schemas.get(key)
+    if entry is None:
+        entry = {
+            "schema": fastavro.parse_schema(json.loads(writer_schema)),
+            "projections": {},
+        }
+        _writer_schemas.set(key, entry)
+    return entry
+
+
+def parsed_schema(writer_schema):
+    """
+    Parsed writer schema, only parsed the first time it is seen by a worker.
+
+    Parameters
+    ----------
+    writer_schema : bytes
+        JSON writer schema stored in the avro file header
+    """
+    return _schema_entry(writer_schema)["schema"]
+
+
+def decoding_schema(writer_schema, cutouts):
+    """
+    Parsed schema that decodes a record up to the last requested cutout.
+
+    Derived from the cached parsed writer schema, once per set of cutouts.
+
+    Parameters
+    ----------
+    writer_schema : bytes
+        JSON writer schema stored in the avro file header
+    cutouts : tuple of str
+        cutout fields to decode
+    """
+    entry = _schema_entry(writer_schema)
+    projected = entry["projections"].get(cutouts)
+    if projected is None:
+        projected = project_schema(entry["schema"], cutouts)
+        entry["projections"][cutouts] = projected
+    return projected
+
+
+def _read_long(fo):
+    byte = fo.read(1)
+    if not byte:
+        raise EOFError("Unexpected end of avro file")
+    b = ord(byte)
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+        b = ord(fo.read(1))
+        n |= (b & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1)
+
+
+def read_alert(avro_io, cutouts=CUTOUT_FIELDS):
+    """
+    Decodes the alert of an avro file, skipping the cutouts not requested.
+
+    Parameters
+    ----------
+    avro_io : file-like
+        avro file positioned at its start
+    cutouts : iterable of str
+        cutout fields to decode, the others are not in the returned record
+    """
+    cutouts = tuple(cutouts)
+    start = avro_io.tell()
+    if avro_io.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not an avro container file")
+    avro_io.seek(start)
+    header = fastavro.schemaless_reader(avro_io, HEADER_SCHEMA)
+
+    codec = header["meta"].get("avro.codec", b"null")
+    if codec in DECOMPRESS:
+        schema = decoding_schema(header["meta"]["avro.schema"], cutouts)
+        _read_long(avro_io)  # Number of records in the block
+        block = DECOMPRESS[codec](avro_io.read(_read_long(avro_io)))
+        record = fastavro.schemaless_reader(io.BytesIO(block), schema)
+    else:
+        avro_io.seek(start)
+        record = next(fastavro.reader(avro_io))
+
+    for field in CUTOUT_FIELDS:
+        if field not in cutouts:
+            record.pop(field, None)
+    return record
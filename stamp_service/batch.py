@@ -0,0 +1,90 @@
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .per_process import PerProcess
+
+
+class _ChunkWriter:
+    """
+    File object that keeps what is written until it is taken, so a zip
+    file can be sent while it is written. It can't seek, so zipfile writes
+    the sizes of the entries after their data.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(results):
+    """
+    Yields a zip file as its entries are added.
+
+    Parameters
+    ----------
+    results : iterable of (dict, list of (str, bytes))
+        manifest entry and files of each item, the manifest of every item
+        is added as manifest.json after the files
+    """
+    writer = _ChunkWriter()
+    manifest = []
+    # Stamps are already compressed
+    with zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED) as archive:
+        for entry, files in results:
+            manifest.append(entry)
+            for name, data in files:
+                archive.writestr(name, data)
+            yield writer.take()
+        archive.writestr("manifest.json", json.dumps(manifest))
+    yield writer.take()
+
+
+class BatchExecutor:
+    """
+    Runs the items of batch requests in a pool of `workers` threads shared
+    by the requests of a worker. Batches take at most `max_items` items and
+    object bundles at most `max_object_items`.
+    """
+
+    def __init__(self):
+        self.init()
+
+    def init(self, settings=None):
+        settings = settings or {}
+        self.workers = int(settings.get("workers") or 8)
+        self.max_items = int(settings.get("max_items") or 200)
+        self.max_object_items = int(settings.get("max_object_items") or 2000)
+        self._pool = PerProcess(
+            lambda: ThreadPoolExecutor(self.workers, thread_name_prefix="batch")
+        )
+
+    def map_unordered(self, func, items):
+        """
+        Yields func(item) for every item, as they finish.
+
+        Items that haven't started are cancelled when the generator is
+        closed, e.g. when the client disconnects.
+        """
+        pool = self._pool.get()
+        futures = [pool.submit(func, item) for item in items]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+batch_executor = BatchExecutor()
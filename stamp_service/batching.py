@@ -0,0 +1,77 @@
+import threading
+
+from .metrics import BATCH_SIZE
+
+
+class _Batch:
+    def __init__(self):
+        self.keys = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class Batcher:
+    """
+    Groups the keys requested by concurrent callers into batches looked up
+    with a single call.
+
+    The first caller of a batch waits `window` seconds, or until the batch
+    has `max_size` keys, and then calls `func` with the keys of the batch.
+    `func` returns a dictionary with the result of every key, or the
+    exception to raise for it. Every caller gets the result of its key.
+
+    Parameters
+    ----------
+    name : str
+        name reported in the metrics
+    func : callable
+        looks up a list of keys
+    window : float
+        seconds to wait for more keys
+    max_size : int
+        keys per batch
+    """
+
+    def __init__(self, name, func, window=0.005, max_size=100):
+        self.name = name
+        self.func = func
+        self.window = window
+        self.max_size = max_size
+        self._batch = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            if key not in batch.keys:
+                batch.keys.append(key)
+            if len(batch.keys) >= self.max_size:
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            BATCH_SIZE.labels(self.name).observe(len(batch.keys))
+            try:
+                batch.results = self.func(list(batch.keys))
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        result = batch.results[key]
+        if isinstance(result, Exception):
+            raise result
+        return result
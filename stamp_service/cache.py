@@ -0,0 +1,257 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .metrics import CACHE_BYTES, CACHE_EVICTIONS, CACHE_LOOKUPS
+from .per_process import PerProcess
+from .shm_cache import SharedMemoryCache
+
+
+class LRUCache:
+    """
+    Thread safe in-process LRU cache bounded by the total size of its values.
+
+    Parameters
+    ----------
+    name : str
+        cache name reported in the metrics
+    max_bytes : int
+        maximum total size of the stored values
+    sizeof : callable
+        returns the size in bytes of a value
+    """
+
+    def __init__(self, name, max_bytes, sizeof=len):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            CACHE_LOOKUPS.labels(self.name, "memory", "miss").inc()
+            return None
+        CACHE_LOOKUPS.labels(self.name, "memory", "hit").inc()
+        return entry[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.nbytes -= old_size
+                evicted += 1
+            CACHE_BYTES.labels(self.name).set(self.nbytes)
+        if evicted:
+            CACHE_EVICTIONS.labels(self.name, "memory").inc(evicted)
+
+
+class DiskCache:
+    """
+    File based cache of bytes that can be shared by every worker of a node.
+
+    Entries are written to a temporary file and renamed into place, so
+    readers never see a partial entry. Reads refresh the modification time
+    of the file and, every `check_every` writes, a background thread removes
+    the least recently used files until the directory is back under 90% of
+    `max_bytes`. Only one worker of the node scans the directory at a time.
+    """
+
+    def __init__(self, name, directory, max_bytes, check_every=100):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._evict_requested = threading.Event()
+        self._evictor = PerProcess(self._start_evictor)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            CACHE_LOOKUPS.labels(self.name, "disk", "miss").inc()
+            return None
+        CACHE_LOOKUPS.labels(self.name, "disk", "hit").inc()
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._writes += 1
+            check = self._writes % self.check_every == 0
+        if check:
+            self._evictor.get()
+            self._evict_requested.set()
+
+    def _start_evictor(self):
+        thread = threading.Thread(
+            target=self._evict_loop, name=f"{self.name}_eviction", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _evict_loop(self):
+        while True:
+            self._evict_requested.wait()
+            self._evict_requested.clear()
+            try:
+                self.evict()
+            except OSError:
+                pass  # Retried on the next check
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for fname in files:
+                if fname.startswith("."):
+                    continue
+                path = os.path.join(root, fname)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """
+        Removes the least recently used files if the directory is over
+        `max_bytes`, unless another worker is already doing it.
+        """
+        fd = os.open(os.path.join(self.directory, ".evict.lock"), os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return
+        try:
+            self._evict()
+        finally:
+            os.close(fd)
+
+    def _evict(self):
+        entries = list(self._entries())
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass  # Removed by another worker
+            total -= size
+        CACHE_EVICTIONS.labels(self.name, "disk").inc(evicted)
+
+
+class TieredCache:
+    """
+    In-process LRU cache backed by optional shared memory and disk caches.
+
+    Lookups go through the in-process, shared memory and disk tiers in
+    that order, and hits are copied to the faster tiers. Every tier is
+    disabled until `init` is called with its settings.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.memory = None
+        self.shared = None
+        self.disk = None
+
+    def init(self, settings=None):
+        settings = settings or {}
+        max_bytes = settings.get("max_bytes") or 0
+        directory = settings.get("directory")
+        self.memory = LRUCache(self.name, int(max_bytes)) if max_bytes else None
+        shared_bytes = int(settings.get("shared_bytes") or 0)
+        self.shared = (
+            SharedMemoryCache(
+                self.name,
+                settings.get("shared_directory") or "/dev/shm",
+                shared_bytes,
+                int(settings.get("shared_slot_bytes") or 65536),
+            )
+            if shared_bytes
+            else None
+        )
+        self.disk = (
+            DiskCache(self.name, directory, int(settings.get("disk_max_bytes") or 0))
+            if directory
+            else None
+        )
+
+    @property
+    def enabled(self):
+        return any(tier is not None for tier in (self.memory, self.shared, self.disk))
+
+    def get(self, key):
+        faster = []
+        value = None
+        for tier in (self.memory, self.shared, self.disk):
+            if tier is None:
+                continue
+            value = tier.get(key)
+            if value is not None:
+                break
+            faster.append(tier)
+        if value is not None:
+            for tier in faster:
+                tier.set(key, value)
+        return value
+
+    def set(self, key, value):
+        if self.memory is not None:
+            self.memory.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except OSError:
+                pass  # The disk tier is best effort, e.g. when the disk is full
+
+
+stamp_cache = TieredCache("rendered_stamps")
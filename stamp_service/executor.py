@@ -0,0 +1,97 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from .metrics import RENDER_QUEUE_DEPTH, RENDER_REJECTIONS, RENDER_WAIT_SECONDS
+from .per_process import PerProcess
+
+MODES = ("inline", "thread", "process")
+
+
+def _timed_call(func, args):
+    return time.time(), func(*args)
+
+
+class RenderExecutor:
+    """
+    Runs CPU bound rendering inline, in a thread pool or in a process pool.
+
+    Pools accept up to `workers + max_queue` renders at once, any other
+    render is rejected with 503 Service Unavailable, as is a render that
+    doesn't finish within `timeout` seconds. Each process creates its own
+    pool.
+    """
+
+    def __init__(self):
+        self.mode = "inline"
+        self._pool = PerProcess(self._new_pool)
+
+    def init(self, settings=None):
+        settings = settings or {}
+        mode = settings.get("mode") or "inline"
+        if mode not in MODES:
+            raise ValueError(f"Unrecognized render executor mode {mode}")
+        self.shutdown()
+        self.mode = mode
+        self.workers = int(settings.get("workers") or 1)
+        self.max_queue = int(settings.get("max_queue") or 0)
+        self.timeout = float(settings.get("timeout") or 10)
+        self.start_method = settings.get("start_method") or "spawn"
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+
+    def _new_pool(self):
+        if self.mode == "thread":
+            return ThreadPoolExecutor(self.workers)
+        context = multiprocessing.get_context(self.start_method)
+        return ProcessPoolExecutor(self.workers, mp_context=context)
+
+    def _release(self, future):
+        RENDER_QUEUE_DEPTH.dec()
+        self._slots.release()
+
+    def run(self, func, *args):
+        """
+        Runs func(*args) in the executor and returns its result.
+
+        Raises
+        ------
+        werkzeug.exceptions.ServiceUnavailable
+            if the queue is full or the render times out
+        """
+        if self.mode == "inline":
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            RENDER_REJECTIONS.labels("queue_full").inc()
+            raise ServiceUnavailable("Rendering queue is full, try again later")
+        RENDER_QUEUE_DEPTH.inc()
+        submitted = time.time()
+        try:
+            future = self._pool.get().submit(_timed_call, func, args)
+        except Exception:
+            self._release(None)
+            raise
+        # The slot is held until the render finishes, even after a timeout
+        future.add_done_callback(self._release)
+
+        try:
+            started, result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            RENDER_REJECTIONS.labels("timeout").inc()
+            raise ServiceUnavailable("Rendering timed out, try again later")
+        RENDER_WAIT_SECONDS.observe(max(started - submitted, 0))
+        return result
+
+    def shutdown(self):
+        pool = self._pool.peek()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = PerProcess(self._new_pool)
+
+
+render_executor = RenderExecutor()
@@ -1,11 +1,16 @@
 from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
 from prometheus_flask_exporter import PrometheusMetrics
 from ralidator_flask.ralidator_flask import RalidatorFlask
+from . import metrics
 
 ralidator = RalidatorFlask()
 
 
 def set_prometheus_metrics(app):
+    """
+    Exports the default flask metrics along with the service metrics
+    defined in the metrics module, e.g. cache hits, misses and evictions.
+    """
     is_gunicorn = "gunicorn" in app.config["SERVER_SETTINGS"]["server_software"]
     if is_gunicorn:
         prometheus_metrics = GunicornInternalPrometheusMetrics.for_app_factory()
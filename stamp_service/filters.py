@@ -1,6 +1,16 @@
 from .extensions import ralidator
 
 
+def is_filtered(filter_name, survey_id):
+    """
+    Whether the user filters hide the data of the survey.
+    """
+    apply_all = "*" in ralidator.ralidator.user_filters
+    return (
+        apply_all or filter_name in ralidator.ralidator.user_filters
+    ) and survey_id == "atlas"
+
+
 def filter_atlas_data(filter_name, arg_key):
     def wrapper_function(arg_function):
         def decorator_function(*args, **kwargs):
@@ -8,10 +18,7 @@ def filter_atlas_data(filter_name, arg_key):
             The decorator function works because we assume that the
             survey id exists.
             """
-            apply_all = "*" in ralidator.ralidator.user_filters
-            if (
-                apply_all or filter_name in ralidator.ralidator.user_filters
-            ) and kwargs[arg_key] == "atlas":
+            if is_filtered(filter_name, kwargs[arg_key]):
                 return None
             else:
                 return arg_function(*args, **kwargs)
@@ -1,52 +1,67 @@
 import gzip
 import io
 
-import astropy.io.fits as fio
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy import ndimage
 
+from . import fits_reader, normalization, png, rotation
 
-def _read_compressed_fits(compressed_fits_file):
-    try:
-        fits = io.BytesIO(compressed_fits_file)
-        return fio.open(gzip.open(fits))[0]
-    except OSError:
-        fits = io.BytesIO(compressed_fits_file)
-        return fio.open(fits)[0]
+GZIP_MAGIC = b"\x1f\x8b"
 
+RENDERERS = ("numpy", "matplotlib")
+# Bump whenever the output of transform changes, it invalidates cached stamps
+RENDERER_VERSION = 1
 
-def get_max(data, window):
-    x = data.shape[0] // 2
-    y = data.shape[1] // 2
-    center = data[x - window : x + window, y - window : y + window]
-    max_val = np.nanmax(center)
-    min_val = np.nanmin(data) + 0.2 * np.nanmedian(np.abs(data - np.nanmedian(data)))
+# matplotlib's Greys_r colormap sampled at 256 levels, same as its lookup table
+_GREYS_R_NODES = np.array([0, 37, 82, 115, 150, 189, 217, 240, 255]) / 255
+_GREYS_R_LUT = (
+    np.interp(
+        np.linspace(0, 1, 256),
+        np.linspace(0, 1, len(_GREYS_R_NODES)),
+        _GREYS_R_NODES,
+    )
+    * 255
+).astype(np.uint8)
 
-    return max_val, min_val
 
+def _astropy_fits():
+    # Only needed for cutouts fits_reader can't read, and slow to import
+    import astropy.io.fits
 
-def transform(compressed_fits_file, file_type, window):
-    hdu = _read_compressed_fits(compressed_fits_file)
+    return astropy.io.fits
+
+
+def _pyplot():
+    # Only needed by the matplotlib renderer, and slow to import
+    import matplotlib.pyplot
+
+    return matplotlib.pyplot
 
-    data = hdu.data
-    vmax, vmin = (
-        get_max(data, window)
-        if file_type != "difference"
-        else (np.nanmax(data), np.nanmin(data))
-    )
 
+def _read_compressed_fits(compressed_fits_file):
+    if compressed_fits_file[:2] == GZIP_MAGIC:
+        fits = gzip.decompress(compressed_fits_file)
+    else:
+        fits = compressed_fits_file
+    try:
+        return fits_reader.read_image(fits)
+    except fits_reader.UnsupportedFITS:
+        return _astropy_fits().open(io.BytesIO(fits))[0]
+
+
+def get_max(data, window):
+    return normalization.get_limits(data, window)
+
+
+def _render_matplotlib(data, vmin, vmax, origin):
+    plt = _pyplot()
     buf = io.BytesIO()
 
     fig = plt.figure()
     ax = fig.add_subplot()
 
-    opts = dict(cmap="Greys_r", interpolation="nearest", vmin=vmin, vmax=vmax)
-    try:  # Transformation required to properly orient ATLAS stamps
-        data = ndimage.rotate(data, hdu.header["PA"])
-        opts["origin"] = "lower"
-    except KeyError:  # Required for ZTF
-        opts["origin"] = "upper"
+    opts = dict(
+        cmap="Greys_r", interpolation="nearest", vmin=vmin, vmax=vmax, origin=origin
+    )
     ax.imshow(data, **opts)
 
     ax.axis("off")
@@ -57,3 +72,118 @@ def transform(compressed_fits_file, file_type, window):
 
     buf.seek(0)
     return buf.read()
+
+
+def _render_numpy(data, vmin, vmax, origin):
+    """
+    Renders the stamp at its native resolution, mapping values the same way
+    matplotlib does: linear between vmin and vmax into 256 levels of Greys_r,
+    saturating outside the range and leaving NaN pixels transparent.
+    """
+    if origin == "lower":
+        data = data[::-1]
+
+    span = vmax - vmin
+    scaled = np.subtract(data, vmin, dtype=np.float64)
+    if span > 0:
+        scaled *= 256 / span
+    else:
+        scaled[~np.isnan(scaled)] = 0
+    np.clip(scaled, 0, 255, out=scaled)
+
+    nan_mask = np.isnan(scaled)
+    has_nan = nan_mask.any()
+    if has_nan:
+        scaled[nan_mask] = 0
+    gray = _GREYS_R_LUT[scaled.astype(np.intp)]
+
+    alpha = None
+    if has_nan:
+        alpha = np.where(nan_mask, 0, 255).astype(np.uint8)
+    return png.encode(gray, alpha)
+
+
+def get_max_batch(stack, window):
+    """
+    Vectorized version of get_max for a stack of same sized stamps.
+
+    Returns one max and one min value per stamp in the stack.
+    """
+    return normalization.get_limits_batch(stack, window)
+
+
+def _check_renderer(renderer):
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unrecognized renderer {renderer}")
+
+
+def _render(hdu, data, vmin, vmax, renderer):
+    try:  # Transformation required to properly orient ATLAS stamps
+        data = rotation.rotate(data, hdu.header["PA"])
+        origin = "lower"
+    except KeyError:  # Required for ZTF
+        origin = "upper"
+
+    if renderer == "matplotlib":
+        return _render_matplotlib(data, vmin, vmax, origin)
+    return _render_numpy(data, vmin, vmax, origin)
+
+
+def transform(compressed_fits_file, file_type, window, renderer="numpy"):
+    _check_renderer(renderer)
+    hdu = _read_compressed_fits(compressed_fits_file)
+
+    data = hdu.data
+    vmax, vmin = (
+        get_max(data, window)
+        if file_type != "difference"
+        else (np.nanmax(data), np.nanmin(data))
+    )
+
+    return _render(hdu, data, vmin, vmax, renderer)
+
+
+def transform_batch(compressed_fits_files, file_types, window, renderer="numpy"):
+    """
+    Transforms several stamps of the same alert into PNG.
+
+    The stamps are stacked so the thresholds of all of them are computed
+    at once. Stamps of different shapes are normalized one by one.
+
+    Parameters
+    ----------
+    compressed_fits_files : list of bytes
+        (gzipped) FITS cutouts
+    file_types : list of str
+        stamp type of each cutout
+    window : int
+        half size of the center window used for the max threshold
+    renderer : str
+        one of RENDERERS
+    """
+    _check_renderer(renderer)
+    hdus = [_read_compressed_fits(fits) for fits in compressed_fits_files]
+    if not hdus:
+        return []
+
+    shapes = {hdu.data.shape for hdu in hdus}
+    if len(shapes) == 1:
+        stack = np.stack([hdu.data for hdu in hdus])
+        is_difference = np.array([stype == "difference" for stype in file_types])
+        vmax, vmin = get_max_batch(stack, window)
+        vmax = np.where(is_difference, np.nanmax(stack, axis=(1, 2)), vmax)
+        vmin = np.where(is_difference, np.nanmin(stack, axis=(1, 2)), vmin)
+    else:
+        limits = [
+            (
+                get_max(hdu.data, window)
+                if stype != "difference"
+                else (np.nanmax(hdu.data), np.nanmin(hdu.data))
+            )
+            for hdu, stype in zip(hdus, file_types)
+        ]
+        vmax, vmin = zip(*limits)
+
+    return [
+        _render(hdu, hdu.data, vmin[i], vmax[i], renderer) for i, hdu in enumerate(hdus)
+    ]
@@ -0,0 +1,105 @@
+from collections import namedtuple
+
+import numpy as np
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+BITPIX_DTYPES = {
+    8: np.dtype("u1"),
+    16: np.dtype(">i2"),
+    32: np.dtype(">i4"),
+    64: np.dtype(">i8"),
+    -32: np.dtype(">f4"),
+    -64: np.dtype(">f8"),
+}
+# Header cards used by the service, any other card is skipped
+KEYWORDS = {"SIMPLE", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "BZERO", "BSCALE", "PA"}
+# Cards that need a feature this reader doesn't support
+UNSUPPORTED_KEYWORDS = {"BLANK", "GROUPS"}
+
+FitsImage = namedtuple("FitsImage", ["header", "data"])
+
+
+class UnsupportedFITS(ValueError):
+    pass
+
+
+def _parse_value(value):
+    value = value.split(b"/", 1)[0].strip()
+    if value == b"T":
+        return True
+    if value == b"F":
+        return False
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value.replace(b"D", b"E"))
+    except ValueError:
+        raise UnsupportedFITS(f"Unsupported header value {value!r}")
+
+
+def _read_header(buffer):
+    header = {}
+    offset = 0
+    while offset + BLOCK_SIZE <= len(buffer):
+        block = bytes(buffer[offset : offset + BLOCK_SIZE])
+        offset += BLOCK_SIZE
+        for start in range(0, BLOCK_SIZE, CARD_SIZE):
+            card = block[start : start + CARD_SIZE]
+            key = card[:8].rstrip().decode("ascii", errors="replace")
+            if key == "END":
+                return header, offset
+            if key in UNSUPPORTED_KEYWORDS:
+                raise UnsupportedFITS(f"Unsupported keyword {key}")
+            if key in KEYWORDS and card[8:10] == b"= ":
+                header[key] = _parse_value(card[10:])
+    raise UnsupportedFITS("Header without END card")
+
+
+def read_image(buffer):
+    """
+    Reads a FITS file holding a single 2D image.
+
+    Only the cards in KEYWORDS are parsed. Unless it has to be scaled by
+    BZERO/BSCALE, the data is a read only big-endian view of the buffer,
+    it isn't copied.
+
+    Parameters
+    ----------
+    buffer : bytes-like
+        uncompressed FITS file
+
+    Raises
+    ------
+    UnsupportedFITS
+        if the file is not a simple 2D image this reader can handle
+    """
+    header, offset = _read_header(memoryview(buffer))
+    if header.get("SIMPLE") is not True or header.get("NAXIS") != 2:
+        raise UnsupportedFITS("Not a single 2D image")
+    try:
+        dtype = BITPIX_DTYPES[header["BITPIX"]]
+        shape = (header["NAXIS2"], header["NAXIS1"])
+    except KeyError:
+        raise UnsupportedFITS("Missing or invalid BITPIX/NAXISn")
+    count = shape[0] * shape[1]
+    if offset + count * dtype.itemsize > len(buffer):
+        raise UnsupportedFITS("Truncated data")
+
+    data = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+    data = data.reshape(shape)
+
+    bscale = header.get("BSCALE", 1)
+    bzero = header.get("BZERO", 0)
+    if bscale != 1 or bzero != 0:
+        # Same output types as astropy
+        if dtype.kind == "f":
+            float_type = dtype.newbyteorder("=")
+        else:
+            float_type = np.float32 if dtype.itemsize <= 2 else np.float64
+        data = data.astype(float_type)
+        data *= bscale
+        data += bzero
+    return FitsImage(header, data)
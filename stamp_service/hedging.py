@@ -0,0 +1,105 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .latency import s3_latencies
+from .metrics import HEDGED_FETCHES
+from .per_process import PerProcess
+from .search import MARS_SURVEYS, mars_searcher, s3_searcher
+
+
+class HedgedFetcher:
+    """
+    Looks an avro up in S3 and, if S3 takes longer than usual, also in MARS,
+    returning the first avro found.
+
+    The wait before asking MARS is the `percentile` of the recent S3
+    download times of the survey, kept between `min_delay` and `max_delay`
+    seconds, and `max_delay` until `min_samples` downloads were observed.
+    The lookup that loses keeps running in the background, Python threads
+    can't be interrupted, and its result only fills the caches. Lookups
+    run in a pool of `workers` threads per process.
+    """
+
+    def __init__(self):
+        self.init()
+
+    def init(self, settings=None):
+        settings = settings or {}
+        self.enabled = bool(settings.get("enabled"))
+        self.percentile = float(settings.get("percentile") or 95)
+        self.min_delay = float(settings.get("min_delay") or 0)
+        self.max_delay = float(settings.get("max_delay") or 1)
+        self.min_samples = int(settings.get("min_samples") or 20)
+        self.workers = int(settings.get("workers") or 16)
+        self._pool = PerProcess(
+            lambda: ThreadPoolExecutor(self.workers, thread_name_prefix="hedged_fetch")
+        )
+
+    def hedges(self, survey_id):
+        return self.enabled and survey_id in MARS_SURVEYS
+
+    def delay(self, survey_id):
+        """
+        Seconds to wait for S3 before asking MARS.
+        """
+        latency = s3_latencies.percentile(survey_id, self.percentile, self.min_samples)
+        if latency is None:
+            return self.max_delay
+        return min(max(latency, self.min_delay), self.max_delay)
+
+    def fetch(self, candid, survey_id, oid=None, avro_url=None):
+        """
+        Returns the avro of an alert and where it was found.
+
+        Parameters
+        ----------
+        candid : int or str
+            alert id
+        survey_id : str
+            survey of the alert, one of MARS_SURVEYS
+        oid : str
+            object id, checked against the MARS answer if given
+        avro_url : str
+            MARS URL of the avro, if it is known
+
+        Returns
+        -------
+        tuple of (io.BytesIO, str)
+            avro file and its source, "s3" or "mars"
+
+        Raises
+        ------
+        FileNotFoundError
+            if the avro is neither in S3 nor in MARS
+        """
+        pool = self._pool.get()
+        s3_future = pool.submit(s3_searcher.get_file_from_s3, candid, survey_id)
+        done, _ = wait([s3_future], timeout=self.delay(survey_id))
+        if done and s3_future.exception() is None:
+            return s3_future.result(), "s3"
+
+        hedged = not done
+        mars_future = pool.submit(
+            mars_searcher.get_file_from_mars, oid, int(candid), avro_url
+        )
+        sources = {s3_future: "s3", mars_future: "mars"}
+        pending = set(sources)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if hedged:
+                        HEDGED_FETCHES.labels(survey_id, sources[future]).inc()
+                    return future.result(), sources[future]
+
+        if hedged:
+            HEDGED_FETCHES.labels(survey_id, "none").inc()
+        # Errors other than a miss in S3 are not hidden by the MARS miss
+        error = s3_future.exception()
+        if not isinstance(error, FileNotFoundError):
+            raise error
+        raise FileNotFoundError
+
+
+hedged_fetcher = HedgedFetcher()
@@ -0,0 +1,62 @@
+import hashlib
+
+from flask import request, after_this_request, Response
+
+# Alert resources never change once they exist
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+# Surveys that filter_atlas_data can hide from some users, their responses
+# must not be stored by shared caches
+RESTRICTED_SURVEYS = ("atlas",)
+
+
+def resource_etag(*parts):
+    """
+    Strong ETag of a resource, derived only from what identifies it.
+
+    Parameters
+    ----------
+    parts : iterable
+        values identifying the resource, e.g. candid, type and format
+    """
+    key = "/".join(str(part) for part in parts)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def set_cache_headers(response, etag, survey_id, mutable=False):
+    response.set_etag(etag)
+    if mutable:
+        # Can be stored, but must be revalidated before every use
+        response.cache_control.no_cache = True
+    else:
+        # send_file asks for revalidation on every use
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    if survey_id in RESTRICTED_SURVEYS:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response
+
+
+def not_modified(etag, survey_id, mutable=False):
+    """
+    Returns a 304 response if the request has a matching If-None-Match.
+    """
+    if request.if_none_match.contains_weak(etag):
+        return set_cache_headers(Response(status=304), etag, survey_id, mutable)
+    return None
+
+
+def cache_response(etag, survey_id, mutable=False):
+    """
+    Adds the ETag and Cache-Control headers to the response of the request.
+    Mutable resources are revalidated with their ETag instead of cached for
+    CACHE_MAX_AGE.
+    """
+
+    @after_this_request
+    def add_headers(response):
+        if response.status_code == 200:
+            set_cache_headers(response, etag, survey_id, mutable)
+        return response
@@ -0,0 +1,169 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .metrics import CIRCUIT_BREAKER_REJECTIONS, CIRCUIT_BREAKER_STATE
+from .per_process import PerProcess
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a service that keeps failing"""
+
+
+class JitteredRetry(Retry):
+    """
+    Retry that waits a random time between 0 and the exponential backoff,
+    so the retries of many clients don't hit the service at once.
+    """
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+
+class CircuitBreaker:
+    """
+    Rejects calls to a service after `failures` consecutive calls failed.
+
+    After `reset_timeout` seconds a single call is let through: if it
+    succeeds the calls are allowed again, otherwise they are rejected for
+    another `reset_timeout` seconds.
+    """
+
+    def __init__(self, name, failures=5, reset_timeout=30):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failed = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+        CIRCUIT_BREAKER_STATE.labels(name).set(CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        CIRCUIT_BREAKER_STATE.labels(self.name).set(state)
+
+    def before_call(self):
+        """
+        Raises CircuitOpen if the call must not be made.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if (
+                self.state == OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout
+            ):
+                self._set_state(HALF_OPEN)
+                return
+        CIRCUIT_BREAKER_REJECTIONS.labels(self.name).inc()
+        raise CircuitOpen(f"{self.name} is unavailable")
+
+    def record(self, success):
+        with self._lock:
+            if success:
+                self._failed = 0
+                if self.state != CLOSED:
+                    self._set_state(CLOSED)
+                return
+            self._failed += 1
+            if self.state == HALF_OPEN or self._failed >= self.failures:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+class HTTPClient:
+    """
+    HTTP client of a service, with a pool of keep-alive connections, connect
+    and read timeouts, retries with jittered exponential backoff and a
+    circuit breaker.
+
+    Connection errors and 5xx answers, once retried, count as failures of
+    the service. Each process creates its own session.
+
+    Parameters
+    ----------
+    name : str
+        service name reported in the metrics
+    settings : dict
+        connect_timeout, read_timeout, retries, backoff, pool_size,
+        breaker_failures and breaker_reset
+    retry_methods : tuple of str
+        methods that can be retried, only idempotent ones
+    """
+
+    def __init__(self, name, settings=None, retry_methods=("GET",)):
+        settings = settings or {}
+        self.name = name
+        self.retry_methods = retry_methods
+        self.timeout = (
+            float(settings.get("connect_timeout") or 3),
+            float(settings.get("read_timeout") or 10),
+        )
+        self.retries = int(settings.get("retries") or 0)
+        self.backoff = float(settings.get("backoff") or 0.2)
+        self.pool_size = int(settings.get("pool_size") or 10)
+        self.breaker = CircuitBreaker(
+            name,
+            int(settings.get("breaker_failures") or 5),
+            float(settings.get("breaker_reset") or 30),
+        )
+        self._session = PerProcess(self._new_session)
+
+    def _new_session(self):
+        retry = JitteredRetry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=self.retry_methods,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, url, **kwargs):
+        """
+        Sends a GET request, like requests.get. See `request`.
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        Sends a POST request, like requests.post. See `request`.
+        """
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request, like requests.request.
+
+        Raises
+        ------
+        CircuitOpen
+            if the service failed too many times in a row
+        requests.RequestException
+            if the request failed after every retry
+        """
+        self.breaker.before_call()
+        try:
+            response = self._session.get().request(
+                method, url, timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException:
+            self.breaker.record(False)
+            raise
+        self.breaker.record(response.status_code < 500)
+        return response
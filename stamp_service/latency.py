@@ -0,0 +1,45 @@
+import math
+import threading
+from collections import defaultdict, deque
+
+from .metrics import FETCH_SECONDS
+
+
+class LatencyTracker:
+    """
+    Keeps the last `window` download times of a source per survey.
+
+    Parameters
+    ----------
+    source : str
+        where the avros are downloaded from, reported in the metrics
+    window : int
+        number of download times kept per survey
+    """
+
+    def __init__(self, source, window=1000):
+        self.source = source
+        self.window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def observe(self, survey_id, seconds):
+        FETCH_SECONDS.labels(self.source, survey_id).observe(seconds)
+        with self._lock:
+            self._samples[survey_id].append(seconds)
+
+    def percentile(self, survey_id, percent, min_samples=1):
+        """
+        Returns the `percent` percentile of the download times of a survey,
+        or None if fewer than `min_samples` were observed.
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(survey_id, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        rank = math.ceil(percent / 100 * len(samples))
+        return samples[min(max(rank, 1), len(samples)) - 1]
+
+
+s3_latencies = LatencyTracker("s3")
+mars_latencies = LatencyTracker("mars")
@@ -0,0 +1,161 @@
+"""
+Bloom filters of the objects in the S3 buckets.
+
+A filter answers that an object is certainly not in its bucket, or that it
+may be there. Filters are built offline from the bucket listing with
+
+    python -m stamp_service.membership --bucket <bucket> --capacity <n> \\
+        --output <path>
+
+and set as `membership_filter` of the survey in SURVEY_SETTINGS.
+"""
+
+import argparse
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+import boto3
+
+MAGIC = b"STMPBLM1"
+# magic, number of bits, number of hashes
+HEADER = struct.Struct("<8sQI4x")
+
+
+def _hashes(key):
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], "little")
+    # Odd, so the probes of a key don't repeat
+    second = int.from_bytes(digest[8:], "little") | 1
+    return first, second
+
+
+class BloomFilter:
+    """
+    Bloom filter of strings.
+
+    Loaded filters are mapped copy-on-write, so keys added afterwards only
+    live in the process that added them and the file is not modified.
+
+    Parameters
+    ----------
+    nbits : int
+        size of the filter in bits, rounded up to a multiple of 8
+    nhashes : int
+        number of bits set per key
+    bits : bytearray or mmap.mmap
+        filter bits, a new empty filter if None
+    """
+
+    def __init__(self, nbits, nhashes, bits=None):
+        self.nbits = -(-nbits // 8) * 8
+        self.nhashes = nhashes
+        self.bits = bytearray(self.nbits // 8) if bits is None else bits
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.001):
+        """
+        Returns an empty filter sized to hold `capacity` keys with a false
+        positive rate of `error_rate`.
+        """
+        nbits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        nhashes = max(1, round(nbits / capacity * math.log(2)))
+        return cls(nbits, nhashes)
+
+    def _positions(self, key):
+        first, second = _hashes(key)
+        for i in range(self.nhashes):
+            yield (first + i * second) % self.nbits
+
+    def add(self, key):
+        # Bits are set with a read-modify-write of their byte, concurrent
+        # adds to the same byte could undo each other
+        with self._lock:
+            for position in self._positions(key):
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def save(self, path):
+        """
+        Writes the filter to a file, replacing it atomically.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, self.nbits, self.nhashes))
+                f.write(self.bits)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Maps a filter written by `save` in memory.
+        """
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, nbits, nhashes = HEADER.unpack_from(data)
+        if magic != MAGIC or len(data) != HEADER.size + nbits // 8:
+            data.close()
+            raise ValueError(f"{path} is not a membership filter")
+        return cls(nbits, nhashes, memoryview(data)[HEADER.size :])
+
+
+def build(client, bucket, capacity, error_rate=0.001, prefix=""):
+    """
+    Returns a filter of the object keys of an S3 bucket.
+
+    Parameters
+    ----------
+    client : botocore.client.S3
+        S3 client
+    bucket : str
+        bucket name
+    capacity : int
+        expected number of objects, the false positive rate grows quickly
+        once it is exceeded
+    error_rate : float
+        false positive rate at capacity
+    prefix : str
+        only list the objects with this prefix
+    """
+    bloom = BloomFilter.for_capacity(capacity, error_rate)
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for s3_object in page.get("Contents", []):
+            bloom.add(s3_object["Key"])
+    return bloom
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Builds the membership filter of an S3 bucket"
+    )
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--capacity", type=int, required=True)
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+    bloom = build(
+        boto3.client("s3"), args.bucket, args.capacity, args.error_rate, args.prefix
+    )
+    bloom.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+CACHE_LOOKUPS = Counter(
+    "stamp_service_cache_lookups_total",
+    "Cache lookups by cache, tier and result (hit or miss)",
+    ["cache", "tier", "result"],
+)
+CACHE_EVICTIONS = Counter(
+    "stamp_service_cache_evictions_total",
+    "Entries evicted from a cache tier to stay under its size limit",
+    ["cache", "tier"],
+)
+CACHE_BYTES = Gauge(
+    "stamp_service_cache_bytes",
+    "Size of the values held by an in-memory cache",
+    ["cache"],
+    multiprocess_mode="livesum",
+)
+RENDER_QUEUE_DEPTH = Gauge(
+    "stamp_service_render_queue_depth",
+    "Renders submitted to the render executor that have not finished",
+    multiprocess_mode="livesum",
+)
+RENDER_WAIT_SECONDS = Histogram(
+    "stamp_service_render_wait_seconds",
+    "Time renders wait in the executor queue before they start",
+)
+RENDER_REJECTIONS = Counter(
+    "stamp_service_render_rejections_total",
+    "Renders answered with 503, because the queue was full or they timed out",
+    ["reason"],
+)
+WRITEBACK_QUEUE_DEPTH = Gauge(
+    "stamp_service_writeback_queue_depth",
+    "Avros from MARS queued or being uploaded to S3",
+    multiprocess_mode="livesum",
+)
+WRITEBACK_UPLOAD_SECONDS = Histogram(
+    "stamp_service_writeback_upload_seconds",
+    "Time to upload to S3 an avro found in MARS",
+)
+WRITEBACK_FAILURES = Counter(
+    "stamp_service_writeback_failures_total",
+    "Avros from MARS not uploaded to S3, because the queue was full, the "
+    "upload lock failed or the upload failed after every retry",
+    ["reason"],
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "stamp_service_singleflight_calls_total",
+    "Fetches that ran (leader) or waited for an identical fetch in flight " "(shared)",
+    ["name", "role"],
+)
+MEMBERSHIP_FILTER_LOOKUPS = Counter(
+    "stamp_service_membership_filter_lookups_total",
+    "S3 lookups checked against the membership filter of the bucket, by "
+    "result (absent or maybe)",
+    ["survey", "result"],
+)
+FETCH_SECONDS = Histogram(
+    "stamp_service_fetch_seconds",
+    "Time to download an avro, by source (s3 or mars) and survey",
+    ["source", "survey"],
+)
+HEDGED_FETCHES = Counter(
+    "stamp_service_hedged_fetches_total",
+    "Lookups where MARS was asked because S3 was slow, by the source that "
+    "answered first (s3, mars or none)",
+    ["survey", "winner"],
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "stamp_service_circuit_breaker_state",
+    "State of the circuit breaker of a service, 0 closed, 1 open and 2 half open",
+    ["name"],
+    multiprocess_mode="max",
+)
+CIRCUIT_BREAKER_REJECTIONS = Counter(
+    "stamp_service_circuit_breaker_rejections_total",
+    "Calls to a service rejected because its circuit breaker was open",
+    ["name"],
+)
+BATCH_SIZE = Histogram(
+    "stamp_service_batch_size",
+    "Keys looked up together by a batcher",
+    ["name"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+MARS_QUERIES = Counter(
+    "stamp_service_mars_queries_total",
+    "Queries sent to MARS, by kind (single, bulk or objects)",
+    ["kind"],
+)
@@ -0,0 +1,124 @@
+import threading
+
+import numpy as np
+
+MAD_FACTOR = 0.2
+
+_local = threading.local()
+
+
+def _scratch(shape, dtype):
+    """
+    Returns a buffer of the given shape, reused between calls of a thread.
+    """
+    size = int(np.prod(shape))
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None or buffer.dtype != dtype or buffer.size < size:
+        buffer = np.empty(size, dtype=dtype)
+        _local.buffer = buffer
+    return buffer[:size].reshape(shape)
+
+
+def _work_dtype(dtype):
+    """
+    Native dtype in which the thresholds of a stamp are computed, float64
+    for integer stamps so medians can be averaged and differences don't
+    overflow, like np.nanmedian does.
+    """
+    if np.issubdtype(dtype, np.floating):
+        return dtype.newbyteorder("=")
+    return np.dtype(np.float64)
+
+
+def _center(data, window):
+    x = data.shape[-2] // 2
+    y = data.shape[-1] // 2
+    return data[..., x - window : x + window, y - window : y + window]
+
+
+def _median_inplace(values):
+    """
+    Median along the last axis, partially sorting values in place.
+
+    Gives the same result as np.median, averaging the two middle values
+    when the length is even.
+    """
+    n = values.shape[-1]
+    half = n // 2
+    if n % 2:
+        values.partition(half)
+        return values[..., half].copy()
+    values.partition([half - 1, half])
+    return (values[..., half - 1] + values[..., half]) / 2
+
+
+def _min_plus_mad(values):
+    """
+    min + MAD_FACTOR * median(|values - median|) along the last axis,
+    overwriting values.
+    """
+    min_val = values.min(axis=-1)
+    median = _median_inplace(values)
+    if values.ndim > 1:
+        median = median[:, np.newaxis]
+    np.subtract(values, median, out=values)
+    np.abs(values, out=values)
+    return min_val + MAD_FACTOR * _median_inplace(values)
+
+
+def _valid_values(data):
+    """
+    Copies the non NaN values of data to the scratch buffer.
+    """
+    flat = data.ravel()
+    dtype = _work_dtype(flat.dtype)
+    nan_mask = np.isnan(flat)
+    if not nan_mask.any():
+        values = _scratch(flat.shape, dtype)
+        values[:] = flat
+        return values
+    values = _scratch((flat.size - np.count_nonzero(nan_mask),), dtype)
+    np.compress(~nan_mask, flat, out=values)
+    return values
+
+
+def get_limits(data, window):
+    """
+    Returns the thresholds used to scale a stamp.
+
+    The max is the maximum inside a window of `window` pixels around the
+    center. The min is the minimum of the stamp plus MAD_FACTOR times the
+    median absolute deviation from the median. NaN values are ignored.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        2D stamp
+    window : int
+        half size of the center window
+    """
+    max_val = np.nanmax(_center(data, window))
+    values = _valid_values(data)
+    if values.size == 0:
+        return max_val, np.nan
+    return max_val, _min_plus_mad(values)
+
+
+def get_limits_batch(stack, window):
+    """
+    Same as get_limits for a stack of stamps of the same shape.
+
+    Returns arrays with the max and min of each stamp.
+    """
+    max_val = np.nanmax(_center(stack, window), axis=(1, 2))
+    flat = stack.reshape(len(stack), -1)
+    if not np.isnan(flat).any():
+        values = _scratch(flat.shape, _work_dtype(flat.dtype))
+        values[:] = flat
+        return max_val, _min_plus_mad(values)
+
+    min_val = []
+    for data in stack:
+        values = _valid_values(data)
+        min_val.append(_min_plus_mad(values) if values.size else np.nan)
+    return max_val, np.array(min_val)
@@ -0,0 +1,39 @@
+import os
+import threading
+
+
+class PerProcess:
+    """
+    Value created by `factory` on first use in every process.
+
+    Thread pools, sessions and threads don't survive a fork, so with
+    gunicorn each worker creates its own after the fork instead of using
+    the one of the master.
+
+    Parameters
+    ----------
+    factory : callable
+        called without arguments to create the value of a process
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        The value of this process, created if it doesn't exist.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._value = self._factory()
+                self._pid = os.getpid()
+            return self._value
+
+    def peek(self):
+        """
+        The value of this process, or None if it wasn't created.
+        """
+        return self._value if self._pid == os.getpid() else None
@@ -0,0 +1,56 @@
+import struct
+import zlib
+
+import numpy as np
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_GRAY = 0
+_GRAY_ALPHA = 4
+
+
+def _chunk(tag, data):
+    return (
+        struct.pack(">I", len(data))
+        + tag
+        + data
+        + struct.pack(">I", zlib.crc32(tag + data))
+    )
+
+
+def encode(gray, alpha=None, level=6):
+    """
+    Encodes an 8 bit grayscale image as PNG.
+
+    Parameters
+    ----------
+    gray : numpy.ndarray
+        2D uint8 array with the gray level of each pixel, first row on top
+    alpha : numpy.ndarray, optional
+        2D uint8 array with the opacity of each pixel. If not given the
+        image is written without an alpha channel
+    level : int
+        zlib compression level
+    """
+    height, width = gray.shape
+    if alpha is None:
+        color_type, channels = _GRAY, 1
+    else:
+        color_type, channels = _GRAY_ALPHA, 2
+
+    # Each scanline is prefixed with its filter type, 0 means no filter
+    raw = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    if alpha is None:
+        raw[:, 1:] = gray
+    else:
+        raw[:, 1::2] = gray
+        raw[:, 2::2] = alpha
+
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return b"".join(
+        [
+            _SIGNATURE,
+            _chunk(b"IHDR", header),
+            _chunk(b"IDAT", zlib.compress(raw.tobytes(), level)),
+            _chunk(b"IEND", b""),
+        ]
+    )
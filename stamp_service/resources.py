@@ -1,28 +1,34 @@
 import io
 
-from flask_restx import Resource, reqparse, Api
-from werkzeug.exceptions import NotFound
+from flask_restx import Resource, reqparse, inputs, Api
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound
 from werkzeug.datastructures import FileStorage
-from . import utils
+from . import utils, avro_reader, http_cache, alerts, fits2png
 from .search import s3_searcher, mars_searcher
+from .cache import stamp_cache
+from .alerts import alert_cache
+from .writeback import s3_writeback
+from .hedging import MARS_SURVEYS, hedged_fetcher
+from .batch import batch_executor, stream_zip
 from flask import current_app as app
-from flask import send_file, jsonify
+from flask import send_file, jsonify, Response
 from ralidator_flask.decorators import (
     set_permissions_decorator,
     check_permissions_decorator,
 )
-from .filters import filter_atlas_data
+from .filters import filter_atlas_data, is_filtered
 
-import fastavro
+# Alert ids name files in S3 and in the caches, so they must be only digits
+candid_type = inputs.regex(r"^[0-9]+\Z")
 
 stamp_parser = reqparse.RequestParser()
 stamp_parser.add_argument("oid", type=str, help="Object ID", default=None)
-stamp_parser.add_argument("candid", type=str, help="Alert id", required=True)
+stamp_parser.add_argument("candid", type=candid_type, help="Alert id", required=True)
 stamp_parser.add_argument(
     "type",
     type=str,
-    help="Stamp type",
-    choices=["science", "template", "difference"],
+    help="Stamp type, 'all' returns every cutout of the alert as base64 in JSON",
+    choices=["science", "template", "difference", "all"],
     required=True,
 )
 stamp_parser.add_argument(
@@ -42,7 +48,7 @@ stamp_parser.add_argument(
 
 avro_parser = reqparse.RequestParser()
 avro_parser.add_argument("oid", type=str, help="Object ID", default=None)
-avro_parser.add_argument("candid", type=str, help="Alert id", required=True)
+avro_parser.add_argument("candid", type=candid_type, help="Alert id", required=True)
 avro_parser.add_argument(
     "survey_id",
     type=str,
@@ -51,9 +57,57 @@ avro_parser.add_argument(
     default="ztf",
 )
 
+stamps_parser = reqparse.RequestParser()
+stamps_parser.add_argument("oid", type=str, help="Object ID", default=None)
+stamps_parser.add_argument(
+    "candids",
+    type=candid_type,
+    help="Comma separated alert ids",
+    action="split",
+    required=True,
+)
+stamps_parser.add_argument(
+    "type",
+    type=str,
+    help="Stamp type, 'all' returns every cutout of the alerts",
+    choices=["science", "template", "difference", "all"],
+    default="all",
+)
+stamps_parser.add_argument(
+    "format",
+    type=str,
+    help="Stamp type",
+    choices=["png", "fits"],
+    required=True,
+)
+stamps_parser.add_argument(
+    "survey_id",
+    type=str,
+    help="Survey ID",
+    choices=["ztf", "atlas"],
+    default="ztf",
+)
+
+object_stamps_parser = reqparse.RequestParser()
+object_stamps_parser.add_argument("oid", type=str, help="Object ID", required=True)
+object_stamps_parser.add_argument(
+    "format",
+    type=str,
+    help="Stamp type",
+    choices=["png", "fits"],
+    required=True,
+)
+object_stamps_parser.add_argument(
+    "survey_id",
+    type=str,
+    help="Survey ID, only surveys with alerts in MARS",
+    choices=list(MARS_SURVEYS),
+    default="ztf",
+)
+
 upload_parser = reqparse.RequestParser()
 upload_parser.add_argument(
-    "candid", type=str, help="Alert id", location="form", required=True
+    "candid", type=candid_type, help="Alert id", location="form", required=True
 )
 upload_parser.add_argument("avro", location="files", type=FileStorage, required=True)
 upload_parser.add_argument(
@@ -64,6 +118,148 @@ upload_parser.add_argument(
     required=True,
 )
 
+# Size of the chunks streamed from S3 by /get_avro
+AVRO_CHUNK_SIZE = 64 * 1024
+# Prefix of the stamp bundles of objects in the S3 buckets
+BUNDLE_PREFIX = "bundles"
+
+
+def read_alert(avro_io, candid, survey_id, cutouts):
+    """
+    Decodes the requested cutouts of an alert. With the decoded alerts
+    cache enabled the whole alert is decoded and cached.
+    """
+    if not alert_cache.enabled:
+        return avro_reader.read_alert(avro_io, cutouts)
+    alert = alert_cache.add(survey_id, candid, avro_io.getvalue())
+    return alerts.project(alert.record, cutouts)
+
+
+def fetch_hedged(candid, survey_id, oid, avro_url=None):
+    """
+    Downloads an alert from S3 or MARS, whichever answers first, and
+    uploads it to S3 if it came from MARS.
+    """
+    try:
+        avro_io, source = hedged_fetcher.fetch(candid, survey_id, oid, avro_url)
+    except FileNotFoundError:
+        app.logger.info(f"[MISS] AVRO {candid} not found in S3 or MARS.")
+        raise NotFound("AVRO not found")
+    app.logger.info(f"[HIT] AVRO {candid} found in {source.upper()}.")
+    if source == "mars":
+        s3_writeback.submit(avro_io.getvalue(), candid, survey_id)
+    return avro_io
+
+
+def fetch_alert(candid, survey_id, oid, cutouts, avro_url=None):
+    """
+    Searches an alert in the decoded alerts cache, S3 and MARS, uploading
+    it to S3 if it came from MARS, and decodes the requested cutouts. The
+    avro is downloaded from `avro_url` instead of asking MARS for it if
+    the URL is known.
+
+    Raises
+    ------
+    werkzeug.exceptions.NotFound
+        if the alert is not found
+    """
+    alert = alert_cache.get(survey_id, candid)
+    if alert is not None:
+        app.logger.info(f"[HIT] AVRO {candid} found in cache.")
+        return alerts.project(alert.record, cutouts)
+    # Search in S3 and MARS at once if S3 is slow
+    if hedged_fetcher.hedges(survey_id):
+        avro_io = fetch_hedged(candid, survey_id, oid, avro_url)
+        return read_alert(avro_io, candid, survey_id, cutouts)
+
+    try:
+        avro_io = s3_searcher.get_file_from_s3(candid, survey_id)
+    except FileNotFoundError:
+        app.logger.info(f"[MISS] AVRO {candid} not found in S3.")
+    else:
+        app.logger.info(f"[HIT] AVRO {candid} found in S3.")
+        return read_alert(avro_io, candid, survey_id, cutouts)
+    if survey_id not in MARS_SURVEYS:
+        raise NotFound("AVRO not found")
+
+    try:
+        avro_io = mars_searcher.get_file_from_mars(oid, int(candid), avro_url)
+    except Exception as e:
+        app.logger.info(f"[MISS] AVRO {candid} could not be retrieved from MARS.")
+        app.logger.error(f"Error: {e}")
+        raise NotFound("AVRO not found")
+    app.logger.info(f"[HIT] AVRO {candid} found in MARS. Uploading from MARS to S3")
+    s3_writeback.submit(avro_io.getvalue(), candid, survey_id)
+    return read_alert(avro_io, candid, survey_id, cutouts)
+
+
+def stamp_files(candid, survey_id, stypes, format, oid=None, avro_url=None):
+    """
+    Returns the file names and files of some stamps of an alert, from the
+    rendered stamps cache or rendered together.
+    """
+    renderer = app.config["PNG_RENDERER"]
+    stamps = {}
+    if stamp_cache.enabled:
+        for stype in stypes:
+            key = utils.stamp_cache_key(survey_id, candid, stype, format, renderer)
+            stamp = stamp_cache.get(key)
+            if stamp is not None:
+                stamps[stype] = stamp
+
+    missing = [stype for stype in stypes if stype not in stamps]
+    if missing:
+        cutouts = tuple(utils.STAMP_KEYS[stype] for stype in missing)
+        data = fetch_alert(candid, survey_id, oid, cutouts, avro_url)
+        # Rendering the cutouts together gives the same stamps as
+        # rendering them one by one, so they can be cached
+        for stype, stamp in utils.render_stamps(data, format, missing, renderer):
+            stamps[stype] = stamp
+            if stamp_cache.enabled:
+                key = utils.stamp_cache_key(survey_id, candid, stype, format, renderer)
+                stamp_cache.set(key, stamp)
+
+    files = []
+    for stype in stypes:
+        if stype in stamps:
+            _, fname = utils.stamp_file_info(format, oid, candid, stype)
+            files.append((fname, stamps[stype]))
+    return files
+
+
+def batch_item(candid, survey_id, stypes, format, oid=None, avro_url=None):
+    """
+    Returns the manifest entry and the files of the stamps of an alert.
+    Errors are reported in the manifest entry instead of raised.
+    """
+    try:
+        files = stamp_files(candid, survey_id, stypes, format, oid, avro_url)
+    except HTTPException as e:
+        return {"candid": candid, "status": e.code, "error": e.description}, []
+    except Exception as e:
+        app.logger.error(f"Stamps of AVRO {candid} failed: {e}")
+        return {"candid": candid, "status": 500, "error": "Internal error"}, []
+    entry = {"candid": candid, "status": 200, "files": [name for name, _ in files]}
+    return entry, files
+
+
+def batch_stamps(candids, survey_id, stypes, format, oid=None, avro_urls=None):
+    """
+    Yields the batch_item of every candid as they are ready, searching and
+    rendering the alerts concurrently. `avro_urls` has the MARS URLs of
+    the avros by candid, if they are known.
+    """
+    application = app._get_current_object()
+    avro_urls = avro_urls or {}
+
+    def get_item(candid):
+        with application.app_context():
+            avro_url = avro_urls.get(candid)
+            return batch_item(candid, survey_id, stypes, format, oid, avro_url)
+
+    return batch_executor.map_unordered(get_item, candids)
+
+
 api = Api(
     version="1.0.0",
     title="ALeRCE AVRO Service",
@@ -86,6 +282,17 @@ class StampResource(Resource):
         format = args["format"]
         oid = args["oid"]
 
+        etag = http_cache.resource_etag(
+            "stamp",
+            oid,
+            utils.stamp_cache_key(
+                survey_id, candid, file_type, format, app.config["PNG_RENDERER"]
+            ),
+        )
+        response = http_cache.not_modified(etag, survey_id)
+        if response is not None:
+            return response
+
         stamp_params = self.get_stamp(
             candid=candid,
             survey_id=survey_id,
@@ -94,6 +301,9 @@ class StampResource(Resource):
             oid=oid,
         )
         if stamp_params:
+            http_cache.cache_response(etag, survey_id)
+            if file_type == "all":
+                return jsonify(stamp_params)
             return send_file(
                 stamp_params["file"],
                 mimetype=stamp_params["mimetype"],
@@ -101,58 +311,49 @@ class StampResource(Resource):
                 as_attachment=stamp_params["as_attachment"],
             )
 
+    def format_avro(self, avro, file_type, format, oid, candid, cache_key=None):
+        renderer = app.config["PNG_RENDERER"]
+        if file_type == "all":
+            return utils.format_stamps(avro, format, oid, candid, renderer)
+        data = utils.get_stamp_type(avro, file_type)
+        stamp_file, mimetype, fname = utils.format_stamp(
+            data, format, oid, candid, file_type, renderer
+        )
+        if cache_key:
+            stamp_cache.set(cache_key, stamp_file.getvalue())
+        return {
+            "file": stamp_file,
+            "mimetype": mimetype,
+            "download_name": fname,
+            "as_attachment": True,
+        }
+
     def get_stamp(self, candid, survey_id, file_type, format, oid=None):
-        # Search in s3
-        try:
-            data = s3_searcher.get_file_from_s3(candid, survey_id)
-            data = next(fastavro.reader(data))
-            data = utils.get_stamp_type(data, file_type)
-            stamp_file, mimetype, fname = utils.format_stamp(
-                data, format, oid, candid, file_type
+        # Search in the rendered stamps cache
+        cache_key = None
+        if file_type != "all" and stamp_cache.enabled:
+            cache_key = utils.stamp_cache_key(
+                survey_id, candid, file_type, format, app.config["PNG_RENDERER"]
             )
-            app.logger.info(f"[HIT] AVRO {candid} found in S3.")
-            return {
-                "file": stamp_file,
-                "mimetype": mimetype,
-                "download_name": fname,
-                "as_attachment": True,
-            }
-        except FileNotFoundError:
-            app.logger.info(f"[MISS] AVRO {candid} not found in S3.")
-
-        if survey_id == "ztf":
-            # Search in MARS
-            try:
-                avro_io = mars_searcher.get_file_from_mars(oid, int(candid))
-                data = next(fastavro.reader(avro_io))
-                stamp_data = utils.get_stamp_type(data, file_type)
-            except Exception as e:
-                app.logger.info(
-                    f"[MISS] AVRO {candid} could not be retrieved from MARS."
-                )
-                raise NotFound("AVRO not found")
-
-            # Upload to S3 from MARS
-            try:
-                avro_io.seek(0)
-                app.logger.info(
-                    f"[HIT] AVRO {candid} found in MARS. Uploading from MARS to S3"
-                )
-                reverse_candid = utils.reverse_candid(candid)
-                file_name = "{}.avro".format(reverse_candid)
-                s3_searcher.upload_file(avro_io, file_name, survey_id)
-                stamp_file, mimetype, fname = utils.format_stamp(
-                    stamp_data, format, oid, candid, file_type
-                )
+            stamp = stamp_cache.get(cache_key)
+            if stamp is not None:
+                app.logger.info(f"[HIT] Stamp {candid} found in cache.")
+                mimetype, fname = utils.stamp_file_info(format, oid, candid, file_type)
                 return {
-                    "file": stamp_file,
+                    "file": io.BytesIO(stamp),
                     "mimetype": mimetype,
                     "download_name": fname,
                     "as_attachment": True,
                 }
-            except Exception as e:
-                app.logger.info("Could not upload file to S3")
-                raise e
+
+        # Only decode the requested cutouts
+        if file_type == "all":
+            cutouts = avro_reader.CUTOUT_FIELDS
+        else:
+            cutouts = (utils.STAMP_KEYS[file_type],)
+
+        data = fetch_alert(candid, survey_id, oid, cutouts)
+        return self.format_avro(data, file_type, format, oid, candid, cache_key)
 
 
 @api.route("/get_avro_info")
@@ -168,49 +369,27 @@ class GetAVROInfoResource(Resource):
         survey_id = args["survey_id"]
         oid = args["oid"]
 
+        etag = http_cache.resource_etag("avro_info", survey_id, candid, oid)
+        # Users that can't see the avro must not learn that it exists
+        if not is_filtered("filter_atlas_avro", survey_id):
+            response = http_cache.not_modified(etag, survey_id)
+            if response is not None:
+                return response
+
         avro_data = self.get_avro(candid=candid, survey_id=survey_id, oid=oid)
 
         if avro_data:
+            http_cache.cache_response(etag, survey_id)
             return avro_data
 
+    def format_info(self, data):
+        # The decoded record can be shared with the alerts cache
+        candidate = dict(data["candidate"], candid=str(data["candidate"]["candid"]))
+        return jsonify(dict(data, candidate=candidate))
+
     @filter_atlas_data(filter_name="filter_atlas_avro", arg_key="survey_id")
     def get_avro(self, candid, survey_id, oid=None):
-        try:
-            data = s3_searcher.get_file_from_s3(candid, survey_id)
-            data = next(fastavro.reader(data))
-            if survey_id == "ztf":
-                del data["cutoutTemplate"]
-            del data["cutoutScience"]
-            del data["cutoutDifference"]
-            app.logger.info(f"[HIT] AVRO {candid} found in S3.")
-            data["candidate"]["candid"] = str(data["candidate"]["candid"])
-            return jsonify(data)
-        except FileNotFoundError:
-            app.logger.info(f"[MISS] AVRO {candid} not found in S3.")
-
-        if survey_id == "ztf":
-            try:
-                avro_io = mars_searcher.get_file_from_mars(oid, int(candid))
-                data = next(fastavro.reader(avro_io))
-                del data["cutoutScience"]
-                del data["cutoutTemplate"]
-                del data["cutoutDifference"]
-            except Exception as e:
-                app.logger.info(
-                    f"[MISS] AVRO {candid} could not be retrieved from MARS."
-                )
-                app.logger.error(f"Error: {e}")
-                raise NotFound("AVRO not found")
-            try:
-                avro_io.seek(0)
-                app.logger.info("Uploading Avro from MARS to S3")
-                reverse_candid = utils.reverse_candid(candid)
-                file_name = "{}.avro".format(reverse_candid)
-                s3_searcher.upload_file(avro_io, file_name, survey_id)
-                data["candidate"]["candid"] = str(data["candidate"]["candid"])
-                return jsonify(data)
-            except Exception as e:
-                raise e
+        return self.format_info(fetch_alert(candid, survey_id, oid, cutouts=()))
 
 
 @api.route("/get_avro")
@@ -227,8 +406,22 @@ class GetAVROResource(Resource):
         survey_id = args["survey_id"]
         oid = args["oid"]
 
+        etag = http_cache.resource_etag("avro", survey_id, candid, oid)
+        # Users that can't see the avro must not learn that it exists
+        if not is_filtered("filter_atlas_avro", survey_id):
+            response = http_cache.not_modified(etag, survey_id)
+            if response is not None:
+                return response
+
         avro_params = self.get_avro(candid=candid, survey_id=survey_id, oid=oid)
         if avro_params:
+            http_cache.cache_response(etag, survey_id)
+            if "stream" in avro_params:
+                return self.stream_avro(
+                    avro_params["stream"],
+                    mimetype=avro_params["mimetype"],
+                    download_name=avro_params["download_name"],
+                )
             return send_file(
                 avro_params["file"],
                 mimetype=avro_params["mimetype"],
@@ -236,12 +429,53 @@ class GetAVROResource(Resource):
                 as_attachment=avro_params["as_attachment"],
             )
 
+    def stream_avro(self, s3_object, mimetype, download_name):
+        """
+        Sends an avro from S3 as it is read, without holding it in memory.
+        """
+        body = s3_object.body
+
+        def chunks():
+            try:
+                yield from body.iter_chunks(AVRO_CHUNK_SIZE)
+            finally:
+                body.close()
+
+        response = Response(chunks(), mimetype=mimetype, direct_passthrough=True)
+        # Release the connection if the response is never iterated
+        response.call_on_close(body.close)
+        response.content_length = s3_object.content_length
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=download_name
+        )
+        return response
+
     @filter_atlas_data(filter_name="filter_atlas_avro", arg_key="survey_id")
     def get_avro(self, candid, survey_id, oid=None):
+        fname = f"{candid}.avro"
+        alert = alert_cache.get(survey_id, candid)
+        if alert is not None:
+            app.logger.info(f"[HIT] AVRO {candid} found in cache")
+            return {
+                "file": io.BytesIO(alert.raw),
+                "mimetype": "app/avro+binary",
+                "download_name": fname,
+                "as_attachment": True,
+            }
+
         try:
+            if app.config["STREAM_AVRO"]:
+                s3_object = s3_searcher.open_file_from_s3(candid, survey_id)
+                app.logger.info(f"[HIT] AVRO {candid} found in S3")
+                return {
+                    "stream": s3_object,
+                    "mimetype": "app/avro+binary",
+                    "download_name": fname,
+                }
             data = s3_searcher.get_file_from_s3(candid, survey_id)
-            fname = f"{candid}.avro"
             app.logger.info(f"[HIT] AVRO {candid} found in S3")
+            if alert_cache.enabled:
+                alert_cache.add(survey_id, candid, data.getvalue())
             return {
                 "file": data,
                 "mimetype": "app/avro+binary",
@@ -254,24 +488,148 @@ class GetAVROResource(Resource):
         if survey_id == "ztf":
             try:
                 avro_io = mars_searcher.get_file_from_mars(oid, int(candid))
-                output = io.BytesIO(avro_io.read())
+                avro = avro_io.read()
                 app.logger.info(f"[HIT] AVRO {candid} found in MARS")
             except Exception as e:
                 app.logger.info("File could not be retreived from MARS.")
                 app.logger.error(f"Error: {e}")
                 raise NotFound("AVRO not found")
+            app.logger.info("Uploading Avro from MARS to S3")
+            s3_writeback.submit(avro, candid, survey_id)
+            if alert_cache.enabled:
+                alert_cache.add(survey_id, candid, avro)
+            file_name = f"{candid}.avro"
+            return {
+                "file": io.BytesIO(avro),
+                "mimetype": "app/avro+binary",
+                "download_name": file_name,
+                "as_attachment": True,
+            }
+
+
+@api.route("/get_stamps")
+@api.response(200, "Success")
+@api.response(400, "Too many candids")
+class StampsResource(Resource):
+    @api.expect(stamps_parser, validate=True)
+    @set_permissions_decorator(["admin", "basic_user"])
+    @check_permissions_decorator
+    def get(self):
+        """
+        Returns a zip file with the stamps of several alerts.
+
+        Alerts are searched and rendered concurrently. The zip file ends
+        with a manifest.json that lists, for every candid, the files of its
+        stamps or the error that stopped them.
+        """
+        args = stamps_parser.parse_args()
+        candids = list(dict.fromkeys(args["candids"]))
+        if not candids:
+            raise BadRequest("No candids")
+        if len(candids) > batch_executor.max_items:
+            raise BadRequest(f"At most {batch_executor.max_items} candids")
+        if args["type"] == "all":
+            stypes = list(utils.STAMP_KEYS)
+        else:
+            stypes = [args["type"]]
+
+        results = batch_stamps(
+            candids, args["survey_id"], stypes, args["format"], args["oid"]
+        )
+        response = Response(stream_zip(results), mimetype="application/zip")
+        response.call_on_close(results.close)
+        response.headers.set("Content-Disposition", "attachment", filename="stamps.zip")
+        return response
+
+
+@api.route("/get_object_stamps")
+@api.response(200, "Success")
+@api.response(404, "Object not found")
+class ObjectStampsResource(Resource):
+    @api.expect(object_stamps_parser, validate=True)
+    @set_permissions_decorator(["admin", "basic_user"])
+    @check_permissions_decorator
+    def get(self):
+        """
+        Returns a zip file with every stamp of an object.
+
+        The candids of the object are listed in MARS. The zip file is
+        built like in /get_stamps and stored in S3, under the object and
+        its candids, so it is built again when the object has new alerts.
+        Zip files with missing alerts are neither stored nor cached.
+        """
+        args = object_stamps_parser.parse_args()
+        oid = args["oid"]
+        survey_id = args["survey_id"]
+        format = args["format"]
+
+        try:
+            avro_urls = {
+                str(candid): url
+                for candid, url in mars_searcher.get_avro_urls(oid).items()
+            }
+        except Exception as e:
+            app.logger.error(f"Candids of {oid} could not be retrieved from MARS: {e}")
+            raise NotFound("Object not found")
+        candids = list(avro_urls)
+        if not candids:
+            raise NotFound("Object not found")
+        if len(candids) > batch_executor.max_object_items:
+            raise BadRequest(
+                f"{oid} has more than {batch_executor.max_object_items} alerts"
+            )
+
+        etag = http_cache.resource_etag(
+            "object_stamps",
+            survey_id,
+            oid,
+            format,
+            app.config["PNG_RENDERER"],
+            fits2png.RENDERER_VERSION,
+            ",".join(candids),
+        )
+        response = http_cache.not_modified(etag, survey_id, mutable=True)
+        if response is not None:
+            return response
+
+        bundle, complete = self.get_bundle(oid, avro_urls, survey_id, format, etag)
+        # The alerts that are missing may be found on the next request
+        if complete:
+            http_cache.cache_response(etag, survey_id, mutable=True)
+        response = Response(bundle, mimetype="application/zip")
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=f"{oid}_stamps.zip"
+        )
+        return response
+
+    def get_bundle(self, oid, avro_urls, survey_id, format, etag):
+        """
+        Returns the zip file with the stamps of the alerts of an object,
+        given the avro URLs of the alerts by candid, and whether it has
+        every alert.
+        """
+        object_name = f"{BUNDLE_PREFIX}/{oid}/{etag}.zip"
+        try:
+            bundle = s3_searcher.read_file(object_name, survey_id)
+            app.logger.info(f"[HIT] Stamps of {oid} found in S3.")
+            return bundle, True
+        except FileNotFoundError:
+            app.logger.info(f"[MISS] Stamps of {oid} not found in S3.")
+
+        stypes = list(utils.STAMP_KEYS)
+        results = list(
+            batch_stamps(list(avro_urls), survey_id, stypes, format, oid, avro_urls)
+        )
+        bundle = b"".join(stream_zip(results))
+        # Bundles with missing alerts are built again on the next request
+        complete = all(entry["status"] == 200 for entry, _ in results)
+        if complete:
+            s3_writeback.submit_object(bundle, object_name, survey_id)
+            # Bundles of older candid lists are never read again
             try:
-                avro_io.seek(0)
-                app.logger.info("Uploading Avro from MARS to S3")
-                reverse_candid = utils.reverse_candid(candid)
-                file_name = "{}.avro".format(reverse_candid)
-                s3_searcher.upload_file(avro_io, file_name, survey_id)
-                file_name = f"{candid}.avro"
-                return {
-                    "file": output,
-                    "mimetype": "app/avro+binary",
-                    "download_name": file_name,
-                    "as_attachment": True,
-                }
+                s3_searcher.delete_files(
+                    f"{BUNDLE_PREFIX}/{oid}/", survey_id, keep=(object_name,)
+                )
             except Exception as e:
-                raise e
+                app.logger.warning(f"Old stamps of {oid} could not be deleted: {e}")
+        return bundle, complete
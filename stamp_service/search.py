@@ -1,35 +1,372 @@
-import requests
 from . import utils
 import io
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple, OrderedDict
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from urllib.request import urlopen
+from .batching import Batcher
+from .cache import DiskCache
+from .http_client import HTTPClient
+from .shm_cache import SharedMemoryCache
+from .latency import mars_latencies, s3_latencies
+from .membership import BloomFilter
+from .per_process import PerProcess
+from .metrics import (
+    CACHE_EVICTIONS,
+    CACHE_LOOKUPS,
+    MARS_QUERIES,
+    MEMBERSHIP_FILTER_LOOKUPS,
+)
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Surveys whose avros can also be found in MARS
+MARS_SURVEYS = ("ztf",)
+
+# Avro in S3 opened for streaming, body is a botocore StreamingBody
+S3Object = namedtuple("S3Object", ["body", "content_length", "etag"])
+
+
+class NegativeCache:
+    """
+    Remembers for `ttl` seconds the keys that were not found.
+
+    Holds at most `max_entries` keys, dropping the ones that expire first.
+    A ttl of 0 disables it.
+    """
+
+    def __init__(self, name, ttl=0, max_entries=100000):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._expires = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._expires)
+
+    def __contains__(self, key):
+        if not self.ttl:
+            return False
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is not None and expires <= time.monotonic():
+                del self._expires[key]
+                expires = None
+        result = "miss" if expires is None else "hit"
+        CACHE_LOOKUPS.labels(self.name, "memory", result).inc()
+        return expires is not None
+
+    def add(self, key):
+        if not self.ttl:
+            return
+        evicted = 0
+        with self._lock:
+            # Every key has the same ttl, so the first key expires first
+            self._expires.pop(key, None)
+            self._expires[key] = time.monotonic() + self.ttl
+            while len(self._expires) > self.max_entries:
+                self._expires.popitem(last=False)
+                evicted += 1
+        if evicted:
+            CACHE_EVICTIONS.labels(self.name, "memory").inc(evicted)
+
+    def discard(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+
+
+class AvroDiskCache(DiskCache):
+    """
+    Disk cache of avro files by (survey_id, candid), shared by the workers
+    of a node.
+
+    Files are stored like in S3, under their reversed candid, followed by a
+    trailer with their length and CRC32. Reads check the avro against the
+    trailer, files that don't match it are removed.
+    """
+
+    TRAILER = struct.Struct("<QI")
+
+    def __init__(self, directory, max_bytes, check_every=100):
+        super().__init__("raw_avros", directory, max_bytes, check_every)
+        self._realdir = os.path.realpath(self.directory)
+
+    def _path(self, key):
+        survey_id, candid = key
+        reverse_candid = utils.reverse_candid(candid)
+        path = os.path.join(
+            self.directory, survey_id, reverse_candid[:2], f"{reverse_candid}.avro"
+        )
+        # Invalid files are removed, so they must never be outside the cache
+        real_path = os.path.realpath(path)
+        if os.path.commonpath([self._realdir, real_path]) != self._realdir:
+            raise ValueError(f"Invalid avro cache key {key}")
+        return path
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size - self.TRAILER.size
+            if size < 0:
+                return None
+            trailer = os.pread(f.fileno(), self.TRAILER.size, size)
+            if len(trailer) != self.TRAILER.size:
+                return None
+            length, checksum = self.TRAILER.unpack(trailer)
+            # Read the avro alone, the one copy callers get
+            data = f.read(size)
+            if length != size or len(data) != size or zlib.crc32(data) != checksum:
+                return None
+            return data
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            value = self._read(path)
+            if value is None:
+                os.remove(path)
+            else:
+                os.utime(path)
+        except FileNotFoundError:
+            value = None
+        result = "miss" if value is None else "hit"
+        CACHE_LOOKUPS.labels(self.name, "disk", result).inc()
+        return value
+
+    def set(self, key, value):
+        trailer = self.TRAILER.pack(len(value), zlib.crc32(value))
+        super().set(key, value + trailer)
+
+
+class CachedBody:
+    """
+    Avro read from the disk cache, with the StreamingBody methods used to
+    stream it.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start : start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def client_config(settings=None):
+    """Config of an S3 client
+
+    :param settings: max_pool_connections, connect_timeout, read_timeout,
+        max_attempts, retry_mode and tcp_keepalive of the client,
+        tcp_keepalive is ignored by botocore versions without it
+    """
+    settings = settings or {}
+    options = dict(
+        max_pool_connections=int(settings.get("max_pool_connections") or 32),
+        connect_timeout=float(settings.get("connect_timeout") or 3),
+        read_timeout=float(settings.get("read_timeout") or 10),
+        retries={
+            "max_attempts": int(settings.get("max_attempts") or 3),
+            "mode": settings.get("retry_mode") or "adaptive",
+        },
+    )
+    if "tcp_keepalive" in Config.OPTION_DEFAULTS:
+        options["tcp_keepalive"] = bool(settings.get("tcp_keepalive", True))
+    return Config(**options)
 
 
 class S3Searcher:
-    def init(self, bucket_config, client=None):
-        self.client = client or boto3.client("s3")
+    def init(
+        self,
+        bucket_config,
+        client=None,
+        miss_ttl=0,
+        disk_cache=None,
+        shared_cache=None,
+    ):
+        # Used for every survey instead of the clients of the settings
+        self.client = client
         self.buckets_dict = bucket_config
+        # Clients by survey, of every process
+        self._clients = PerProcess(dict)
+        self._clients_lock = threading.Lock()
+        # Objects certainly not in the bucket are not requested. Only for
+        # surveys in MARS, as avros written to the bucket after the filter
+        # was built are not found until it is rebuilt
+        self.filters = {}
+        for survey_id, settings in bucket_config.items():
+            if not settings.get("membership_filter"):
+                continue
+            if survey_id not in MARS_SURVEYS:
+                logger.warning(
+                    f"Ignoring the membership filter of {survey_id}, "
+                    "it has no avros in MARS"
+                )
+                continue
+            self.filters[survey_id] = BloomFilter.load(settings["membership_filter"])
+        shared_cache = shared_cache or {}
+        self.shared = (
+            SharedMemoryCache(
+                "raw_avros",
+                shared_cache.get("directory") or "/dev/shm",
+                int(shared_cache["size"]),
+                int(shared_cache.get("slot_bytes") or 131072),
+            )
+            if shared_cache.get("size")
+            else None
+        )
+        disk_cache = disk_cache or {}
+        self.disk = (
+            AvroDiskCache(disk_cache["directory"], int(disk_cache["max_bytes"]))
+            if disk_cache.get("directory")
+            else None
+        )
+        # Objects not found, by (survey_id, object name)
+        self.misses = NegativeCache("s3_misses", miss_ttl)
+        self._flights = SingleFlight("s3")
 
-    def get_file_from_s3(self, candid, survey_id):
+    def get_client(self, survey_id):
+        """S3 client of a survey, configured by its client settings
+
+        :param survey_id: Survey of the bucket
+        """
+        if self.client is not None:
+            return self.client
+        clients = self._clients.get()
+        with self._clients_lock:
+            client = clients.get(survey_id)
+            if client is None:
+                # The default session is not thread safe
+                session = boto3.session.Session()
+                settings = self.buckets_dict[survey_id].get("client")
+                client = session.client("s3", config=client_config(settings))
+                clients[survey_id] = client
+            return client
+
+    def _get_object(self, candid, survey_id):
         reverse_candid = utils.reverse_candid(candid)
         file_name = f"{reverse_candid}.avro"
         bucket_name = self.buckets_dict[survey_id]["bucket"]
+        if (survey_id, file_name) in self.misses:
+            raise FileNotFoundError
+        membership = self.filters.get(survey_id)
+        if membership is not None:
+            absent = file_name not in membership
+            result = "absent" if absent else "maybe"
+            MEMBERSHIP_FILTER_LOOKUPS.labels(survey_id, result).inc()
+            if absent:
+                raise FileNotFoundError
         try:
-            # self.client.download_fileobj(self.bucket_name, file_name, avro_file)
-            f = self.client.get_object(Bucket=bucket_name, Key=file_name)["Body"].read()
-            avro_file = io.BytesIO(f)
-            return avro_file
+            return self.get_client(survey_id).get_object(
+                Bucket=bucket_name, Key=file_name
+            )
         except ClientError as e:
             if (
                 e.response["Error"]["Code"] == "404"
                 or e.response["Error"]["Code"] == "NoSuchKey"
             ):
+                self.misses.add((survey_id, file_name))
                 raise FileNotFoundError
             else:
                 print()
                 raise Exception(e)
 
+    def _read_cached(self, candid, survey_id):
+        shared_key = f"{survey_id}/{candid}"
+        if self.shared is not None:
+            data = self.shared.get(shared_key)
+            if data is not None:
+                return data
+        if self.disk is not None:
+            data = self.disk.get((survey_id, candid))
+            if data is not None:
+                if self.shared is not None:
+                    self.shared.set(shared_key, data)
+                return data
+        return None
+
+    def _read_object(self, candid, survey_id):
+        data = self._read_cached(candid, survey_id)
+        if data is not None:
+            return data
+        start = time.monotonic()
+        data = self._get_object(candid, survey_id)["Body"].read()
+        s3_latencies.observe(survey_id, time.monotonic() - start)
+        if self.shared is not None:
+            self.shared.set(f"{survey_id}/{candid}", data)
+        if self.disk is not None:
+            try:
+                self.disk.set((survey_id, candid), data)
+            except OSError:
+                pass  # The disk cache is best effort, e.g. when the disk is full
+        return data
+
+    def get_file_from_s3(self, candid, survey_id):
+        # Concurrent requests for the same avro share one download
+        f = self._flights.do(
+            (survey_id, str(candid)), self._read_object, candid, survey_id
+        )
+        avro_file = io.BytesIO(f)
+        return avro_file
+
+    def open_file_from_s3(self, candid, survey_id):
+        """Open an avro in S3 without reading it
+
+        The caller must close the body of the returned S3Object.
+
+        :param candid: Alert id
+        :param survey_id: Survey of the alert
+        """
+        data = self._read_cached(candid, survey_id)
+        if data is not None:
+            return S3Object(CachedBody(data), len(data), None)
+        s3_object = self._get_object(candid, survey_id)
+        return S3Object(
+            s3_object["Body"], s3_object["ContentLength"], s3_object["ETag"]
+        )
+
+    def read_file(self, object_name, survey_id):
+        """Read a file other than an avro from S3
+
+        :param object_name: S3 object name
+        :param survey_id: Survey whose bucket has the file
+        :raises FileNotFoundError: if the object doesn't exist
+        """
+        bucket_name = self.buckets_dict[survey_id]["bucket"]
+        try:
+            s3_object = self.get_client(survey_id).get_object(
+                Bucket=bucket_name, Key=object_name
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                raise FileNotFoundError
+            raise
+        return s3_object["Body"].read()
+
+    def delete_files(self, prefix, survey_id, keep=()):
+        """Delete the files under a prefix of an S3 bucket
+
+        :param prefix: Prefix of the S3 object names
+        :param survey_id: Survey whose bucket has the files
+        :param keep: S3 object names not deleted
+        """
+        bucket_name = self.buckets_dict[survey_id]["bucket"]
+        client = self.get_client(survey_id)
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for s3_object in page.get("Contents", []):
+                if s3_object["Key"] not in keep:
+                    client.delete_object(Bucket=bucket_name, Key=s3_object["Key"])
+
     def upload_file(self, file_name, object_name, survey_id):
         """Upload a file to an S3 bucket
 
@@ -38,22 +375,121 @@ class S3Searcher:
         :param object_name: S3 object name. If not specified then file_name is used
         """
         bucket_name = self.buckets_dict[survey_id]["bucket"]
-        return self.client.upload_fileobj(file_name, bucket_name, object_name)
+        result = self.get_client(survey_id).upload_fileobj(
+            file_name, bucket_name, object_name
+        )
+        self.misses.discard((survey_id, object_name))
+        if survey_id in self.filters:
+            self.filters[survey_id].add(object_name)
+        return result
+
+
+class BulkQueryUnsupported(Exception):
+    """Raised when MARS doesn't answer a bulk query as expected"""
 
 
 class MARSSearcher:
-    def init(self, mars_url):
+    def init(self, mars_url, miss_ttl=0, http=None, batch=None):
         self.mars_url = mars_url
+        # Bulk queries are sent with POST but only read, so they can be retried
+        self.http = HTTPClient("mars", http, retry_methods=("GET", "POST"))
+        # Candids MARS has no alert for, MARS only has ZTF alerts
+        self.misses = NegativeCache("mars_misses", miss_ttl)
+        self._flights = SingleFlight("mars")
+        # Candids looked up at the same time are sent in one bulk query
+        batch = batch or {}
+        window = float(batch.get("window") or 0)
+        self._batcher = (
+            Batcher("mars", self._query_many, window, int(batch.get("max_size") or 100))
+            if window
+            else None
+        )
 
-    def get_file_from_mars(self, oid, candid):
-        payload = {"candid": int(candid), "format": "json"}
-        resp = requests.get(self.mars_url, params=payload)
+    def get_file_from_mars(self, oid, candid, avro_url=None):
+        # Concurrent requests for the same alert share one download
+        f = self._flights.do((oid, int(candid)), self._download, oid, candid, avro_url)
+        return io.BytesIO(f)
+
+    def _download(self, oid, candid, avro_url=None):
+        start = time.monotonic()
+        # The URL of an objectId query saves the candid query
+        if avro_url is None:
+            if int(candid) in self.misses:
+                raise FileNotFoundError
+            resp_json = self._query(int(candid))
+            if resp_json.get("results") == []:
+                self.misses.add(int(candid))
+                raise FileNotFoundError
+            self.check_response(resp_json, oid, candid)
+            avro_url = resp_json["results"][0]["avro"]
+        avro = self.http.get(avro_url)
+        if avro.status_code != 200:
+            raise Exception("Unable to download from MARS")
+        data = avro.content
+        mars_latencies.observe("ztf", time.monotonic() - start)
+        return data
+
+    def _query(self, candid):
+        """
+        Returns the MARS answer for a candid, from a bulk query if they are
+        enabled.
+        """
+        batcher = self._batcher
+        if batcher is not None:
+            try:
+                return batcher.get(candid)
+            except BulkQueryUnsupported:
+                self._batcher = None
+        MARS_QUERIES.labels("single").inc()
+        payload = {"candid": candid, "format": "json"}
+        resp = self.http.get(self.mars_url, params=payload)
         if resp.status_code != 200:
             raise Exception("Unable to download from MARS")
-        resp_json = resp.json()
-        self.check_response(resp_json, oid, candid)
-        with urlopen(resp_json["results"][0]["avro"]) as f:
-            return io.BytesIO(f.read())
+        return resp.json()
+
+    def _query_many(self, candids):
+        """
+        Sends the queries of several candids at once, MARS answers every
+        query of the list with its own results, in order.
+        """
+        MARS_QUERIES.labels("bulk").inc()
+        queries = [{"candid": candid} for candid in candids]
+        resp = self.http.post(
+            self.mars_url, params={"format": "json"}, json={"queries": queries}
+        )
+        if resp.status_code >= 500:
+            raise Exception("Unable to query MARS")
+        try:
+            if resp.status_code != 200:
+                raise ValueError(f"Status {resp.status_code}")
+            answers = resp.json()["results"]
+            if len(answers) != len(candids) or not all(
+                "results" in answer for answer in answers
+            ):
+                raise ValueError("Unexpected answer")
+        except (ValueError, KeyError, TypeError) as e:
+            raise BulkQueryUnsupported(f"MARS bulk query failed: {e}")
+        return dict(zip(candids, answers))
+
+    def get_avro_urls(self, oid):
+        """
+        Returns the avro URLs of every alert of an object by candid, in
+        ascending candid order, following the pages of the MARS answer.
+        """
+        urls = {}
+        url = self.mars_url
+        params = {"objectId": oid, "format": "json"}
+        while url:
+            MARS_QUERIES.labels("objects").inc()
+            resp = self.http.get(url, params=params)
+            if resp.status_code != 200:
+                raise Exception("Unable to query MARS")
+            resp_json = resp.json()
+            for result in resp_json["results"]:
+                urls[int(result["candid"])] = result["avro"]
+            # The next page URL has every parameter
+            url, params = resp_json.get("next"), None
+        return dict(sorted(urls.items()))
 
     def check_response(self, resp, oid, candid):
         assert "results" in resp
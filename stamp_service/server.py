@@ -14,6 +14,12 @@ def create_app(config_path):
     application.config["SERVER_SETTINGS"] = config_dict["SERVER_SETTINGS"]
     application.config["RALIDATOR_SETTINGS"] = config_dict["RALIDATOR_SETTINGS"]
     application.config["FILTERS_MAP"] = {}
+    application.config["PNG_RENDERER"] = config_dict["SERVER_SETTINGS"].get(
+        "png_renderer", "numpy"
+    )
+    application.config["STREAM_AVRO"] = config_dict["SERVER_SETTINGS"].get(
+        "stream_avro", True
+    )
     CORS(application)
 
     ralidator.init_app(application)
@@ -30,9 +36,36 @@ def create_app(config_path):
 
     with application.app_context():
         from .search import s3_searcher, mars_searcher
+        from .cache import stamp_cache
+        from .alerts import alert_cache
+        from .executor import render_executor
+        from .writeback import s3_writeback
+        from .hedging import hedged_fetcher
+        from .batch import batch_executor
 
-        s3_searcher.init(application.config["SERVER_SETTINGS"]["SURVEY_SETTINGS"])
-        mars_searcher.init(mars_url=application.config["SERVER_SETTINGS"]["mars_url"])
+        negative_cache = (
+            application.config["SERVER_SETTINGS"].get("NEGATIVE_CACHE") or {}
+        )
+        s3_searcher.init(
+            application.config["SERVER_SETTINGS"]["SURVEY_SETTINGS"],
+            miss_ttl=float(negative_cache.get("s3_ttl") or 0),
+            disk_cache=application.config["SERVER_SETTINGS"].get("AVRO_DISK_CACHE"),
+            shared_cache=application.config["SERVER_SETTINGS"].get("AVRO_SHARED_CACHE"),
+        )
+        mars_searcher.init(
+            mars_url=application.config["SERVER_SETTINGS"]["mars_url"],
+            miss_ttl=float(negative_cache.get("mars_ttl") or 0),
+            http=application.config["SERVER_SETTINGS"].get("MARS_CLIENT"),
+            batch=application.config["SERVER_SETTINGS"].get("MARS_BATCH"),
+        )
+        stamp_cache.init(application.config["SERVER_SETTINGS"].get("STAMP_CACHE"))
+        alert_cache.init(application.config["SERVER_SETTINGS"].get("ALERT_CACHE"))
+        render_executor.init(
+            application.config["SERVER_SETTINGS"].get("RENDER_EXECUTOR")
+        )
+        s3_writeback.init(application.config["SERVER_SETTINGS"].get("S3_WRITEBACK"))
+        hedged_fetcher.init(application.config["SERVER_SETTINGS"].get("HEDGING"))
+        batch_executor.init(application.config["SERVER_SETTINGS"].get("BATCH"))
 
         from .resources import api
 
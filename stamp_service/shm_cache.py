@@ -0,0 +1,214 @@
+import fcntl
+import glob
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+from .metrics import CACHE_EVICTIONS, CACHE_LOOKUPS
+
+MAGIC = b"STMPSHM1"
+# magic, ways, slot size, number of buckets
+HEADER = struct.Struct("<8sIIQ")
+HEADER_SIZE = 64
+# sequence, last access, key digest, value length, value CRC32
+SLOT = struct.Struct("<QQ16sII")
+SEQUENCE = struct.Struct("<Q")
+THREAD_LOCKS = 64
+
+
+def _owner_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_file_at(fd, path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(fd)
+    return (stat.st_dev, stat.st_ino) == (opened.st_dev, opened.st_ino)
+
+
+class SharedMemoryCache:
+    """
+    Fixed size cache of bytes in a memory mapped file shared by every
+    worker of a node.
+
+    The file holds a hash table of buckets of `ways` slots of `slot_bytes`
+    bytes. A key can only be stored in the bucket its hash points to, in
+    the slot of the same key, an empty one or the least recently used one.
+    Values that don't fit in a slot are not cached.
+
+    Reads don't lock: every slot has a sequence number that is odd while
+    the slot is being written, and readers discard values whose sequence
+    changed while they were copied or that don't match their CRC32.
+    Writers lock their bucket, with a byte range lock between processes
+    and a thread lock within a process.
+
+    The file is named after the pid of the process that owns it, the
+    gunicorn master that forked the workers, and files whose owner is no
+    longer running are removed, so a restarted master starts with an empty
+    cache. A reload keeps the master, so a file created with other settings
+    is replaced by an empty one.
+
+    Parameters
+    ----------
+    name : str
+        cache name, used in the file name and the metrics
+    directory : str
+        directory of the file, e.g. /dev/shm
+    size : int
+        size of the file in bytes
+    slot_bytes : int
+        size of a slot, values up to slot_bytes minus 40 bytes are cached
+    ways : int
+        number of slots per bucket
+    owner : int
+        pid of the owner of the file, the parent process by default
+    """
+
+    def __init__(self, name, directory, size, slot_bytes=65536, ways=4, owner=None):
+        self.name = name
+        self.slot_bytes = slot_bytes
+        self.ways = ways
+        self.bucket_bytes = slot_bytes * ways
+        self.nbuckets = (size - HEADER_SIZE) // self.bucket_bytes
+        if self.nbuckets < 1:
+            raise ValueError(f"Shared memory cache {name} is too small")
+        self.max_value_bytes = slot_bytes - SLOT.size
+
+        owner = os.getppid() if owner is None else owner
+        self.remove_stale(directory, name)
+        self.path = os.path.join(directory, f"stamp_service-{name}-{owner}.shm")
+        self._fd = self._open(self.path)
+        self._map = mmap.mmap(self._fd, HEADER_SIZE + self.nbuckets * self.bucket_bytes)
+        self._locks = [threading.Lock() for _ in range(THREAD_LOCKS)]
+
+    @staticmethod
+    def remove_stale(directory, name):
+        """
+        Removes the files of this cache whose owner is no longer running.
+        """
+        pattern = re.compile(rf"stamp_service-{re.escape(name)}-(\d+)\.shm$")
+        for path in glob.glob(os.path.join(directory, f"stamp_service-{name}-*.shm")):
+            match = pattern.search(path)
+            if match and not _owner_alive(int(match.group(1))):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _open(self, path):
+        size = HEADER_SIZE + self.nbuckets * self.bucket_bytes
+        header = HEADER.pack(MAGIC, self.ways, self.slot_bytes, self.nbuckets)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                # Only the first worker initializes the file
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if not _is_file_at(fd, path):
+                    # Replaced by another worker while waiting for the lock
+                    os.close(fd)
+                    continue
+                if os.fstat(fd).st_size == 0:
+                    # The file is zero filled, so every slot starts empty
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, header, 0)
+                elif os.pread(fd, HEADER.size, 0) != header:
+                    # Created with other settings by the workers before a
+                    # reload, which keep their own copy until they exit
+                    os.remove(path)
+                    os.close(fd)
+                    continue
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except Exception:
+                os.close(fd)
+                raise
+            return fd
+
+    def _bucket(self, digest):
+        bucket = int.from_bytes(digest[:8], "little") % self.nbuckets
+        return bucket, HEADER_SIZE + bucket * self.bucket_bytes
+
+    def get(self, key):
+        digest = hashlib.sha1(key.encode()).digest()[:16]
+        _, offset = self._bucket(digest)
+        value = None
+        for slot in range(offset, offset + self.bucket_bytes, self.slot_bytes):
+            sequence, _, slot_digest, length, crc = SLOT.unpack_from(self._map, slot)
+            if sequence % 2 or slot_digest != digest:
+                continue
+            if length > self.max_value_bytes:
+                break
+            start = slot + SLOT.size
+            data = self._map[start : start + length]
+            if (
+                SEQUENCE.unpack_from(self._map, slot)[0] == sequence
+                and zlib.crc32(data) == crc
+            ):
+                # Unlocked, a lost update only makes the LRU approximate
+                SEQUENCE.pack_into(self._map, slot + SEQUENCE.size, time.time_ns())
+                value = data
+            break
+        result = "miss" if value is None else "hit"
+        CACHE_LOOKUPS.labels(self.name, "shared", result).inc()
+        return value
+
+    def set(self, key, value):
+        if not value or len(value) > self.max_value_bytes:
+            return
+        digest = hashlib.sha1(key.encode()).digest()[:16]
+        bucket, offset = self._bucket(digest)
+        with self._locks[bucket % THREAD_LOCKS]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.bucket_bytes, offset)
+            try:
+                self._write(offset, digest, value)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.bucket_bytes, offset)
+
+    def _write(self, offset, digest, value):
+        slots = []
+        for slot in range(offset, offset + self.bucket_bytes, self.slot_bytes):
+            sequence, accessed, slot_digest, length, _ = SLOT.unpack_from(
+                self._map, slot
+            )
+            if slot_digest == digest:
+                target = (slot, sequence)
+                break
+            slots.append((length > 0, accessed, slot, sequence))
+        else:
+            used, _, slot, sequence = min(slots)
+            target = (slot, sequence)
+            if used:
+                CACHE_EVICTIONS.labels(self.name, "shared").inc()
+
+        slot, sequence = target
+        # Odd while the slot is written, readers skip it
+        SEQUENCE.pack_into(self._map, slot, sequence + 1)
+        SLOT.pack_into(
+            self._map,
+            slot,
+            sequence + 1,
+            time.time_ns(),
+            digest,
+            len(value),
+            zlib.crc32(value),
+        )
+        start = slot + SLOT.size
+        self._map[start : start + len(value)] = value
+        SEQUENCE.pack_into(self._map, slot, sequence + 2)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
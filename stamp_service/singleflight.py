@@ -0,0 +1,94 @@
+import fcntl
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+from .metrics import SINGLEFLIGHT_CALLS
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time within a process.
+
+    Callers that arrive while a call with the same key is running wait for
+    it and get its result, or its exception, instead of running their own.
+    Results are shared, so they should be immutable.
+
+    Parameters
+    ----------
+    name : str
+        name reported in the metrics
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            SINGLEFLIGHT_CALLS.labels(self.name, "shared").inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLEFLIGHT_CALLS.labels(self.name, "leader").inc()
+        try:
+            call.result = func(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+@contextmanager
+def worker_lock(directory, name):
+    """
+    Non blocking lock shared by the processes of a node.
+
+    Yields True if the lock was acquired and False if another process holds
+    it. Lock files are removed on release, so in a rare race two processes
+    can both acquire the lock; it must only guard idempotent work.
+
+    Parameters
+    ----------
+    directory : str
+        directory of the lock files, created if it doesn't exist
+    name : str
+        name of the lock
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, hashlib.sha1(name.encode()).hexdigest())
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            fcntl.flock(f, fcntl.LOCK_UN)
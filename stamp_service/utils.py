@@ -1,6 +1,19 @@
+import base64
 import io
 import logging
 from . import fits2png
+from .executor import render_executor
+
+STAMP_KEYS = {
+    "science": "cutoutScience",
+    "template": "cutoutTemplate",
+    "difference": "cutoutDifference",
+}
+FORMATS = {
+    "fits": ("application/fits+gzip", "fits.gz"),
+    "png": ("image/png", "png"),
+}
+WINDOW = 2
 
 
 def set_logger(app):
@@ -10,33 +23,81 @@ def set_logger(app):
         app.logger.setLevel(gunicorn_logger.level)
 
 
-def format_stamp(stamp, fmt, oid, candid, stype):
-    window = 2
+def _basename(oid, candid, stype):
     if oid:
-        basename = f"{oid}_{candid}_{stype}"
-    else:
-        basename = f"{candid}_{stype}"
-    if fmt == "fits":
-        stamp_file = io.BytesIO(stamp)
-        mimetype = "application/fits+gzip"
-        fname = f"{basename}.fits.gz"
-    elif fmt == "png":
-        stamp_file = io.BytesIO(fits2png.transform(stamp, stype, window))
-        mimetype = "image/png"
-        fname = f"{basename}.png"
-    else:
+        return f"{oid}_{candid}_{stype}"
+    return f"{candid}_{stype}"
+
+
+def stamp_file_info(fmt, oid, candid, stype):
+    """
+    Returns the mimetype and download name of a formatted stamp.
+    """
+    try:
+        mimetype, extension = FORMATS[fmt]
+    except KeyError:
         raise ValueError(f"Unrecognized format {fmt}")
-    return stamp_file, mimetype, fname
+    return mimetype, f"{_basename(oid, candid, stype)}.{extension}"
+
+
+def format_stamp(stamp, fmt, oid, candid, stype, renderer="numpy"):
+    mimetype, fname = stamp_file_info(fmt, oid, candid, stype)
+    if fmt == "png":
+        stamp = render_executor.run(fits2png.transform, stamp, stype, WINDOW, renderer)
+    return io.BytesIO(stamp), mimetype, fname
+
+
+def render_stamps(avro, fmt, stypes=STAMP_KEYS, renderer="numpy"):
+    """
+    Formats several cutouts of an alert at once.
+
+    Returns a list of (stamp type, file) tuples. Cutouts missing from the
+    alert are skipped.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unrecognized format {fmt}")
+    stypes = [stype for stype in stypes if avro.get(STAMP_KEYS[stype])]
+    files = [get_stamp_type(avro, stype) for stype in stypes]
+    if fmt == "png" and files:
+        files = render_executor.run(
+            fits2png.transform_batch, files, stypes, WINDOW, renderer
+        )
+    return list(zip(stypes, files))
+
+
+def format_stamps(avro, fmt, oid, candid, renderer="numpy"):
+    """
+    Formats every cutout of an alert at once.
+
+    Returns a dictionary keyed by stamp type with the base64 encoded file,
+    its mimetype and file name. Cutouts missing from the alert are skipped.
+    """
+    stamps = {}
+    for stype, stamp_file in render_stamps(avro, fmt, renderer=renderer):
+        mimetype, fname = stamp_file_info(fmt, oid, candid, stype)
+        stamps[stype] = {
+            "file": base64.b64encode(stamp_file).decode("ascii"),
+            "mimetype": mimetype,
+            "download_name": fname,
+        }
+    return stamps
+
+
+def stamp_cache_key(survey_id, candid, stype, fmt, renderer):
+    """
+    Key of a formatted stamp in the rendered stamps cache.
+
+    Includes the renderer version so changes to the transform invalidate
+    previously cached stamps.
+    """
+    version = f"{renderer}-{fits2png.RENDERER_VERSION}"
+    return f"{survey_id}/{candid}/{stype}/{fmt}/{WINDOW}/{version}"
 
 
 def get_stamp_type(avro, stype):
-    if stype == "science":
-        key = "cutoutScience"
-    elif stype == "template":
-        key = "cutoutTemplate"
-    elif stype == "difference":
-        key = "cutoutDifference"
-    else:
+    try:
+        key = STAMP_KEYS[stype]
+    except KeyError:
         raise ValueError(f"Unrecognized stamp type {stype}")
     return avro[key]["stampData"]
 
@@ -0,0 +1,173 @@
+import io
+import logging
+import threading
+import time
+from collections import deque
+
+from . import utils
+from .metrics import WRITEBACK_FAILURES, WRITEBACK_QUEUE_DEPTH, WRITEBACK_UPLOAD_SECONDS
+from .per_process import PerProcess
+from .search import s3_searcher
+from .singleflight import worker_lock
+
+MODES = ("sync", "async")
+
+logger = logging.getLogger(__name__)
+
+
+class S3WriteBack:
+    """
+    Uploads to S3 the avros that were found in MARS, and other files built
+    by the service.
+
+    In "async" mode the avros are queued and uploaded by `workers`
+    background threads, so requests don't wait for the upload. An avro is
+    queued only once until its upload finishes and the queue holds at most
+    `max_bytes` of avros, avros that don't fit are dropped and will be
+    fetched from MARS again. In "sync" mode the upload happens before
+    submit returns. In both modes failed uploads are retried `retries`
+    times, waiting `backoff` seconds doubled on every attempt, and then
+    only logged. If `lock_dir` is set, an avro being uploaded by another
+    worker of the node is skipped. Each process starts its own threads.
+    """
+
+    def __init__(self):
+        self.init()
+
+    def init(self, settings=None):
+        settings = settings or {}
+        mode = settings.get("mode") or "sync"
+        if mode not in MODES:
+            raise ValueError(f"Unrecognized write-back mode {mode}")
+        self.mode = mode
+        self.workers = int(settings.get("workers") or 1)
+        self.max_bytes = int(settings.get("max_bytes") or 64 * 1024**2)
+        self.retries = int(settings.get("retries") or 0)
+        self.backoff = float(settings.get("backoff") or 0.5)
+        self.lock_dir = settings.get("lock_dir") or None
+        self.nbytes = 0
+        self._queue = deque()
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._threads = PerProcess(self._start_threads)
+
+    def _start_threads(self):
+        threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                key = self._queue.popleft()
+                object_name, data = self._pending[key]
+            try:
+                self._upload(key, object_name, data)
+            finally:
+                with self._condition:
+                    del self._pending[key]
+                    self.nbytes -= len(data)
+                    WRITEBACK_QUEUE_DEPTH.dec()
+                    self._condition.notify_all()
+
+    def _upload(self, key, object_name, data):
+        if self.lock_dir is None:
+            return self._put(key, object_name, data)
+        survey_id, name = key
+        try:
+            with worker_lock(self.lock_dir, f"{survey_id}/{name}") as acquired:
+                if not acquired:
+                    return True
+                return self._put(key, object_name, data)
+        except OSError as e:
+            # e.g. lock_dir is not writable
+            logger.warning(f"Upload of {name} to S3 failed: {e}")
+            WRITEBACK_FAILURES.labels("lock_error").inc()
+            return False
+
+    def _put(self, key, object_name, data):
+        survey_id, name = key
+        for attempt in range(self.retries + 1):
+            start = time.time()
+            try:
+                s3_searcher.upload_file(io.BytesIO(data), object_name, survey_id)
+                WRITEBACK_UPLOAD_SECONDS.observe(time.time() - start)
+                return True
+            except Exception as e:
+                logger.warning(f"Upload of {name} to S3 failed: {e}")
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2**attempt)
+        WRITEBACK_FAILURES.labels("upload_error").inc()
+        return False
+
+    def submit(self, data, candid, survey_id):
+        """
+        Uploads an avro to S3, in the background in "async" mode.
+
+        Parameters
+        ----------
+        data : bytes
+            avro file
+        candid : int or str
+            alert id
+        survey_id : str
+            survey of the alert
+
+        Returns
+        -------
+        bool
+            False if the upload failed or the avro was dropped
+        """
+        object_name = f"{utils.reverse_candid(candid)}.avro"
+        return self._submit((survey_id, str(candid)), object_name, data)
+
+    def submit_object(self, data, object_name, survey_id):
+        """
+        Uploads a file other than an avro to S3 like `submit`.
+
+        Parameters
+        ----------
+        data : bytes
+            file content
+        object_name : str
+            S3 object name
+        survey_id : str
+            survey whose bucket gets the file
+        """
+        return self._submit((survey_id, object_name), object_name, data)
+
+    def _submit(self, key, object_name, data):
+        if self.mode == "sync":
+            return self._upload(key, object_name, data)
+
+        with self._condition:
+            if key in self._pending:
+                return True
+            if self.nbytes + len(data) > self.max_bytes:
+                WRITEBACK_FAILURES.labels("queue_full").inc()
+                return False
+            self._threads.get()
+            self._pending[key] = (object_name, data)
+            self._queue.append(key)
+            self.nbytes += len(data)
+            WRITEBACK_QUEUE_DEPTH.inc()
+            self._condition.notify()
+        return True
+
+    def join(self, timeout=None):
+        """
+        Waits until every queued avro has been uploaded or given up on.
+
+        Returns False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending, timeout)
+
+
+s3_writeback = S3WriteBack()
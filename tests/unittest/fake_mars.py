@@ -0,0 +1,115 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeMARS:
+    """
+    Local HTTP server answering like the MARS API.
+
+    Alerts added with `add` are returned by candid and by objectId, in pages
+    of `page_size`, and their avros are served under /avro/<candid>. POST
+    requests with a list of queries are answered with the results of each
+    query if `bulk` is set, and with 405 otherwise. The next `failures`
+    requests are answered with `failure_status`.
+    """
+
+    def __init__(self, page_size=2, bulk=True):
+        self.page_size = page_size
+        self.bulk = bulk
+        self.alerts = {}
+        self.failures = 0
+        self.failure_status = 503
+        self.requests = []
+        # Client address of every connection
+        self.connections = set()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.01,), daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add(self, oid, candid, avro):
+        self.alerts[candid] = (oid, avro)
+
+    def _result(self, candid):
+        oid, _ = self.alerts[candid]
+        return {"objectId": oid, "candid": candid, "avro": f"{self.url}avro/{candid}"}
+
+    def _answer(self, path, query):
+        if path.startswith("/avro/"):
+            candid = int(path.rsplit("/", 1)[1])
+            if candid not in self.alerts:
+                return 404, "application/octet-stream", b""
+            return 200, "application/octet-stream", self.alerts[candid][1]
+
+        if "candid" in query:
+            candids = [c for c in self.alerts if c == int(query["candid"][0])]
+        else:
+            oid = query["objectId"][0]
+            candids = [c for c, (o, _) in self.alerts.items() if o == oid]
+        page = int(query.get("page", ["1"])[0])
+        start = (page - 1) * self.page_size
+        results = [self._result(c) for c in candids[start : start + self.page_size]]
+        next_url = None
+        if start + self.page_size < len(candids):
+            next_url = f"{self.url}?objectId={query['objectId'][0]}&page={page + 1}"
+        body = {"count": len(candids), "next": next_url, "results": results}
+        return 200, "application/json", json.dumps(body).encode()
+
+    def _answer_bulk(self, queries):
+        if not self.bulk:
+            return 405, "text/plain", b""
+        answers = []
+        for query in queries:
+            candid = int(query["candid"])
+            results = [self._result(candid)] if candid in self.alerts else []
+            answers.append({"count": len(results), "results": results})
+        body = {"results": answers}
+        return 200, "application/json", json.dumps(body).encode()
+
+    def _handler(self):
+        mars = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                self.reply(lambda: mars._answer(url.path, parse_qs(url.query)))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                queries = json.loads(self.rfile.read(length))["queries"]
+                self.reply(lambda: mars._answer_bulk(queries))
+
+            def reply(self, answer):
+                with mars._lock:
+                    mars.requests.append(f"{self.command} {self.path}")
+                    mars.connections.add(self.client_address)
+                    failing = mars.failures > 0
+                    mars.failures -= failing
+                if failing:
+                    status, content_type, body = mars.failure_status, "text/plain", b""
+                else:
+                    status, content_type, body = answer()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
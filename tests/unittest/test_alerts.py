@@ -0,0 +1,55 @@
+import os
+import unittest
+from stamp_service import avro_reader
+from stamp_service.alerts import AlertCache, project
+from stamp_service.metrics import CACHE_BYTES
+
+FILE_PATH = os.path.dirname(__file__)
+AVRO_PATH = os.path.join(
+    FILE_PATH, "../examples/avro_test/ZTF18/a/c/u/w/w/p/p/820128985515010010.avro"
+)
+
+
+class TestAlertCache(unittest.TestCase):
+    def setUp(self):
+        with open(AVRO_PATH, "rb") as f:
+            self.avro = f.read()
+        self.cache = AlertCache("test_alerts")
+
+    def test_disabled_by_default(self):
+        self.cache.init()
+        self.assertFalse(self.cache.enabled)
+        alert = self.cache.add("ztf", 123, self.avro)
+        self.assertEqual(alert.raw, self.avro)
+        self.assertIsNone(self.cache.get("ztf", 123))
+
+    def test_add_and_get(self):
+        self.cache.init({"max_bytes": 10 * len(self.avro)})
+        self.cache.add("ztf", 123, self.avro)
+        alert = self.cache.get("ztf", "123")
+        self.assertEqual(alert.raw, self.avro)
+        for field in avro_reader.CUTOUT_FIELDS:
+            self.assertIn(field, alert.record)
+        self.assertIsNone(self.cache.get("atlas", 123))
+        self.assertEqual(
+            CACHE_BYTES.labels("test_alerts")._value.get(), 2 * len(self.avro)
+        )
+
+    def test_eviction(self):
+        self.cache.init({"max_bytes": 3 * len(self.avro)})
+        self.cache.add("ztf", 1, self.avro)
+        self.cache.add("ztf", 2, self.avro)
+        self.assertIsNone(self.cache.get("ztf", 1))
+        self.assertIsNotNone(self.cache.get("ztf", 2))
+
+
+class TestProject(unittest.TestCase):
+    def test_project(self):
+        record = {
+            "candidate": {"candid": 1},
+            "cutoutScience": {"stampData": b"science"},
+            "cutoutTemplate": {"stampData": b"template"},
+        }
+        projected = project(record, ("cutoutScience",))
+        self.assertEqual(set(projected), {"candidate", "cutoutScience"})
+        self.assertEqual(len(record), 3)
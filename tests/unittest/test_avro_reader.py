@@ -0,0 +1,101 @@
+import io
+import os
+import unittest
+from unittest import mock
+import fastavro
+from stamp_service import avro_reader
+
+FILE_PATH = os.path.dirname(__file__)
+AVRO_PATH = os.path.join(
+    FILE_PATH, "../examples/avro_test/ZTF18/a/c/u/w/w/p/p/820128985515010010.avro"
+)
+
+
+class TestReadAlert(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(AVRO_PATH, "rb") as f:
+            cls.avro = f.read()
+        reader = fastavro.reader(io.BytesIO(cls.avro))
+        cls.schema = reader.writer_schema
+        cls.alert = next(reader)
+
+    def test_read_all(self):
+        alert = avro_reader.read_alert(io.BytesIO(self.avro))
+        self.assertEqual(alert, self.alert)
+
+    def test_read_without_cutouts(self):
+        alert = avro_reader.read_alert(io.BytesIO(self.avro), cutouts=())
+        for field in avro_reader.CUTOUT_FIELDS:
+            self.assertNotIn(field, alert)
+        self.assertEqual(alert["candidate"], self.alert["candidate"])
+        self.assertEqual(alert["prv_candidates"], self.alert["prv_candidates"])
+
+    def test_read_one_cutout(self):
+        for field in avro_reader.CUTOUT_FIELDS:
+            alert = avro_reader.read_alert(io.BytesIO(self.avro), cutouts=(field,))
+            self.assertEqual(alert[field], self.alert[field])
+            others = set(avro_reader.CUTOUT_FIELDS) - {field}
+            self.assertFalse(others & set(alert))
+
+    def test_deflate_codec(self):
+        avro = io.BytesIO()
+        fastavro.writer(avro, self.schema, [self.alert], codec="deflate")
+        avro.seek(0)
+        alert = avro_reader.read_alert(avro, cutouts=("cutoutScience",))
+        self.assertEqual(alert["cutoutScience"], self.alert["cutoutScience"])
+        self.assertNotIn("cutoutDifference", alert)
+
+    def test_not_avro(self):
+        with self.assertRaises(ValueError):
+            avro_reader.read_alert(io.BytesIO(b"not an avro file"))
+
+
+class TestSchemaCache(unittest.TestCase):
+    def setUp(self):
+        with open(AVRO_PATH, "rb") as f:
+            self.avro = f.read()
+        self.writer_schema = (
+            fastavro.reader(io.BytesIO(self.avro)).metadata["avro.schema"].encode()
+        )
+
+    def test_schema_is_parsed_once(self):
+        cache = avro_reader.LRUCache("test", 2, sizeof=lambda entry: 1)
+        with mock.patch.object(avro_reader, "_writer_schemas", cache):
+            with mock.patch(
+                "stamp_service.avro_reader.fastavro.parse_schema",
+                wraps=fastavro.parse_schema,
+            ) as parse_schema:
+                for cutouts in [(), ("cutoutScience",), ()]:
+                    avro_reader.read_alert(io.BytesIO(self.avro), cutouts)
+                parsed = avro_reader.parsed_schema(self.writer_schema)
+        parse_schema.assert_called_once()
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(parsed["name"], "ztf.alert")
+
+    def test_projections_are_reused(self):
+        first = avro_reader.decoding_schema(self.writer_schema, ("cutoutScience",))
+        second = avro_reader.decoding_schema(self.writer_schema, ("cutoutScience",))
+        self.assertIs(first, second)
+        self.assertEqual(first["fields"][-1]["name"], "cutoutScience")
+
+
+class TestProjectSchema(unittest.TestCase):
+    def test_truncates_after_last_needed_field(self):
+        schema = {
+            "type": "record",
+            "name": "alert",
+            "fields": [
+                {"name": "candidate", "type": "long"},
+                {"name": "cutoutScience", "type": "bytes"},
+                {"name": "cutoutTemplate", "type": "bytes"},
+                {"name": "cutoutDifference", "type": "bytes"},
+            ],
+        }
+        names = lambda s: [f["name"] for f in s["fields"]]
+        self.assertEqual(names(avro_reader.project_schema(schema, ())), ["candidate"])
+        self.assertEqual(
+            names(avro_reader.project_schema(schema, ("cutoutTemplate",))),
+            ["candidate", "cutoutScience", "cutoutTemplate"],
+        )
+        self.assertEqual(len(schema["fields"]), 4)
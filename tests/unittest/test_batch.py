@@ -0,0 +1,58 @@
+import io
+import json
+import threading
+import unittest
+import zipfile
+
+from stamp_service.batch import BatchExecutor, stream_zip
+
+
+class TestStreamZip(unittest.TestCase):
+    def test_zip_with_manifest(self):
+        results = [
+            ({"candid": "1", "files": ["1.png"]}, [("1.png", b"png")]),
+            ({"candid": "2", "error": "AVRO not found"}, []),
+        ]
+        chunks = list(stream_zip(results))
+        self.assertEqual(len(chunks), 3)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ["1.png", "manifest.json"])
+            self.assertEqual(archive.read("1.png"), b"png")
+            manifest = json.loads(archive.read("manifest.json"))
+        self.assertEqual(manifest, [entry for entry, _ in results])
+
+
+class TestBatchExecutor(unittest.TestCase):
+    def test_map_unordered(self):
+        executor = BatchExecutor()
+        executor.init({"workers": 2})
+        results = executor.map_unordered(lambda x: x * 2, range(10))
+        self.assertEqual(sorted(results), list(range(0, 20, 2)))
+
+    def test_errors_are_raised(self):
+        executor = BatchExecutor()
+
+        def fail(item):
+            raise ValueError(item)
+
+        with self.assertRaises(ValueError):
+            list(executor.map_unordered(fail, [1]))
+
+    def test_pending_items_are_cancelled_on_close(self):
+        executor = BatchExecutor()
+        executor.init({"workers": 1})
+        release = threading.Event()
+        started = []
+
+        def work(item):
+            started.append(item)
+            if item > 1:
+                release.wait(5)
+            return item
+
+        results = executor.map_unordered(work, [1, 2, 3])
+        self.assertEqual(next(results), 1)
+        results.close()
+        release.set()
+        executor._pool.get().shutdown(wait=True)
+        self.assertNotIn(3, started)
@@ -0,0 +1,54 @@
+import threading
+import unittest
+
+from stamp_service.batching import Batcher
+
+
+class TestBatcher(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def lookup(self, keys):
+        self.calls.append(keys)
+        return {key: key * 2 if key >= 0 else ValueError(key) for key in keys}
+
+    def get_concurrently(self, batcher, keys):
+        results = {}
+
+        def get(key):
+            try:
+                results[key] = batcher.get(key)
+            except Exception as e:
+                results[key] = e
+
+        threads = [threading.Thread(target=get, args=(key,)) for key in keys]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_keys_are_looked_up_together(self):
+        batcher = Batcher("test", self.lookup, window=0.5)
+        results = self.get_concurrently(batcher, range(5))
+        self.assertEqual(results, {key: key * 2 for key in range(5)})
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(sorted(self.calls[0]), list(range(5)))
+
+    def test_full_batches_are_looked_up_at_once(self):
+        batcher = Batcher("test", self.lookup, window=10, max_size=2)
+        results = self.get_concurrently(batcher, range(4))
+        self.assertEqual(len(results), 4)
+        self.assertEqual([len(keys) for keys in self.calls], [2, 2])
+
+    def test_errors(self):
+        batcher = Batcher("test", self.lookup, window=0)
+        with self.assertRaises(ValueError):
+            batcher.get(-1)
+
+        def fail(keys):
+            raise KeyError("lookup failed")
+
+        batcher = Batcher("test", fail, window=0)
+        with self.assertRaises(KeyError):
+            batcher.get(1)
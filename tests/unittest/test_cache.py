@@ -0,0 +1,180 @@
+import fcntl
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from stamp_service.cache import LRUCache, DiskCache, TieredCache
+from stamp_service.metrics import CACHE_EVICTIONS, CACHE_LOOKUPS
+
+
+def metric_value(metric, *labels):
+    return metric.labels(*labels)._value.get()
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = LRUCache("test_lru", 10)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", b"123")
+        self.assertEqual(cache.get("a"), b"123")
+        self.assertEqual(cache.nbytes, 3)
+
+    def test_evicts_least_recently_used_to_stay_under_max_bytes(self):
+        evictions = metric_value(CACHE_EVICTIONS, "test_lru", "memory")
+        cache = LRUCache("test_lru", 10)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        cache.get("a")
+        cache.set("c", b"1234")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1234")
+        self.assertEqual(cache.get("c"), b"1234")
+        self.assertEqual(cache.nbytes, 8)
+        self.assertEqual(
+            metric_value(CACHE_EVICTIONS, "test_lru", "memory"), evictions + 1
+        )
+
+    def test_replacing_a_key_updates_size(self):
+        cache = LRUCache("test_lru", 10)
+        cache.set("a", b"1234")
+        cache.set("a", b"12")
+        self.assertEqual(cache.nbytes, 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_values_bigger_than_the_cache_are_not_stored(self):
+        cache = LRUCache("test_lru", 2)
+        cache.set("a", b"123")
+        self.assertIsNone(cache.get("a"))
+
+    def test_lookups_are_counted(self):
+        hits = metric_value(CACHE_LOOKUPS, "test_lru_count", "memory", "hit")
+        misses = metric_value(CACHE_LOOKUPS, "test_lru_count", "memory", "miss")
+        cache = LRUCache("test_lru_count", 10)
+        cache.get("a")
+        cache.set("a", b"1")
+        cache.get("a")
+        self.assertEqual(
+            metric_value(CACHE_LOOKUPS, "test_lru_count", "memory", "hit"), hits + 1
+        )
+        self.assertEqual(
+            metric_value(CACHE_LOOKUPS, "test_lru_count", "memory", "miss"),
+            misses + 1,
+        )
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_and_set(self):
+        cache = DiskCache("test_disk", self.directory, 100)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", b"123")
+        self.assertEqual(cache.get("a"), b"123")
+        # Shared with other instances using the same directory
+        other = DiskCache("test_disk", self.directory, 100)
+        self.assertEqual(other.get("a"), b"123")
+
+    def test_no_temporary_files_are_left(self):
+        cache = DiskCache("test_disk", self.directory, 100)
+        cache.set("a", b"123")
+        files = [f for _, _, fs in os.walk(self.directory) for f in fs]
+        self.assertEqual(len(files), 1)
+        self.assertFalse(files[0].startswith("."))
+
+    def test_evicts_least_recently_used_files(self):
+        cache = DiskCache("test_disk", self.directory, 10, check_every=3)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        os.utime(cache._path("a"), (0, 0))
+        cache.set("c", b"1234")
+        deadline = time.monotonic() + 5
+        while os.path.exists(cache._path("a")) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), b"1234")
+        self.assertEqual(cache.get("c"), b"1234")
+
+    def test_eviction_runs_in_the_background(self):
+        cache = DiskCache("test_disk", self.directory, 10, check_every=1)
+        evicted = threading.Event()
+        threads = []
+
+        def evict():
+            threads.append(threading.current_thread())
+            evicted.set()
+
+        with mock.patch.object(cache, "evict", side_effect=evict):
+            cache.set("a", b"1234")
+            self.assertTrue(evicted.wait(5))
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_one_eviction_at_a_time(self):
+        cache = DiskCache("test_disk", self.directory, 1)
+        cache.set("a", b"1234")
+        with open(os.path.join(self.directory, ".evict.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            cache.evict()
+            self.assertEqual(cache.get("a"), b"1234")
+        cache.evict()
+        self.assertIsNone(cache.get("a"))
+
+
+class TestTieredCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_disabled_until_init(self):
+        cache = TieredCache("test_tiered")
+        self.assertFalse(cache.enabled)
+        cache.set("a", b"1")
+        self.assertIsNone(cache.get("a"))
+        cache.init({"max_bytes": 0, "directory": None})
+        self.assertFalse(cache.enabled)
+
+    def test_disk_hits_are_promoted_to_memory(self):
+        cache = TieredCache("test_tiered")
+        settings = {
+            "max_bytes": 100,
+            "directory": self.tmp_dir.name,
+            "disk_max_bytes": 100,
+        }
+        cache.init(settings)
+        cache.disk.set("a", b"123")
+        self.assertIsNone(cache.memory.get("a"))
+        self.assertEqual(cache.get("a"), b"123")
+        self.assertEqual(cache.memory.get("a"), b"123")
+
+    def test_set_writes_every_tier(self):
+        cache = TieredCache("test_tiered")
+        cache.init({"max_bytes": 100, "directory": self.tmp_dir.name})
+        cache.set("a", b"123")
+        self.assertEqual(cache.memory.get("a"), b"123")
+        self.assertEqual(cache.disk.get("a"), b"123")
+
+    def test_shared_memory_hits_are_promoted_to_memory(self):
+        cache = TieredCache("test_tiered")
+        cache.init(
+            {
+                "max_bytes": 100,
+                "shared_bytes": 10**5,
+                "shared_directory": self.tmp_dir.name,
+                "shared_slot_bytes": 1024,
+            }
+        )
+        self.assertTrue(cache.enabled)
+        cache.shared.set("a", b"123")
+        self.assertEqual(cache.get("a"), b"123")
+        self.assertEqual(cache.memory.get("a"), b"123")
+        cache.set("b", b"456")
+        self.assertEqual(cache.shared.get("b"), b"456")
+        cache.shared.close()
@@ -0,0 +1,60 @@
+import threading
+import time
+import unittest
+from werkzeug.exceptions import ServiceUnavailable
+from stamp_service import utils
+from stamp_service.executor import RenderExecutor
+from stamp_service.metrics import RENDER_QUEUE_DEPTH
+
+
+class TestRenderExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = RenderExecutor()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_inline_by_default(self):
+        self.assertEqual(self.executor.run(utils.reverse_candid, "123"), "321")
+        self.assertIsNone(self.executor._pool.peek())
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.executor.init({"mode": "other"})
+
+    def test_thread_pool(self):
+        self.executor.init({"mode": "thread", "workers": 2})
+        self.assertEqual(self.executor.run(utils.reverse_candid, "123"), "321")
+
+    def test_process_pool(self):
+        self.executor.init({"mode": "process", "workers": 1})
+        self.assertEqual(self.executor.run(utils.reverse_candid, "123"), "321")
+
+    def test_full_queue_is_rejected(self):
+        self.executor.init({"mode": "thread", "workers": 1, "max_queue": 0})
+        started, release = threading.Event(), threading.Event()
+
+        def blocking():
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=self.executor.run, args=(blocking,))
+        thread.start()
+        started.wait()
+        with self.assertRaises(ServiceUnavailable):
+            self.executor.run(utils.reverse_candid, "123")
+        release.set()
+        thread.join()
+        self.assertEqual(self.executor.run(utils.reverse_candid, "123"), "321")
+
+    def test_timeout(self):
+        self.executor.init({"mode": "thread", "timeout": 0.01})
+        with self.assertRaises(ServiceUnavailable):
+            self.executor.run(time.sleep, 0.2)
+
+    def test_queue_depth_goes_back_to_previous_value(self):
+        depth = RENDER_QUEUE_DEPTH._value.get()
+        self.executor.init({"mode": "thread"})
+        self.executor.run(utils.reverse_candid, "123")
+        self.executor._pool.get().shutdown(wait=True)
+        self.assertEqual(RENDER_QUEUE_DEPTH._value.get(), depth)
@@ -1,8 +1,18 @@
+import gzip
 import io
+import os
+import subprocess
+import sys
 import unittest
 from unittest import mock
 import numpy as np
-from stamp_service import fits2png
+import matplotlib.pyplot as plt
+from matplotlib import colors, image
+import astropy.io.fits as fio
+from stamp_service import fits2png, fits_reader
+import fastavro
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "../examples/avro_test")
 
 
 class TestGetMaxValueRange(unittest.TestCase):
@@ -39,35 +49,35 @@ class TestGetMaxValueRange(unittest.TestCase):
         self.assertEqual(expected, vmin)
 
 
-@mock.patch("stamp_service.fits2png.plt")
+@mock.patch("stamp_service.fits2png._pyplot")
 @mock.patch("stamp_service.fits2png.get_max")
 class TestFITS2PNGTransform(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.data = np.zeros((10, 10))
 
-    @mock.patch("stamp_service.fits2png.fio")
+    @mock.patch("stamp_service.fits2png._astropy_fits")
     @mock.patch("stamp_service.fits2png.gzip")
     def test_opening_of_gzipped_fits(self, mock_gzip, mock_fio, mock_max, mock_plt):
         mock_max.return_value = 1, 0
-        mock_fio.open.return_value[0].data = self.data
-        mock_fio.open.return_value[0].header = {}
+        mock_gzip.decompress.return_value = b""
+        mock_fio.return_value.open.return_value[0].data = self.data
+        mock_fio.return_value.open.return_value[0].header = {}
 
-        fits2png.transform(b"", "", 2)
-        mock_fio.open.assert_called()
-        mock_gzip.open.assert_called()
+        fits2png.transform(b"\x1f\x8b", "", 2, renderer="matplotlib")
+        mock_fio.return_value.open.assert_called()
+        mock_gzip.decompress.assert_called_with(b"\x1f\x8b")
 
-    @mock.patch("stamp_service.fits2png.fio")
+    @mock.patch("stamp_service.fits2png._astropy_fits")
     @mock.patch("stamp_service.fits2png.gzip")
     def test_opening_of_not_gzipped_fits(self, mock_gzip, mock_fio, mock_max, mock_plt):
         mock_max.return_value = 1, 0
-        mock_fio.open.return_value[0].data = self.data
-        mock_fio.open.return_value[0].header = {}
-        mock_gzip.side_effect = IOError()
+        mock_fio.return_value.open.return_value[0].data = self.data
+        mock_fio.return_value.open.return_value[0].header = {}
 
-        fits2png.transform(b"", "", 2)
-        mock_fio.open.assert_called()
-        mock_gzip.open.assert_called()
+        fits2png.transform(b"", "", 2, renderer="matplotlib")
+        mock_fio.return_value.open.assert_called()
+        mock_gzip.decompress.assert_not_called()
 
     @mock.patch("stamp_service.fits2png._read_compressed_fits")
     def test_when_using_difference_stamp_do_not_change_min_max(
@@ -76,7 +86,7 @@ class TestFITS2PNGTransform(unittest.TestCase):
         mock_read.return_value.data = self.data
         mock_read.return_value.header = {}
 
-        fits2png.transform(b"", "difference", 2)
+        fits2png.transform(b"", "difference", 2, renderer="matplotlib")
         mock_max.assert_not_called()
 
     @mock.patch("stamp_service.fits2png._read_compressed_fits")
@@ -87,7 +97,7 @@ class TestFITS2PNGTransform(unittest.TestCase):
         mock_read.return_value.data = self.data
         mock_read.return_value.header = {}
 
-        fits2png.transform(b"", "", 2)
+        fits2png.transform(b"", "", 2, renderer="matplotlib")
         mock_max.assert_called()
 
     @mock.patch("stamp_service.fits2png._read_compressed_fits")
@@ -96,8 +106,8 @@ class TestFITS2PNGTransform(unittest.TestCase):
         mock_read.return_value.data = self.data
         mock_read.return_value.header = {}
 
-        fits2png.transform(b"", "", 2)
-        mock_plt.figure.return_value.add_subplot.return_value.axis.assert_called_with(
+        fits2png.transform(b"", "", 2, renderer="matplotlib")
+        mock_plt.return_value.figure.return_value.add_subplot.return_value.axis.assert_called_with(
             "off"
         )
 
@@ -109,8 +119,8 @@ class TestFITS2PNGTransform(unittest.TestCase):
         mock_read.return_value.data = self.data
         mock_read.return_value.header = {}
 
-        fits2png.transform(b"", "", 2)
-        args = mock_plt.figure.return_value.savefig.call_args
+        fits2png.transform(b"", "", 2, renderer="matplotlib")
+        args = mock_plt.return_value.figure.return_value.savefig.call_args
         self.assertIsInstance(args.args[0], io.BytesIO)
         self.assertEqual("png", args.kwargs["format"])
 
@@ -120,8 +130,8 @@ class TestFITS2PNGTransform(unittest.TestCase):
         mock_read.return_value.data = self.data
         mock_read.return_value.header = {}
 
-        fits2png.transform(b"", "", 2)
-        mock_plt.close.assert_called()
+        fits2png.transform(b"", "", 2, renderer="matplotlib")
+        mock_plt.return_value.close.assert_called()
 
     @mock.patch("stamp_service.fits2png._read_compressed_fits")
     def test_output_is_a_bytes_object(self, mock_read, mock_max, mock_plt):
@@ -129,39 +139,181 @@ class TestFITS2PNGTransform(unittest.TestCase):
         mock_read.return_value.data = self.data
         mock_read.return_value.header = {}
 
-        out = fits2png.transform(b"", "", 2)
+        out = fits2png.transform(b"", "", 2, renderer="matplotlib")
         self.assertEqual(b"", out)
 
-    @mock.patch("stamp_service.fits2png.ndimage")
+    @mock.patch("stamp_service.fits2png.rotation")
     @mock.patch("stamp_service.fits2png._read_compressed_fits")
     def test_no_rotation_applied_if_pa_not_in_header(
-        self, mock_read, mock_ndimage, mock_max, mock_plt
+        self, mock_read, mock_rotation, mock_max, mock_plt
     ):
         mock_max.return_value = 1, 0
         mock_read.return_value.data = self.data
         mock_read.return_value.header = {}
 
-        fits2png.transform(b"", "", 2)
-        mock_ndimage.rotate.assert_not_called()
+        fits2png.transform(b"", "", 2, renderer="matplotlib")
+        mock_rotation.rotate.assert_not_called()
         kwargs = (
-            mock_plt.figure.return_value.add_subplot.return_value.imshow.call_args.kwargs
+            mock_plt.return_value.figure.return_value.add_subplot.return_value.imshow.call_args.kwargs
         )
         self.assertIn("origin", kwargs)
         self.assertEqual(kwargs["origin"], "upper")
 
-    @mock.patch("stamp_service.fits2png.ndimage")
+    @mock.patch("stamp_service.fits2png.rotation")
     @mock.patch("stamp_service.fits2png._read_compressed_fits")
     def test_rotation_applied_if_pa_present_in_header(
-        self, mock_read, mock_ndimage, mock_max, mock_plt
+        self, mock_read, mock_rotation, mock_max, mock_plt
     ):
         mock_max.return_value = 1, 0
         mock_read.return_value.data = self.data
         mock_read.return_value.header = dict(PA=0)
 
-        fits2png.transform(b"", "", 2)
-        mock_ndimage.rotate.assert_called()
+        fits2png.transform(b"", "", 2, renderer="matplotlib")
+        mock_rotation.rotate.assert_called()
         kwargs = (
-            mock_plt.figure.return_value.add_subplot.return_value.imshow.call_args.kwargs
+            mock_plt.return_value.figure.return_value.add_subplot.return_value.imshow.call_args.kwargs
         )
         self.assertIn("origin", kwargs)
         self.assertEqual(kwargs["origin"], "lower")
+
+
+class TestNumpyRenderer(unittest.TestCase):
+    def render(self, data, vmin, vmax, origin="upper"):
+        out = fits2png._render_numpy(data, vmin, vmax, origin)
+        return image.imread(io.BytesIO(out))
+
+    def test_lookup_table_matches_matplotlib_colormap(self):
+        expected = plt.get_cmap("Greys_r")(np.arange(256), bytes=True)[:, 0]
+        np.testing.assert_array_equal(fits2png._GREYS_R_LUT, expected)
+
+    def test_values_are_mapped_like_matplotlib(self):
+        np.random.seed(616)
+        data = np.random.normal(size=(10, 10)).astype(">f4")
+        vmin, vmax = -1, 1.5
+        expected = plt.get_cmap("Greys_r")(
+            colors.Normalize(vmin, vmax)(data), bytes=True
+        )[..., 0]
+
+        out = self.render(data, vmin, vmax)
+        np.testing.assert_array_equal(np.round(out * 255), expected)
+
+    def test_nan_pixels_are_transparent(self):
+        data = np.ones((4, 4))
+        data[1, 2] = np.nan
+
+        out = self.render(data, 0, 2)
+        self.assertEqual(out.shape, (4, 4, 4))
+        self.assertEqual(out[1, 2, 3], 0)
+        self.assertEqual(np.count_nonzero(out[..., 3] == 1), 15)
+
+    def test_origin_lower_flips_rows(self):
+        data = np.zeros((4, 4))
+        data[0, :] = 1
+
+        upper = self.render(data, 0, 1, "upper")
+        lower = self.render(data, 0, 1, "lower")
+        np.testing.assert_array_equal(upper[::-1], lower)
+        self.assertTrue((upper[0] == 1).all())
+
+    def test_constant_data_does_not_fail(self):
+        out = self.render(np.ones((4, 4)), 1, 1)
+        self.assertTrue((out == 0).all())
+
+    @mock.patch("stamp_service.fits2png._pyplot")
+    @mock.patch("stamp_service.fits2png._read_compressed_fits")
+    def test_transform_uses_numpy_renderer_by_default(self, mock_read, mock_plt):
+        mock_read.return_value.data = np.zeros((10, 10))
+        mock_read.return_value.header = {}
+
+        out = fits2png.transform(b"", "difference", 2)
+        mock_plt.return_value.figure.assert_not_called()
+        self.assertTrue(out.startswith(b"\x89PNG"))
+
+    def test_transform_rejects_unknown_renderer(self):
+        with self.assertRaises(ValueError):
+            fits2png.transform(b"", "", 2, renderer="other")
+
+
+class TestReadCompressedFits(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        avro_path = os.path.join(
+            EXAMPLES_PATH, "ZTF18/a/c/u/w/w/p/p/820128985515010010.avro"
+        )
+        with open(avro_path, "rb") as f:
+            cls.stamp = next(fastavro.reader(f))["cutoutScience"]["stampData"]
+
+    def test_reads_cutout_like_astropy(self):
+        expected = fio.open(io.BytesIO(gzip.decompress(self.stamp)))[0]
+        hdu = fits2png._read_compressed_fits(self.stamp)
+        self.assertIsInstance(hdu, fits_reader.FitsImage)
+        self.assertEqual(expected.data.dtype, hdu.data.dtype)
+        np.testing.assert_array_equal(expected.data, hdu.data)
+
+    def test_reads_not_gzipped_cutout(self):
+        hdu = fits2png._read_compressed_fits(gzip.decompress(self.stamp))
+        self.assertEqual((63, 63), hdu.data.shape)
+
+    @mock.patch("stamp_service.fits2png._astropy_fits")
+    def test_falls_back_to_astropy(self, mock_fio):
+        hdu = fits2png._read_compressed_fits(b"not a simple fits")
+        self.assertEqual(mock_fio.return_value.open.return_value[0], hdu)
+
+
+class TestBatchTransform(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        avro_path = os.path.join(
+            EXAMPLES_PATH, "ZTF18/a/c/u/w/w/p/p/820128985515010010.avro"
+        )
+        with open(avro_path, "rb") as f:
+            avro = next(fastavro.reader(f))
+        cls.types = ["science", "template", "difference"]
+        cls.stamps = [
+            avro["cutoutScience"]["stampData"],
+            avro["cutoutTemplate"]["stampData"],
+            avro["cutoutDifference"]["stampData"],
+        ]
+
+    def test_get_max_batch_matches_get_max(self):
+        np.random.seed(616)
+        stack = np.random.random((3, 10, 10))
+        stack[1, 2, 3] = np.nan
+
+        vmax, vmin = fits2png.get_max_batch(stack, 2)
+        for i, data in enumerate(stack):
+            expected_max, expected_min = fits2png.get_max(data, 2)
+            self.assertEqual(expected_max, vmax[i])
+            self.assertEqual(expected_min, vmin[i])
+
+    def test_transform_batch_matches_transform(self):
+        out = fits2png.transform_batch(self.stamps, self.types, 2)
+        expected = [
+            fits2png.transform(stamp, stype, 2)
+            for stamp, stype in zip(self.stamps, self.types)
+        ]
+        self.assertEqual(expected, out)
+
+    @mock.patch("stamp_service.fits2png._read_compressed_fits")
+    def test_transform_batch_with_different_shapes(self, mock_read):
+        small, big = mock.MagicMock(), mock.MagicMock()
+        small.data, small.header = np.zeros((4, 4)), {}
+        big.data, big.header = np.zeros((10, 10)), {}
+        mock_read.side_effect = [small, big]
+
+        out = fits2png.transform_batch([b"", b""], ["science", "difference"], 2)
+        self.assertEqual(2, len(out))
+
+    def test_transform_batch_empty(self):
+        self.assertEqual([], fits2png.transform_batch([], [], 2))
+
+
+class TestImports(unittest.TestCase):
+    def test_astropy_and_matplotlib_are_imported_on_use(self):
+        code = (
+            "import sys\n"
+            "from stamp_service import fits2png\n"
+            "assert 'astropy' not in sys.modules\n"
+            "assert 'matplotlib' not in sys.modules\n"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,57 @@
+import io
+import unittest
+import numpy as np
+import astropy.io.fits as fio
+from stamp_service import fits_reader
+
+
+def write_fits(data, **header):
+    hdu = fio.PrimaryHDU(data)
+    for key, value in header.items():
+        hdu.header[key] = value
+    buf = io.BytesIO()
+    hdu.writeto(buf)
+    return buf.getvalue()
+
+
+class TestReadImage(unittest.TestCase):
+    def test_float_image_is_a_view_of_the_buffer(self):
+        data = np.arange(12, dtype=np.float32).reshape(3, 4)
+        fits = write_fits(data, PA=12.5)
+
+        image = fits_reader.read_image(fits)
+        np.testing.assert_array_equal(image.data, data)
+        self.assertEqual(image.data.dtype, np.dtype(">f4"))
+        self.assertFalse(image.data.flags.owndata)
+        self.assertEqual(image.header["PA"], 12.5)
+        self.assertEqual(image.header["NAXIS1"], 4)
+        self.assertNotIn("EXTEND", image.header)
+
+    def test_missing_pa(self):
+        fits = write_fits(np.zeros((2, 2), dtype=np.float64))
+        image = fits_reader.read_image(fits)
+        self.assertNotIn("PA", image.header)
+
+    def test_scaled_integer_image_matches_astropy(self):
+        data = np.arange(12, dtype=np.int16).reshape(3, 4)
+        fits = write_fits(data, BSCALE=0.5, BZERO=10.0)
+
+        image = fits_reader.read_image(fits)
+        expected = fio.open(io.BytesIO(fits))[0].data
+        np.testing.assert_array_equal(image.data, expected)
+        self.assertEqual(image.data.dtype, expected.dtype)
+
+    def test_parse_value(self):
+        self.assertEqual(fits_reader._parse_value(b"  T  / comment"), True)
+        self.assertEqual(fits_reader._parse_value(b"  -32"), -32)
+        self.assertEqual(fits_reader._parse_value(b"  1.5D2 / comment"), 150.0)
+        with self.assertRaises(fits_reader.UnsupportedFITS):
+            fits_reader._parse_value(b"'text'")
+
+    def test_unsupported_files(self):
+        cube = write_fits(np.zeros((2, 2, 2), dtype=np.float32))
+        blank = write_fits(np.zeros((2, 2), dtype=np.int16), BLANK=-1)
+        truncated = write_fits(np.zeros((100, 100), dtype=np.float32))[:-2880]
+        for fits in [b"", b"SIMPLE", cube, blank, truncated]:
+            with self.assertRaises(fits_reader.UnsupportedFITS):
+                fits_reader.read_image(fits)
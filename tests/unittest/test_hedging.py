@@ -0,0 +1,84 @@
+import io
+import threading
+import unittest
+from unittest import mock
+
+from stamp_service.hedging import HedgedFetcher
+from stamp_service.latency import LatencyTracker
+
+
+class TestHedgedFetcher(unittest.TestCase):
+    def setUp(self):
+        self.fetcher = HedgedFetcher()
+        self.fetcher.init({"enabled": True, "max_delay": 0.05, "min_samples": 10})
+        self.s3_released = threading.Event()
+        patcher = mock.patch("stamp_service.hedging.s3_searcher.get_file_from_s3")
+        self.get_file_from_s3 = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("stamp_service.hedging.mars_searcher.get_file_from_mars")
+        self.get_file_from_mars = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Let slow S3 lookups finish after each test
+        self.addCleanup(self.s3_released.set)
+
+    def slow_s3(self, *args):
+        self.s3_released.wait(5)
+        return io.BytesIO(b"s3")
+
+    def test_only_hedges_surveys_in_mars(self):
+        self.assertTrue(self.fetcher.hedges("ztf"))
+        self.assertFalse(self.fetcher.hedges("atlas"))
+        self.fetcher.init()
+        self.assertFalse(self.fetcher.hedges("ztf"))
+
+    def test_fast_s3_does_not_ask_mars(self):
+        self.get_file_from_s3.return_value = io.BytesIO(b"s3")
+        avro_io, source = self.fetcher.fetch(123, "ztf", "oid")
+        self.assertEqual((avro_io.read(), source), (b"s3", "s3"))
+        self.get_file_from_mars.assert_not_called()
+
+    def test_slow_s3_asks_mars(self):
+        self.get_file_from_s3.side_effect = self.slow_s3
+        self.get_file_from_mars.return_value = io.BytesIO(b"mars")
+        avro_io, source = self.fetcher.fetch(123, "ztf", "oid")
+        self.assertEqual((avro_io.read(), source), (b"mars", "mars"))
+        self.get_file_from_mars.assert_called_once_with("oid", 123, None)
+
+    def test_slow_s3_wins_if_mars_misses(self):
+        self.get_file_from_s3.side_effect = self.slow_s3
+        self.get_file_from_mars.side_effect = FileNotFoundError
+        threading.Timer(0.1, self.s3_released.set).start()
+        avro_io, source = self.fetcher.fetch(123, "ztf", "oid")
+        self.assertEqual((avro_io.read(), source), (b"s3", "s3"))
+
+    def test_s3_miss_asks_mars(self):
+        self.get_file_from_s3.side_effect = FileNotFoundError
+        self.get_file_from_mars.return_value = io.BytesIO(b"mars")
+        _, source = self.fetcher.fetch(123, "ztf", "oid")
+        self.assertEqual(source, "mars")
+
+    def test_not_found(self):
+        self.get_file_from_s3.side_effect = FileNotFoundError
+        self.get_file_from_mars.side_effect = Exception("MARS error")
+        with self.assertRaises(FileNotFoundError):
+            self.fetcher.fetch(123, "ztf", "oid")
+
+    def test_s3_errors_are_raised(self):
+        self.get_file_from_s3.side_effect = ValueError("S3 error")
+        self.get_file_from_mars.side_effect = FileNotFoundError
+        with self.assertRaises(ValueError):
+            self.fetcher.fetch(123, "ztf", "oid")
+
+    def test_delay_follows_s3_latency(self):
+        self.fetcher.init(
+            {"percentile": 50, "min_delay": 0.01, "max_delay": 1, "min_samples": 10}
+        )
+        latencies = LatencyTracker("test")
+        with mock.patch("stamp_service.hedging.s3_latencies", latencies):
+            self.assertEqual(self.fetcher.delay("ztf"), 1)
+            for _ in range(10):
+                latencies.observe("ztf", 0.2)
+            self.assertEqual(self.fetcher.delay("ztf"), 0.2)
+            for _ in range(20):
+                latencies.observe("ztf", 0.001)
+            self.assertEqual(self.fetcher.delay("ztf"), 0.01)
@@ -0,0 +1,74 @@
+import unittest
+from flask import Flask
+from stamp_service import http_cache
+
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.calls = 0
+
+        @self.app.route("/<survey_id>")
+        def resource(survey_id):
+            etag = http_cache.resource_etag("test", survey_id)
+            response = http_cache.not_modified(etag, survey_id)
+            if response is not None:
+                return response
+            self.calls += 1
+            http_cache.cache_response(etag, survey_id)
+            return "data"
+
+        @self.app.route("/mutable/<survey_id>")
+        def mutable_resource(survey_id):
+            etag = http_cache.resource_etag("mutable", survey_id)
+            response = http_cache.not_modified(etag, survey_id, mutable=True)
+            if response is not None:
+                return response
+            http_cache.cache_response(etag, survey_id, mutable=True)
+            return "data"
+
+        self.client = self.app.test_client()
+
+    def test_resource_etag_is_deterministic(self):
+        etag = http_cache.resource_etag("stamp", "ztf", 123, "png")
+        self.assertEqual(etag, http_cache.resource_etag("stamp", "ztf", 123, "png"))
+        self.assertNotEqual(etag, http_cache.resource_etag("stamp", "ztf", 123, "fits"))
+
+    def test_response_headers(self):
+        rv = self.client.get("/ztf")
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(
+            rv.headers["ETag"], f'"{http_cache.resource_etag("test", "ztf")}"'
+        )
+        self.assertEqual(rv.cache_control.max_age, http_cache.CACHE_MAX_AGE)
+        self.assertTrue(rv.cache_control.public)
+        self.assertTrue(rv.cache_control.immutable)
+
+    def test_restricted_survey_is_private(self):
+        rv = self.client.get("/atlas")
+        self.assertTrue(rv.cache_control.private)
+        self.assertFalse(rv.cache_control.public)
+
+    def test_not_modified(self):
+        etag = self.client.get("/ztf").headers["ETag"]
+        rv = self.client.get("/ztf", headers={"If-None-Match": etag})
+        self.assertEqual(rv.status_code, 304)
+        self.assertEqual(rv.data, b"")
+        self.assertEqual(rv.headers["ETag"], etag)
+        self.assertEqual(self.calls, 1)
+
+    def test_other_etag_is_modified(self):
+        rv = self.client.get("/ztf", headers={"If-None-Match": '"other"'})
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.data, b"data")
+
+    def test_mutable_resources_are_revalidated(self):
+        rv = self.client.get("/mutable/ztf")
+        self.assertTrue(rv.cache_control.no_cache)
+        self.assertIsNone(rv.cache_control.max_age)
+        self.assertFalse(rv.cache_control.immutable)
+        rv = self.client.get(
+            "/mutable/ztf", headers={"If-None-Match": rv.headers["ETag"]}
+        )
+        self.assertEqual(rv.status_code, 304)
+        self.assertTrue(rv.cache_control.no_cache)
@@ -0,0 +1,77 @@
+import unittest
+from unittest import mock
+
+from stamp_service.http_client import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpen,
+    HTTPClient,
+    JitteredRetry,
+)
+from fake_mars import FakeMARS
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    @mock.patch("stamp_service.http_client.time.monotonic")
+    def test_opens_after_consecutive_failures(self, monotonic):
+        monotonic.return_value = 0
+        breaker = CircuitBreaker("test", failures=2, reset_timeout=10)
+        breaker.record(False)
+        breaker.record(True)
+        breaker.record(False)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record(False)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+    @mock.patch("stamp_service.http_client.time.monotonic")
+    def test_lets_one_call_through_after_reset_timeout(self, monotonic):
+        monotonic.return_value = 0
+        breaker = CircuitBreaker("test", failures=1, reset_timeout=10)
+        breaker.record(False)
+        monotonic.return_value = 10
+        breaker.before_call()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+        # A failed trial opens the circuit again
+        breaker.record(False)
+        self.assertEqual(breaker.state, OPEN)
+        monotonic.return_value = 20
+        breaker.before_call()
+        breaker.record(True)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.before_call()
+
+
+class TestHTTPClient(unittest.TestCase):
+    def test_backoff_is_jittered(self):
+        retry = JitteredRetry(total=5, backoff_factor=1)
+        retry = retry.increment(method="GET", url="/").increment(method="GET", url="/")
+        backoffs = {retry.get_backoff_time() for _ in range(20)}
+        self.assertGreater(len(backoffs), 1)
+        self.assertTrue(all(0 <= backoff <= 2 for backoff in backoffs))
+
+    def test_server_errors_open_the_circuit(self):
+        with FakeMARS() as mars:
+            client = HTTPClient("test", {"breaker_failures": 1, "breaker_reset": 60})
+            mars.failures = 1
+            self.assertEqual(
+                client.get(mars.url, params={"candid": 1}).status_code, 503
+            )
+            with self.assertRaises(CircuitOpen):
+                client.get(mars.url, params={"candid": 1})
+
+    def test_timeouts(self):
+        client = HTTPClient("test", {"connect_timeout": 1, "read_timeout": 2})
+        self.assertEqual(client.timeout, (1, 2))
+
+    def test_new_session_after_fork(self):
+        client = HTTPClient("test")
+        session = client._session.get()
+        self.assertIs(client._session.get(), session)
+        with mock.patch("stamp_service.per_process.os.getpid", return_value=-1):
+            self.assertIsNot(client._session.get(), session)
@@ -0,0 +1,33 @@
+import unittest
+
+from stamp_service.latency import LatencyTracker
+
+
+class TestLatencyTracker(unittest.TestCase):
+    def test_percentile(self):
+        tracker = LatencyTracker("test")
+        for seconds in range(1, 101):
+            tracker.observe("ztf", seconds / 100)
+        self.assertEqual(tracker.percentile("ztf", 95), 0.95)
+        self.assertEqual(tracker.percentile("ztf", 100), 1)
+        self.assertEqual(tracker.percentile("ztf", 0), 0.01)
+
+    def test_surveys_are_tracked_separately(self):
+        tracker = LatencyTracker("test")
+        tracker.observe("ztf", 1)
+        tracker.observe("atlas", 2)
+        self.assertEqual(tracker.percentile("ztf", 50), 1)
+        self.assertEqual(tracker.percentile("atlas", 50), 2)
+
+    def test_min_samples(self):
+        tracker = LatencyTracker("test")
+        self.assertIsNone(tracker.percentile("ztf", 50))
+        tracker.observe("ztf", 1)
+        self.assertIsNone(tracker.percentile("ztf", 50, min_samples=2))
+        self.assertEqual(tracker.percentile("ztf", 50, min_samples=1), 1)
+
+    def test_only_the_last_samples_are_kept(self):
+        tracker = LatencyTracker("test", window=2)
+        for seconds in (10, 1, 1):
+            tracker.observe("ztf", seconds)
+        self.assertEqual(tracker.percentile("ztf", 100), 1)
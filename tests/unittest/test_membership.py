@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+
+import boto3
+from moto import mock_s3
+
+from stamp_service.membership import BloomFilter, build, main
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_added_keys_are_found(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        keys = [f"{i}.avro" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"{i}.avro")
+        false_positives = sum(f"{i}.avro" in bloom for i in range(1000, 11000))
+        self.assertLess(false_positives, 300)
+
+    def test_save_and_load(self):
+        bloom = BloomFilter.for_capacity(100)
+        bloom.add("a.avro")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "filter")
+            bloom.save(path)
+            loaded = BloomFilter.load(path)
+            self.assertEqual(loaded.nbits, bloom.nbits)
+            self.assertIn("a.avro", loaded)
+            self.assertNotIn("b.avro", loaded)
+            # Keys added after loading don't modify the file
+            loaded.add("b.avro")
+            self.assertIn("b.avro", loaded)
+            self.assertNotIn("b.avro", BloomFilter.load(path))
+
+    def test_load_rejects_other_files(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"not a filter" * 10)
+            f.flush()
+            with self.assertRaises(ValueError):
+                BloomFilter.load(f.name)
+
+
+@mock_s3
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+        os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+        self.client = boto3.client("s3", region_name="us-east-1")
+        self.client.create_bucket(Bucket="test_bucket")
+        for key in ("1.avro", "2.avro"):
+            self.client.put_object(Bucket="test_bucket", Key=key, Body=b"avro")
+
+    def test_build(self):
+        bloom = build(self.client, "test_bucket", 100)
+        self.assertIn("1.avro", bloom)
+        self.assertIn("2.avro", bloom)
+        self.assertNotIn("3.avro", bloom)
+
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "filter")
+            main(["--bucket", "test_bucket", "--capacity", "100", "--output", path])
+            self.assertIn("1.avro", BloomFilter.load(path))
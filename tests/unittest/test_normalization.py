@@ -0,0 +1,87 @@
+import glob
+import os
+import unittest
+import warnings
+import numpy as np
+import fastavro
+from stamp_service import normalization, fits2png, utils
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "../examples/avro_test")
+
+
+def reference_limits(data, window):
+    x = data.shape[0] // 2
+    y = data.shape[1] // 2
+    center = data[x - window : x + window, y - window : y + window]
+    max_val = np.nanmax(center)
+    min_val = np.nanmin(data) + 0.2 * np.nanmedian(np.abs(data - np.nanmedian(data)))
+    return max_val, min_val
+
+
+class TestGetLimits(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        np.random.seed(616)
+        with_nan = np.random.normal(size=(11, 11)).astype(">f4")
+        with_nan[2, 3] = np.nan
+        cls.stamps = [
+            np.random.random((10, 10)),
+            np.random.normal(size=(9, 9)).astype(">f4"),
+            with_nan,
+        ]
+        for path in glob.glob(f"{EXAMPLES_PATH}/**/*.avro", recursive=True):
+            with open(path, "rb") as f:
+                avro = next(fastavro.reader(f))
+            for stype in utils.STAMP_KEYS:
+                stamp = utils.get_stamp_type(avro, stype)
+                cls.stamps.append(fits2png._read_compressed_fits(stamp).data)
+
+    def test_identical_to_reference_formula(self):
+        for data in self.stamps:
+            self.assertEqual(
+                reference_limits(data, 2), normalization.get_limits(data, 2)
+            )
+
+    def test_integer_stamps(self):
+        # FITS cutouts without BZERO/BSCALE keep their integer BITPIX
+        for dtype in [">i2", ">i4"]:
+            data = np.random.randint(-30000, 30000, size=(8, 8)).astype(dtype)
+            data[0, 0] = np.iinfo(dtype).max
+            data[0, 1] = np.iinfo(dtype).min
+            self.assertEqual(
+                reference_limits(data, 2), normalization.get_limits(data, 2)
+            )
+            max_val, min_val = normalization.get_limits_batch(np.stack([data]), 2)
+            self.assertEqual(reference_limits(data, 2), (max_val[0], min_val[0]))
+
+    def test_does_not_modify_data(self):
+        data = np.random.random((9, 9))
+        copy = data.copy()
+        normalization.get_limits(data, 2)
+        np.testing.assert_array_equal(data, copy)
+
+    def test_all_nan(self):
+        data = np.full((5, 5), np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            _, min_val = normalization.get_limits(data, 1)
+        self.assertTrue(np.isnan(min_val))
+
+    def test_batch_identical_to_reference_formula(self):
+        same_shape = [data for data in self.stamps if data.shape == (63, 63)]
+        for stack in [np.stack(same_shape[:3]), np.stack(same_shape)]:
+            max_val, min_val = normalization.get_limits_batch(stack, 2)
+            for i, data in enumerate(stack):
+                self.assertEqual(reference_limits(data, 2), (max_val[i], min_val[i]))
+
+    def test_batch_with_nan(self):
+        stack = np.random.random((3, 8, 8))
+        stack[1, 0, 0] = np.nan
+        max_val, min_val = normalization.get_limits_batch(stack, 2)
+        for i, data in enumerate(stack):
+            self.assertEqual(reference_limits(data, 2), (max_val[i], min_val[i]))
+
+    def test_scratch_buffer_is_reused(self):
+        first = normalization._scratch((10,), np.float32)
+        second = normalization._scratch((5,), np.float32)
+        self.assertTrue(np.shares_memory(first, second))
@@ -0,0 +1,38 @@
+import threading
+import unittest
+from unittest import mock
+from stamp_service.per_process import PerProcess
+
+
+class TestPerProcess(unittest.TestCase):
+    def test_created_on_first_use(self):
+        factory = mock.Mock(side_effect=object)
+        value = PerProcess(factory)
+        self.assertIsNone(value.peek())
+        factory.assert_not_called()
+        created = value.get()
+        self.assertIs(value.get(), created)
+        self.assertIs(value.peek(), created)
+        factory.assert_called_once_with()
+
+    def test_created_again_after_fork(self):
+        value = PerProcess(object)
+        created = value.get()
+        with mock.patch("stamp_service.per_process.os.getpid", return_value=-1):
+            self.assertIsNone(value.peek())
+            self.assertIsNot(value.get(), created)
+
+    def test_created_once_by_concurrent_threads(self):
+        factory = mock.Mock(side_effect=object)
+        value = PerProcess(factory)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(value.get()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(result) for result in results}), 1)
+        factory.assert_called_once_with()
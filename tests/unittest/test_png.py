@@ -0,0 +1,25 @@
+import io
+import unittest
+import numpy as np
+from matplotlib import image
+from stamp_service import png
+
+
+class TestEncode(unittest.TestCase):
+    def test_encode_grayscale(self):
+        gray = np.arange(12, dtype=np.uint8).reshape(3, 4) * 20
+
+        out = image.imread(io.BytesIO(png.encode(gray)))
+        self.assertEqual(out.shape, (3, 4))
+        np.testing.assert_array_equal(np.round(out * 255), gray)
+
+    def test_encode_grayscale_with_alpha(self):
+        gray = np.full((3, 4), 100, dtype=np.uint8)
+        alpha = np.full((3, 4), 255, dtype=np.uint8)
+        alpha[0, 1] = 0
+
+        out = image.imread(io.BytesIO(png.encode(gray, alpha)))
+        # Gray and alpha images are read back as RGBA
+        self.assertEqual(out.shape, (3, 4, 4))
+        np.testing.assert_array_equal(np.round(out[..., 0] * 255), gray)
+        np.testing.assert_array_equal(np.round(out[..., 3] * 255), alpha)
@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+from scipy import ndimage
+from stamp_service import rotation
+
+
+class TestRotate(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        np.random.seed(616)
+        y, x = np.indices((63, 63))
+        source = 100 * np.exp(-((x - 33) ** 2 + (y - 30) ** 2) / 8)
+        cls.data = (source + np.random.normal(size=(63, 63))).astype(">f4")
+
+    def test_quantize(self):
+        self.assertEqual(rotation.quantize(90), 900)
+        self.assertEqual(rotation.quantize(-90), 2700)
+        self.assertEqual(rotation.quantize(360.02), 0)
+        self.assertEqual(rotation.quantize(37.34), 373)
+
+    def test_multiples_of_90_are_exact(self):
+        for angle in [0, 90, 180, 270, -90, 450]:
+            expected = ndimage.rotate(self.data, angle)
+            np.testing.assert_allclose(
+                rotation.rotate(self.data, angle), expected, atol=1e-3
+            )
+
+    def test_arbitrary_angles_are_close_to_ndimage(self):
+        for angle in [12.1, 37.3, 301.7]:
+            expected = ndimage.rotate(self.data, angle)
+            out = rotation.rotate(self.data, angle)
+            self.assertEqual(expected.shape, out.shape)
+            error = np.abs(expected - out)
+            self.assertLess(np.median(error), 0.05)
+            self.assertLess(error.max(), 0.05 * np.ptp(self.data))
+
+    def test_coordinate_maps_are_cached_per_angle_and_shape(self):
+        rotation._coordinate_map.cache_clear()
+        rotation.rotate(self.data, 37.3)
+        rotation.rotate(self.data, 37.31)
+        rotation.rotate(self.data[:50], 37.3)
+        info = rotation._coordinate_map.cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 2)
+
+    def test_spline_method_uses_ndimage(self):
+        np.testing.assert_array_equal(
+            rotation.rotate(self.data, 37.3, method="spline"),
+            ndimage.rotate(self.data, 37.3),
+        )
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            rotation.rotate(self.data, 37.3, method="other")
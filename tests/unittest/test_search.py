@@ -1,6 +1,20 @@
+import threading
 import unittest
 from unittest import mock
-from stamp_service.search import S3Searcher, MARSSearcher, boto3, io
+import tempfile
+from stamp_service.search import (
+    S3Searcher,
+    MARSSearcher,
+    NegativeCache,
+    AvroDiskCache,
+    Config,
+    boto3,
+    client_config,
+    io,
+)
+from stamp_service.membership import BloomFilter
+from stamp_service.http_client import CircuitOpen
+from fake_mars import FakeMARS
 from moto import mock_s3
 import os
 
@@ -44,6 +58,120 @@ class TestS3Searcher(unittest.TestCase):
         file = self.searcher.get_file_from_s3(candid, "ztf")
         self.assertIsInstance(file, io.BytesIO)
 
+    def test_open_file_from_s3(self):
+        candid = "820128985515010010"
+        s3_object = self.searcher.open_file_from_s3(candid, "ztf")
+        data = b"".join(s3_object.body.iter_chunks(1024))
+        s3_object.body.close()
+        self.assertEqual(len(data), s3_object.content_length)
+        self.assertEqual(data, self.searcher.get_file_from_s3(candid, "ztf").read())
+        self.assertTrue(s3_object.etag.startswith('"'))
+
+    def test_open_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            self.searcher.open_file_from_s3("123", "ztf")
+
+    def test_miss_is_cached(self):
+        self.searcher.init(TEST_BUCKET_CONFIG, client=self.client, miss_ttl=60)
+        with mock.patch.object(
+            self.client, "get_object", wraps=self.client.get_object
+        ) as get_object:
+            for _ in range(2):
+                with self.assertRaises(FileNotFoundError):
+                    self.searcher.get_file_from_s3("123", "ztf")
+        get_object.assert_called_once()
+
+    def test_upload_clears_cached_miss(self):
+        self.searcher.init(TEST_BUCKET_CONFIG, client=self.client, miss_ttl=60)
+        with self.assertRaises(FileNotFoundError):
+            self.searcher.get_file_from_s3("123", "ztf")
+        self.searcher.upload_file(io.BytesIO(b"avro"), "321.avro", "ztf")
+        self.assertEqual(self.searcher.get_file_from_s3("123", "ztf").read(), b"avro")
+
+    def test_disk_cache(self):
+        candid = "820128985515010010"
+        with tempfile.TemporaryDirectory() as directory:
+            self.searcher.init(
+                TEST_BUCKET_CONFIG,
+                client=self.client,
+                disk_cache={"directory": directory, "max_bytes": 10**6},
+            )
+            data = self.searcher.get_file_from_s3(candid, "ztf").read()
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(directory, "ztf", "01", f"{candid[::-1]}.avro")
+                )
+            )
+            with mock.patch.object(self.client, "get_object") as get_object:
+                self.assertEqual(
+                    self.searcher.get_file_from_s3(candid, "ztf").read(), data
+                )
+                s3_object = self.searcher.open_file_from_s3(candid, "ztf")
+                self.assertEqual(b"".join(s3_object.body.iter_chunks(1000)), data)
+                self.assertEqual(s3_object.content_length, len(data))
+            get_object.assert_not_called()
+
+    def test_shared_cache(self):
+        candid = "820128985515010010"
+        with tempfile.TemporaryDirectory() as directory:
+            self.searcher.init(
+                TEST_BUCKET_CONFIG,
+                client=self.client,
+                shared_cache={"directory": directory, "size": 10**6},
+            )
+            data = self.searcher.get_file_from_s3(candid, "ztf").read()
+            self.assertEqual(self.searcher.shared.get(f"ztf/{candid}"), data)
+            with mock.patch.object(self.client, "get_object") as get_object:
+                s3_object = self.searcher.open_file_from_s3(candid, "ztf")
+                self.assertEqual(b"".join(s3_object.body.iter_chunks(1000)), data)
+            get_object.assert_not_called()
+            self.searcher.shared.close()
+
+    def test_membership_filter(self):
+        candid = "820128985515010010"
+        bloom = BloomFilter.for_capacity(100)
+        bloom.add(f"{candid[::-1]}.avro")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "filter")
+            bloom.save(path)
+            config = {"ztf": dict(TEST_BUCKET_CONFIG["ztf"], membership_filter=path)}
+            self.searcher.init(config, client=self.client)
+        self.searcher.get_file_from_s3(candid, "ztf")
+        with mock.patch.object(self.client, "get_object") as get_object:
+            with self.assertRaises(FileNotFoundError):
+                self.searcher.get_file_from_s3("123", "ztf")
+        get_object.assert_not_called()
+        self.searcher.upload_file(io.BytesIO(b"avro"), "321.avro", "ztf")
+        self.assertEqual(self.searcher.get_file_from_s3("123", "ztf").read(), b"avro")
+
+    def test_membership_filter_only_for_surveys_in_mars(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "filter")
+            BloomFilter.for_capacity(100).save(path)
+            config = {"atlas": {"bucket": "test_bucket", "membership_filter": path}}
+            with self.assertLogs("stamp_service.search", "WARNING"):
+                self.searcher.init(config, client=self.client)
+        self.assertEqual(self.searcher.filters, {})
+        avro = self.searcher.get_file_from_s3("820128985515010010", "atlas")
+        self.assertIsInstance(avro, io.BytesIO)
+
+    def test_read_file(self):
+        self.searcher.upload_file(io.BytesIO(b"bundle"), "bundles/oid.zip", "ztf")
+        self.assertEqual(self.searcher.read_file("bundles/oid.zip", "ztf"), b"bundle")
+        with self.assertRaises(FileNotFoundError):
+            self.searcher.read_file("bundles/other.zip", "ztf")
+
+    def test_delete_files(self):
+        for name in ["bundles/oid/a.zip", "bundles/oid/b.zip", "bundles/other/a.zip"]:
+            self.searcher.upload_file(io.BytesIO(b"bundle"), name, "ztf")
+        self.searcher.delete_files("bundles/oid/", "ztf", keep=("bundles/oid/b.zip",))
+        with self.assertRaises(FileNotFoundError):
+            self.searcher.read_file("bundles/oid/a.zip", "ztf")
+        self.assertEqual(self.searcher.read_file("bundles/oid/b.zip", "ztf"), b"bundle")
+        self.assertEqual(
+            self.searcher.read_file("bundles/other/a.zip", "ztf"), b"bundle"
+        )
+
     def test_upload_file(self):
         file = io.BytesIO()
         self.assertEqual(
@@ -54,24 +182,152 @@ class TestS3Searcher(unittest.TestCase):
             len(self.client.list_objects(Bucket="test_bucket")["Contents"]), 2
         )
 
+    def test_clients(self):
+        config = {
+            "ztf": dict(
+                TEST_BUCKET_CONFIG["ztf"],
+                client={"max_pool_connections": 50, "read_timeout": 5},
+            ),
+            "atlas": {"id": "atlas", "bucket": "test_bucket"},
+        }
+        self.searcher.init(config)
+        self.assertIsNone(self.searcher._clients.peek())
+        file = self.searcher.get_file_from_s3("820128985515010010", "ztf")
+        self.assertIsInstance(file, io.BytesIO)
+        client = self.searcher.get_client("ztf")
+        self.assertIs(self.searcher.get_client("ztf"), client)
+        self.assertEqual(client.meta.config.max_pool_connections, 50)
+        self.assertEqual(client.meta.config.read_timeout, 5)
+        self.assertEqual(client.meta.config.retries["mode"], "adaptive")
+        self.assertTrue(client.meta.config.tcp_keepalive)
+        atlas_client = self.searcher.get_client("atlas")
+        self.assertIsNot(atlas_client, client)
+        self.assertEqual(atlas_client.meta.config.max_pool_connections, 32)
+
+    def test_client_config_without_tcp_keepalive(self):
+        # botocore without the option, e.g. the one of the pinned boto3
+        defaults = dict(Config.OPTION_DEFAULTS)
+        del defaults["tcp_keepalive"]
+        with mock.patch.object(Config, "OPTION_DEFAULTS", defaults):
+            config = client_config({"tcp_keepalive": True})
+        self.assertEqual(config.max_pool_connections, 32)
+
+    def test_clients_are_created_again_after_fork(self):
+        self.searcher.init(TEST_BUCKET_CONFIG)
+        client = self.searcher.get_client("ztf")
+        with mock.patch("stamp_service.per_process.os.getpid", return_value=-1):
+            self.assertIsNot(self.searcher.get_client("ztf"), client)
+
 
 class TestMARSSearcher(unittest.TestCase):
     def setUp(self):
+        self.mars = FakeMARS()
+        self.mars.__enter__()
         self.searcher = MARSSearcher()
-        self.searcher.init(mars_url="fake_url")
+        self.searcher.init(mars_url=self.mars.url, http={"backoff": 0.01})
 
     def tearDown(self):
+        self.mars.__exit__()
         del self.searcher
 
-    @mock.patch("requests.get")
-    @mock.patch.object(MARSSearcher, "check_response")
-    @mock.patch("stamp_service.search.urlopen")
-    def test_get_file_from_mars(self, mock_open, mock_check_response, mock_get):
-        mock_get.return_value.json.return_value = {"results": [{"avro": "avro"}]}
-        mock_open.return_value.__enter__.return_value.read.return_value = b"avro"
-        mock_get.return_value.status_code = 200
+    def test_get_file_from_mars(self):
+        self.mars.add("oid", 123, b"avro")
         resp = self.searcher.get_file_from_mars("oid", 123)
         self.assertIsInstance(resp, io.BytesIO)
+        self.assertEqual(resp.read(), b"avro")
+
+    def test_get_avro_urls(self):
+        for candid in (3, 1, 2):
+            self.mars.add("oid", candid, f"avro {candid}".encode())
+        self.mars.add("other", 4, b"avro")
+        avro_urls = self.searcher.get_avro_urls("oid")
+        self.assertEqual(list(avro_urls), [1, 2, 3])
+        # Two pages of two alerts
+        self.assertEqual(len(self.mars.requests), 2)
+        # The avros are downloaded without querying their candid
+        resp = self.searcher.get_file_from_mars("oid", 2, avro_urls[2])
+        self.assertEqual(resp.read(), b"avro 2")
+        self.assertEqual(self.mars.requests[-1], "GET /avro/2")
+        self.assertEqual(len(self.mars.requests), 3)
+
+    def test_mars_miss_is_cached(self):
+        self.searcher.init(mars_url=self.mars.url, miss_ttl=60)
+        for _ in range(2):
+            with self.assertRaises(FileNotFoundError):
+                self.searcher.get_file_from_mars("oid", 123)
+        self.assertEqual(len(self.mars.requests), 1)
+
+    def test_mars_error_is_not_cached(self):
+        self.searcher.init(mars_url=self.mars.url, miss_ttl=60)
+        self.mars.failures = 2
+        self.mars.failure_status = 500
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.searcher.get_file_from_mars("oid", 123)
+        self.assertEqual(len(self.mars.requests), 2)
+
+    def test_failed_requests_are_retried(self):
+        self.searcher.init(mars_url=self.mars.url, http={"retries": 2, "backoff": 0.01})
+        self.mars.add("oid", 123, b"avro")
+        self.mars.failures = 2
+        self.assertEqual(self.searcher.get_file_from_mars("oid", 123).read(), b"avro")
+        self.assertEqual(len(self.mars.requests), 4)
+
+    def test_unhealthy_mars_is_not_called(self):
+        self.searcher.init(
+            mars_url=self.mars.url, http={"breaker_failures": 2, "breaker_reset": 60}
+        )
+        self.mars.failures = 10
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.searcher.get_file_from_mars("oid", 123)
+        with self.assertRaises(CircuitOpen):
+            self.searcher.get_file_from_mars("oid", 123)
+        self.assertEqual(len(self.mars.requests), 2)
+
+    def test_connections_are_reused(self):
+        self.mars.add("oid", 123, b"avro")
+        self.mars.add("oid", 456, b"avro")
+        self.searcher.get_file_from_mars("oid", 123)
+        self.searcher.get_file_from_mars("oid", 456)
+        self.assertEqual(len(self.mars.requests), 4)
+        self.assertEqual(len(self.mars.connections), 1)
+
+    def get_concurrently(self, candids):
+        results = {}
+
+        def get(candid):
+            try:
+                results[candid] = self.searcher.get_file_from_mars("oid", candid).read()
+            except FileNotFoundError:
+                results[candid] = None
+
+        threads = [threading.Thread(target=get, args=(c,)) for c in candids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_bulk_queries(self):
+        self.searcher.init(mars_url=self.mars.url, batch={"window": 0.5})
+        for candid in range(1, 10):
+            self.mars.add("oid", candid, f"avro {candid}".encode())
+        results = self.get_concurrently(range(1, 11))
+        self.assertEqual(results[3], b"avro 3")
+        self.assertIsNone(results[10])
+        queries = [r for r in self.mars.requests if not r.startswith("GET /avro/")]
+        self.assertEqual(queries, ["POST /?format=json"])
+
+    def test_bulk_queries_fall_back_to_single_queries(self):
+        self.mars.bulk = False
+        self.searcher.init(mars_url=self.mars.url, batch={"window": 0.01})
+        self.mars.add("oid", 1, b"avro")
+        self.assertEqual(self.get_concurrently([1, 2]), {1: b"avro", 2: None})
+        self.assertIsNone(self.searcher._batcher)
+        self.assertEqual(self.get_concurrently([1]), {1: b"avro"})
+        posts = [r for r in self.mars.requests if r.startswith("POST")]
+        self.assertEqual(len(posts), 1)
 
     def test_check_response(self):
         resp = {
@@ -113,3 +369,81 @@ class TestMARSSearcher(unittest.TestCase):
             self.searcher.check_response(resp6, "oid", 123)
         with self.assertRaises(AssertionError) as context:
             self.searcher.check_response(resp7, "oid", 123)
+
+
+class TestNegativeCache(unittest.TestCase):
+    def test_disabled_by_default(self):
+        cache = NegativeCache("test")
+        cache.add("key")
+        self.assertNotIn("key", cache)
+
+    @mock.patch("stamp_service.search.time.monotonic")
+    def test_entries_expire(self, monotonic):
+        monotonic.return_value = 0
+        cache = NegativeCache("test", ttl=10)
+        cache.add("key")
+        monotonic.return_value = 9
+        self.assertIn("key", cache)
+        monotonic.return_value = 10
+        self.assertNotIn("key", cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_max_entries(self):
+        cache = NegativeCache("test", ttl=10, max_entries=2)
+        for key in ["a", "b", "c"]:
+            cache.add(key)
+        self.assertNotIn("a", cache)
+        self.assertIn("c", cache)
+
+    def test_discard(self):
+        cache = NegativeCache("test", ttl=10)
+        cache.add("key")
+        cache.discard("key")
+        self.assertNotIn("key", cache)
+
+
+class TestAvroDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = AvroDiskCache(self.tmp.name, max_bytes=10**6)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_set_and_get(self):
+        self.cache.set(("ztf", "123"), b"avro")
+        value = self.cache.get(("ztf", "123"))
+        self.assertEqual(value, b"avro")
+        self.assertIsInstance(value, bytes)
+        self.assertIsNone(self.cache.get(("ztf", "456")))
+        self.assertIsNone(self.cache.get(("atlas", "123")))
+
+    def test_corrupt_file_is_removed(self):
+        self.cache.set(("ztf", "123"), b"avro")
+        path = self.cache._path(("ztf", "123"))
+        with open(path, "r+b") as f:
+            f.write(b"AVRO")
+        self.assertIsNone(self.cache.get(("ztf", "123")))
+        self.assertFalse(os.path.exists(path))
+
+    def test_keys_outside_the_directory(self):
+        cache_dir = os.path.join(self.tmp.name, "cache")
+        cache = AvroDiskCache(cache_dir, max_bytes=10**6)
+        cache.set(("ztf", "123"), b"avro")
+        victim = os.path.join(self.tmp.name, "victim", "x.avro")
+        os.makedirs(os.path.dirname(victim))
+        with open(victim, "wb") as f:
+            f.write(b"not an avro")
+        # Reversed, the candid is ../victim/x
+        with self.assertRaises(ValueError):
+            cache.get(("ztf", "x/mitciv/.."))
+        self.assertTrue(os.path.exists(victim))
+
+    def test_truncated_and_empty_files(self):
+        for content in [b"", b"avro"]:
+            self.cache.set(("ztf", "123"), b"avro")
+            path = self.cache._path(("ztf", "123"))
+            with open(path, "wb") as f:
+                f.write(content)
+            self.assertIsNone(self.cache.get(("ztf", "123")))
+            self.assertFalse(os.path.exists(path))
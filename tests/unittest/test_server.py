@@ -11,7 +11,14 @@ CONFIG_FILE_PATH = os.path.join(FILE_PATH, "../test_config.yml")
 os.environ["BUCKET_NAME"] = "test_bucket"
 os.environ["MARS_URL"] = "test_url"
 from stamp_service.server import create_app
+from stamp_service.search import S3Object
+from stamp_service import http_cache, utils
+from stamp_service.alerts import alert_cache
+from stamp_service.hedging import hedged_fetcher
 import io
+import threading
+import json
+import zipfile
 
 
 def create_token(permisions, filters, secret_key):
@@ -43,7 +50,7 @@ class TestStampResource(unittest.TestCase):
     @mock.patch("stamp_service.utils.get_stamp_type")
     @mock.patch("stamp_service.utils.format_stamp")
     @mock.patch("stamp_service.resources.send_file")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     def test_get_stamp_s3(
         self, reader, send_file, format_stamp, get_stamp_type, get_avro_from_s3
     ):
@@ -54,10 +61,77 @@ class TestStampResource(unittest.TestCase):
         self.assertEqual(rv.json, "ok")
 
     @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
+    @mock.patch("stamp_service.resources.stamp_cache")
+    @mock.patch("stamp_service.resources.send_file")
+    def test_get_stamp_cached(self, send_file, stamp_cache, get_avro_from_s3):
+        stamp_cache.enabled = True
+        stamp_cache.get.return_value = b"png"
+        send_file.return_value = "ok"
+        args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
+        rv = self.client.get("/get_stamp", query_string=args)
+        self.assertEqual(rv.json, "ok")
+        get_avro_from_s3.assert_not_called()
+        self.assertEqual(send_file.call_args.args[0].read(), b"png")
+
+    @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
+    def test_get_stamp_not_modified(self, get_avro_from_s3):
+        etag = http_cache.resource_etag(
+            "stamp",
+            "oid",
+            utils.stamp_cache_key("ztf", "123", "science", "png", "numpy"),
+        )
+        args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
+        headers = {"If-None-Match": f'"{etag}"'}
+        rv = self.client.get("/get_stamp", query_string=args, headers=headers)
+        self.assertEqual(rv.status_code, 304)
+        get_avro_from_s3.assert_not_called()
+
+    @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
+    @mock.patch("stamp_service.resources.stamp_cache")
     @mock.patch("stamp_service.utils.get_stamp_type")
     @mock.patch("stamp_service.utils.format_stamp")
     @mock.patch("stamp_service.resources.send_file")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
+    def test_get_stamp_s3_is_cached(
+        self,
+        reader,
+        send_file,
+        format_stamp,
+        get_stamp_type,
+        stamp_cache,
+        get_avro_from_s3,
+    ):
+        stamp_cache.enabled = True
+        stamp_cache.get.return_value = None
+        format_stamp.return_value = (io.BytesIO(b"png"), "image/png", "fname")
+        send_file.return_value = "ok"
+        args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
+        rv = self.client.get("/get_stamp", query_string=args)
+        self.assertEqual(rv.json, "ok")
+        stamp_cache.set.assert_called_once()
+        self.assertEqual(stamp_cache.set.call_args.args[1], b"png")
+
+    @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
+    @mock.patch("stamp_service.utils.format_stamps")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
+    def test_get_all_stamps_s3(self, reader, format_stamps, get_avro_from_s3):
+        stamps = {
+            "science": {
+                "file": "c2NpZW5jZQ==",
+                "mimetype": "image/png",
+                "download_name": "oid_123_science.png",
+            }
+        }
+        format_stamps.return_value = stamps
+        args = {"oid": "oid", "candid": 123, "type": "all", "format": "png"}
+        rv = self.client.get("/get_stamp", query_string=args)
+        self.assertEqual(rv.json, stamps)
+
+    @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
+    @mock.patch("stamp_service.utils.get_stamp_type")
+    @mock.patch("stamp_service.utils.format_stamp")
+    @mock.patch("stamp_service.resources.send_file")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     @unittest.skip("removed filter in stamps")
     def test_get_stamp_s3_filter_atlas(
         self, reader, send_file, format_stamp, get_stamp_type, get_avro_from_s3
@@ -80,7 +154,7 @@ class TestStampResource(unittest.TestCase):
     @mock.patch("stamp_service.utils.get_stamp_type")
     @mock.patch("stamp_service.utils.format_stamp")
     @mock.patch("stamp_service.resources.send_file")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     def test_get_stamp_s3_allow_atlas(
         self, reader, send_file, format_stamp, get_stamp_type, get_avro_from_s3
     ):
@@ -104,7 +178,7 @@ class TestStampResource(unittest.TestCase):
     @mock.patch("stamp_service.resources.utils.get_stamp_type")
     @mock.patch("stamp_service.resources.utils.format_stamp")
     @mock.patch("stamp_service.resources.send_file")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     def test_get_stamp_not_found(
         self,
         fastavro_reader,
@@ -122,6 +196,22 @@ class TestStampResource(unittest.TestCase):
         rv = self.client.get("/get_stamp", query_string=args)
         self.assertEqual(rv.status, "404 NOT FOUND")
 
+    @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
+    @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
+    def test_get_stamp_not_found_outside_mars(
+        self, get_file_from_mars, get_file_from_s3
+    ):
+        get_file_from_s3.side_effect = FileNotFoundError
+        args = {"candid": 123, "type": "science", "format": "png", "survey_id": "atlas"}
+        rv = self.client.get("/get_stamp", query_string=args)
+        self.assertEqual(rv.status, "404 NOT FOUND")
+        # ATLAS alerts are not in MARS
+        get_file_from_mars.assert_not_called()
+        args = {"candid": 123, "survey_id": "atlas"}
+        rv = self.client.get("/get_avro_info", query_string=args)
+        self.assertEqual(rv.status, "404 NOT FOUND")
+        get_file_from_mars.assert_not_called()
+
 
 class TestAVROInfoResource(unittest.TestCase):
     def setUp(self):
@@ -136,11 +226,12 @@ class TestAVROInfoResource(unittest.TestCase):
         del self.client
 
     @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     @mock.patch("stamp_service.resources.jsonify")
     def test_get_avro_s3(self, jsonify, reader, get_file_from_s3):
         get_file_from_s3.return_value = b"data"
-        reader.next.return_value = {
+        reader.return_value = {
+            "candidate": {"candid": 123},
             "cutoutScience": {},
             "cutoutTemplate": {},
             "cutoutDifference": {},
@@ -151,11 +242,12 @@ class TestAVROInfoResource(unittest.TestCase):
         self.assertEqual(rv.json, "ok")
 
     @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     @mock.patch("stamp_service.resources.jsonify")
     def test_get_avro_s3_filter_atlas(self, jsonify, reader, get_file_from_s3):
         get_file_from_s3.return_value = b"data"
-        reader.next.return_value = {
+        reader.return_value = {
+            "candidate": {"candid": 123},
             "cutoutScience": {},
             "cutoutTemplate": {},
             "cutoutDifference": {},
@@ -174,11 +266,12 @@ class TestAVROInfoResource(unittest.TestCase):
         self.assertEqual(rv.json, None)
 
     @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     @mock.patch("stamp_service.resources.jsonify")
     def test_get_avro_s3_allow_atlas(self, jsonify, reader, get_file_from_s3):
         get_file_from_s3.return_value = b"data"
-        reader.next.return_value = {
+        reader.return_value = {
+            "candidate": {"candid": 123},
             "cutoutScience": {},
             "cutoutTemplate": {},
             "cutoutDifference": {},
@@ -199,7 +292,7 @@ class TestAVROInfoResource(unittest.TestCase):
     @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
     @mock.patch("stamp_service.resources.s3_searcher.upload_file")
     @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     @mock.patch("stamp_service.resources.jsonify")
     def test_get_stamp_mars(
         self,
@@ -211,7 +304,8 @@ class TestAVROInfoResource(unittest.TestCase):
     ):
         get_file_from_s3.side_effect = FileNotFoundError
         get_file_from_mars.return_value = io.BytesIO(b"test")
-        reader.next.return_value = {
+        reader.return_value = {
+            "candidate": {"candid": 123},
             "cutoutScience": {},
             "cutoutTemplate": {},
             "cutoutDifference": {},
@@ -224,7 +318,7 @@ class TestAVROInfoResource(unittest.TestCase):
     @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
     @mock.patch("stamp_service.resources.s3_searcher.upload_file")
     @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
-    @mock.patch("stamp_service.resources.fastavro.reader")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
     def test_get_stamp_not_found(
         self,
         fastavro_reader,
@@ -243,6 +337,7 @@ class TestAVROResource(unittest.TestCase):
     def setUp(self):
         application = create_app(CONFIG_FILE_PATH)
         application.config["TESTING"] = True
+        self.app = application
 
         self.SECRET_KEY = application.config["RALIDATOR_SETTINGS"]["SECRET_KEY"]
         with application.test_client() as client:
@@ -251,38 +346,91 @@ class TestAVROResource(unittest.TestCase):
     def tearDown(self):
         del self.client
 
+    def s3_object(self):
+        body = mock.MagicMock()
+        body.iter_chunks.return_value = iter([b"da", b"ta"])
+        return S3Object(body, 4, '"etag"')
+
+    @mock.patch("stamp_service.search.S3Searcher.open_file_from_s3")
+    def test_get_avro_s3(self, open_file_from_s3):
+        open_file_from_s3.return_value = self.s3_object()
+        args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
+        rv = self.client.get("/get_avro", query_string=args)
+        self.assertEqual(rv.data, b"data")
+        self.assertEqual(rv.headers["Content-Length"], "4")
+        self.assertIn("immutable", rv.headers["Cache-Control"])
+        self.assertIn("123.avro", rv.headers["Content-Disposition"])
+        open_file_from_s3.return_value.body.close.assert_called()
+
+    @mock.patch("stamp_service.search.S3Searcher.open_file_from_s3")
+    def test_get_avro_not_modified(self, open_file_from_s3):
+        open_file_from_s3.return_value = self.s3_object()
+        args = {"oid": "oid", "candid": 123}
+        etag = self.client.get("/get_avro", query_string=args).headers["ETag"]
+        rv = self.client.get(
+            "/get_avro", query_string=args, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(rv.status_code, 304)
+        open_file_from_s3.assert_called_once()
+
+    @mock.patch("stamp_service.search.S3Searcher.open_file_from_s3")
+    def test_filtered_avro_is_not_revalidated(self, open_file_from_s3):
+        open_file_from_s3.return_value = self.s3_object()
+        args = {"oid": "oid", "candid": 123, "survey_id": "atlas"}
+        etag = self.client.get("/get_avro", query_string=args).headers["ETag"]
+        token = create_token(["basic_user"], ["filter_atlas_avro"], self.SECRET_KEY)
+        headers = {"Authorization": f"bearer {token}", "If-None-Match": etag}
+        rv = self.client.get("/get_avro", query_string=args, headers=headers)
+        self.assertNotEqual(rv.status_code, 304)
+        self.assertNotIn("ETag", rv.headers)
+        self.assertEqual(rv.json, None)
+
     @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
     @mock.patch("stamp_service.resources.send_file")
-    def test_get_avro_s3(self, send_file, get_file_from_s3):
+    def test_get_avro_s3_without_streaming(self, send_file, get_file_from_s3):
+        self.app.config["STREAM_AVRO"] = False
         get_file_from_s3.return_value = b"data"
         send_file.return_value = "ok"
         args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
         rv = self.client.get("/get_avro", query_string=args)
         self.assertEqual(rv.json, "ok")
 
-    @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
-    @mock.patch("stamp_service.resources.send_file")
-    def test_get_avro_s3_filter_atlas(self, send_file, get_file_from_s3):
-        get_file_from_s3.return_value = b"data"
-        send_file.return_value = "ok"
+    @mock.patch("stamp_service.resources.s3_searcher.open_file_from_s3")
+    @mock.patch("stamp_service.resources.s3_searcher.upload_file")
+    @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
+    def test_get_avro_mars_upload_fails(
+        self,
+        get_file_from_mars,
+        upload_file,
+        open_file_from_s3,
+    ):
+        open_file_from_s3.side_effect = FileNotFoundError
+        get_file_from_mars.return_value = io.BytesIO(b"test")
+        upload_file.side_effect = Exception("S3 is down")
+        args = {"oid": "oid", "candid": 123}
+        rv = self.client.get("/get_avro", query_string=args)
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.data, b"test")
+
+    @mock.patch("stamp_service.search.S3Searcher.open_file_from_s3")
+    def test_get_avro_s3_filter_atlas(self, open_file_from_s3):
+        open_file_from_s3.return_value = self.s3_object()
         args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
         token = create_token(["basic_user"], ["filter_atlas_avro"], self.SECRET_KEY)
         headers = {"Authorization": f"bearer {token}"}
         rv = self.client.get("/get_avro", query_string=args, headers=headers)
         self.assertEqual(rv.json, None)
 
-    @mock.patch("stamp_service.search.S3Searcher.get_file_from_s3")
-    @mock.patch("stamp_service.resources.send_file")
-    def test_get_avro_s3_filter_atlas(self, send_file, get_file_from_s3):
-        get_file_from_s3.return_value = b"data"
-        send_file.return_value = "ok"
+    @mock.patch("stamp_service.search.S3Searcher.open_file_from_s3")
+    def test_get_avro_s3_allow_atlas(self, open_file_from_s3):
+        open_file_from_s3.return_value = self.s3_object()
         args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
         token = create_token(["basic_user"], ["no_filter"], self.SECRET_KEY)
         headers = {"Authorization": f"bearer {token}"}
         rv = self.client.get("/get_avro", query_string=args, headers=headers)
-        self.assertEqual(rv.json, "ok")
+        self.assertEqual(rv.data, b"data")
 
-    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    @mock.patch("stamp_service.resources.s3_searcher.open_file_from_s3")
     @mock.patch("stamp_service.resources.s3_searcher.upload_file")
     @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
     @mock.patch("stamp_service.resources.send_file")
@@ -291,26 +439,283 @@ class TestAVROResource(unittest.TestCase):
         send_file,
         get_file_from_mars,
         upload_file,
-        get_file_from_s3,
+        open_file_from_s3,
     ):
-        get_file_from_s3.side_effect = FileNotFoundError
+        open_file_from_s3.side_effect = FileNotFoundError
         get_file_from_mars.return_value = io.BytesIO(b"test")
         send_file.return_value = "ok"
         args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
         rv = self.client.get("/get_avro", query_string=args)
         self.assertEqual(rv.json, "ok")
 
-    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    @mock.patch("stamp_service.resources.s3_searcher.open_file_from_s3")
     @mock.patch("stamp_service.resources.s3_searcher.upload_file")
     @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
     def test_get_stamp_not_found(
         self,
         get_file_from_mars,
         upload_file,
-        get_file_from_s3,
+        open_file_from_s3,
     ):
-        get_file_from_s3.side_effect = FileNotFoundError
+        open_file_from_s3.side_effect = FileNotFoundError
         get_file_from_mars.side_effect = Exception
         args = {"oid": "oid", "candid": 123, "type": "science", "format": "png"}
         rv = self.client.get("/get_avro", query_string=args)
         self.assertEqual(rv.status, "404 NOT FOUND")
+
+    @mock.patch("stamp_service.resources.s3_searcher.open_file_from_s3")
+    def test_invalid_candid(self, open_file_from_s3):
+        for candid in ["x/mitciv/..", "123\n", "-1"]:
+            args = {"oid": "oid", "candid": candid}
+            for path in ["/get_avro", "/get_avro_info"]:
+                rv = self.client.get(path, query_string=args)
+                self.assertEqual(rv.status_code, 400)
+            rv = self.client.get(
+                "/get_stamp", query_string=dict(args, type="science", format="png")
+            )
+            self.assertEqual(rv.status_code, 400)
+        open_file_from_s3.assert_not_called()
+
+
+class TestAlertCache(unittest.TestCase):
+    def setUp(self):
+        application = create_app(CONFIG_FILE_PATH)
+        application.config["TESTING"] = True
+        alert_cache.init({"max_bytes": 10 * 1024**2})
+        with open(
+            os.path.join(EXAMPLES_PATH, "ZTF18/a/c/u/w/w/p/p/820128985515010010.avro"),
+            "rb",
+        ) as f:
+            self.avro = f.read()
+        with application.test_client() as client:
+            self.client = client
+
+    def tearDown(self):
+        alert_cache.init()
+        del self.client
+
+    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    def test_endpoints_share_one_download(self, get_file_from_s3):
+        get_file_from_s3.side_effect = lambda *args: io.BytesIO(self.avro)
+        args = {"oid": "oid", "candid": 820128985515010010}
+        rv = self.client.get("/get_avro_info", query_string=args)
+        self.assertEqual(rv.json["candidate"]["candid"], "820128985515010010")
+        for stype in ["science", "template", "difference"]:
+            stamp_args = dict(args, type=stype, format="fits")
+            rv = self.client.get("/get_stamp", query_string=stamp_args)
+            self.assertEqual(rv.status_code, 200)
+        rv = self.client.get("/get_avro", query_string=args)
+        self.assertEqual(rv.data, self.avro)
+        get_file_from_s3.assert_called_once()
+
+    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    def test_sent_files_are_not_revalidated(self, get_file_from_s3):
+        get_file_from_s3.side_effect = lambda *args: io.BytesIO(self.avro)
+        args = {"oid": "oid", "candid": 820128985515010010}
+        responses = [
+            self.client.get(
+                "/get_stamp", query_string=dict(args, type="science", format="png")
+            ),
+            # Sent from the alerts cache with send_file
+            self.client.get("/get_avro", query_string=args),
+        ]
+        for rv in responses:
+            self.assertEqual(rv.status_code, 200)
+            self.assertFalse(rv.cache_control.no_cache)
+            self.assertTrue(rv.cache_control.immutable)
+            self.assertEqual(rv.cache_control.max_age, http_cache.CACHE_MAX_AGE)
+
+
+class TestHedging(unittest.TestCase):
+    def setUp(self):
+        application = create_app(CONFIG_FILE_PATH)
+        application.config["TESTING"] = True
+        hedged_fetcher.init({"enabled": True, "max_delay": 0.05})
+        self.s3_released = threading.Event()
+        with application.test_client() as client:
+            self.client = client
+
+    def tearDown(self):
+        self.s3_released.set()
+        hedged_fetcher.init()
+        del self.client
+
+    @mock.patch("stamp_service.resources.s3_writeback.submit")
+    @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
+    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    @mock.patch("stamp_service.resources.avro_reader.read_alert")
+    @mock.patch("stamp_service.resources.jsonify")
+    def test_slow_s3_is_answered_from_mars(
+        self, jsonify, reader, get_file_from_s3, get_file_from_mars, submit
+    ):
+        get_file_from_s3.side_effect = lambda *args: self.s3_released.wait(5)
+        get_file_from_mars.return_value = io.BytesIO(b"test")
+        reader.return_value = {"candidate": {"candid": 123}}
+        jsonify.return_value = "ok"
+        args = {"oid": "oid", "candid": 123}
+        rv = self.client.get("/get_avro_info", query_string=args)
+        self.assertEqual(rv.json, "ok")
+        submit.assert_called_once_with(b"test", "123", "ztf")
+
+
+class TestStampsResource(unittest.TestCase):
+    def setUp(self):
+        application = create_app(CONFIG_FILE_PATH)
+        application.config["TESTING"] = True
+        with open(
+            os.path.join(EXAMPLES_PATH, "ZTF18/a/c/u/w/w/p/p/820128985515010010.avro"),
+            "rb",
+        ) as f:
+            self.avro = f.read()
+        with application.test_client() as client:
+            self.client = client
+
+    def tearDown(self):
+        del self.client
+
+    def get_zip(self, args):
+        rv = self.client.get("/get_stamps", query_string=args)
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.mimetype, "application/zip")
+        archive = zipfile.ZipFile(io.BytesIO(rv.data))
+        return archive, json.loads(archive.read("manifest.json"))
+
+    @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
+    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    def test_get_stamps(self, get_file_from_s3, get_file_from_mars):
+        def get_file(candid, survey_id):
+            if candid == "820128985515010010":
+                return io.BytesIO(self.avro)
+            raise FileNotFoundError
+
+        get_file_from_s3.side_effect = get_file
+        get_file_from_mars.side_effect = Exception
+        args = {"oid": "oid", "candids": "820128985515010010,123", "format": "fits"}
+        archive, manifest = self.get_zip(args)
+        entries = {entry["candid"]: entry for entry in manifest}
+        self.assertEqual(entries["123"]["status"], 404)
+        files = entries["820128985515010010"]["files"]
+        self.assertEqual(
+            files,
+            [
+                f"oid_820128985515010010_{stype}.fits.gz"
+                for stype in ["science", "template", "difference"]
+            ],
+        )
+        self.assertEqual(sorted(archive.namelist()), sorted(files + ["manifest.json"]))
+
+    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    def test_get_stamps_of_one_type(self, get_file_from_s3):
+        get_file_from_s3.side_effect = lambda *args: io.BytesIO(self.avro)
+        args = {"candids": "820128985515010010", "type": "science", "format": "png"}
+        archive, manifest = self.get_zip(args)
+        self.assertEqual(manifest[0]["files"], ["820128985515010010_science.png"])
+        self.assertTrue(
+            archive.read("820128985515010010_science.png").startswith(b"\x89PNG")
+        )
+
+    def test_too_many_candids(self):
+        candids = ",".join(str(candid) for candid in range(1000))
+        args = {"candids": candids, "format": "png"}
+        rv = self.client.get("/get_stamps", query_string=args)
+        self.assertEqual(rv.status_code, 400)
+
+    def test_invalid_candid(self):
+        args = {"candids": "123,x/mitciv/..", "format": "png"}
+        rv = self.client.get("/get_stamps", query_string=args)
+        self.assertEqual(rv.status_code, 400)
+
+
+class TestObjectStampsResource(unittest.TestCase):
+    def setUp(self):
+        application = create_app(CONFIG_FILE_PATH)
+        application.config["TESTING"] = True
+        with open(
+            os.path.join(EXAMPLES_PATH, "ZTF18/a/c/u/w/w/p/p/820128985515010010.avro"),
+            "rb",
+        ) as f:
+            self.avro = f.read()
+        with application.test_client() as client:
+            self.client = client
+
+    def tearDown(self):
+        del self.client
+
+    @mock.patch("stamp_service.resources.s3_searcher.delete_files")
+    @mock.patch("stamp_service.resources.s3_writeback.submit_object")
+    @mock.patch("stamp_service.resources.s3_searcher.read_file")
+    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    @mock.patch("stamp_service.resources.mars_searcher.get_avro_urls")
+    def test_bundle_is_built_and_stored(
+        self, get_avro_urls, get_file_from_s3, read_file, submit_object, delete_files
+    ):
+        get_avro_urls.return_value = {820128985515010010: "avro_url"}
+        get_file_from_s3.side_effect = lambda *args: io.BytesIO(self.avro)
+        read_file.side_effect = FileNotFoundError
+        args = {"oid": "ZTF18acuwwpp", "format": "fits"}
+        rv = self.client.get("/get_object_stamps", query_string=args)
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(rv.cache_control.no_cache)
+        archive = zipfile.ZipFile(io.BytesIO(rv.data))
+        manifest = json.loads(archive.read("manifest.json"))
+        self.assertEqual(len(manifest[0]["files"]), 3)
+        bundle, object_name, survey_id = submit_object.call_args[0]
+        self.assertEqual(bundle, rv.data)
+        self.assertTrue(object_name.startswith("bundles/ZTF18acuwwpp/"))
+        self.assertEqual(survey_id, "ztf")
+        # The bundles of other candids are deleted
+        delete_files.assert_called_once_with(
+            "bundles/ZTF18acuwwpp/", "ztf", keep=(object_name,)
+        )
+
+        read_file.side_effect = None
+        read_file.return_value = b"stored bundle"
+        rv = self.client.get("/get_object_stamps", query_string=args)
+        self.assertEqual(rv.data, b"stored bundle")
+        read_file.assert_called_with(object_name, "ztf")
+        get_file_from_s3.assert_called_once()
+
+        rv = self.client.get(
+            "/get_object_stamps",
+            query_string=args,
+            headers={"If-None-Match": rv.headers["ETag"]},
+        )
+        self.assertEqual(rv.status_code, 304)
+
+    @mock.patch("stamp_service.resources.s3_writeback.submit_object")
+    @mock.patch("stamp_service.resources.s3_searcher.read_file")
+    @mock.patch("stamp_service.resources.s3_searcher.get_file_from_s3")
+    @mock.patch("stamp_service.resources.mars_searcher.get_file_from_mars")
+    @mock.patch("stamp_service.resources.mars_searcher.get_avro_urls")
+    def test_incomplete_bundle_is_not_stored(
+        self,
+        get_avro_urls,
+        get_file_from_mars,
+        get_file_from_s3,
+        read_file,
+        submit_object,
+    ):
+        get_avro_urls.return_value = {123: "avro_url"}
+        get_file_from_s3.side_effect = FileNotFoundError
+        get_file_from_mars.side_effect = Exception
+        read_file.side_effect = FileNotFoundError
+        args = {"oid": "oid", "format": "png"}
+        rv = self.client.get("/get_object_stamps", query_string=args)
+        self.assertEqual(rv.status_code, 200)
+        manifest = json.loads(
+            zipfile.ZipFile(io.BytesIO(rv.data)).read("manifest.json")
+        )
+        self.assertEqual(manifest[0]["status"], 404)
+        submit_object.assert_not_called()
+        # The avro is downloaded from the URL of the objectId query
+        get_file_from_mars.assert_called_once_with("oid", 123, "avro_url")
+        # Nor cached, the missing alert may be found on the next request
+        self.assertNotIn("ETag", rv.headers)
+        self.assertNotIn("Cache-Control", rv.headers)
+
+    @mock.patch("stamp_service.resources.mars_searcher.get_avro_urls")
+    def test_object_not_found(self, get_avro_urls):
+        get_avro_urls.return_value = {}
+        args = {"oid": "oid", "format": "png"}
+        rv = self.client.get("/get_object_stamps", query_string=args)
+        self.assertEqual(rv.status_code, 404)
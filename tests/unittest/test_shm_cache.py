@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import unittest
+
+from stamp_service.metrics import CACHE_EVICTIONS
+from stamp_service.shm_cache import SEQUENCE, SharedMemoryCache
+
+
+def metric_value(metric, *labels):
+    return metric.labels(*labels)._value.get()
+
+
+def _set_in_other_process(directory, owner):
+    cache = SharedMemoryCache("test_shm", directory, 10**5, 1024, owner=owner)
+    cache.set("from_child", b"child value")
+    cache.close()
+
+
+class TestSharedMemoryCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+        self.cache = self.open()
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def open(self, name="test_shm", size=10**5, ways=4):
+        return SharedMemoryCache(
+            name, self.directory, size, 1024, ways, owner=os.getpid()
+        )
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", b"123")
+        self.assertEqual(self.cache.get("a"), b"123")
+        self.cache.set("a", b"4567")
+        self.assertEqual(self.cache.get("a"), b"4567")
+
+    def test_values_bigger_than_a_slot_are_not_stored(self):
+        self.cache.set("a", b"1" * 1024)
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_evicts_least_recently_used_slot_of_a_bucket(self):
+        self.cache.close()
+        # A single bucket of two slots
+        self.cache = self.open("test_shm_bucket", size=64 + 2 * 1024, ways=2)
+        evictions = metric_value(CACHE_EVICTIONS, "test_shm_bucket", "shared")
+        self.cache.set("a", b"1")
+        self.cache.set("b", b"2")
+        self.cache.get("a")
+        self.cache.set("c", b"3")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), b"1")
+        self.assertEqual(self.cache.get("c"), b"3")
+        self.assertEqual(
+            metric_value(CACHE_EVICTIONS, "test_shm_bucket", "shared"),
+            evictions + 1,
+        )
+
+    def test_slots_being_written_are_skipped(self):
+        self.cache.set("a", b"123")
+        slot = next(
+            slot
+            for slot in range(64, len(self.cache._map), 1024)
+            if SEQUENCE.unpack_from(self.cache._map, slot)[0]
+        )
+        SEQUENCE.pack_into(self.cache._map, slot, 3)
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_corrupt_values_are_ignored(self):
+        self.cache.set("a", b"123")
+        offset = self.cache._map.find(b"123")
+        self.cache._map[offset : offset + 3] = b"321"
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_shared_between_processes(self):
+        context = multiprocessing.get_context("spawn")
+        process = context.Process(
+            target=_set_in_other_process, args=(self.directory, os.getpid())
+        )
+        process.start()
+        process.join(30)
+        self.assertEqual(self.cache.get("from_child"), b"child value")
+
+    def test_files_of_stopped_owners_are_removed(self):
+        # The pid of a process that already exited
+        dead_pid = subprocess.Popen(["true"])
+        dead_pid.wait()
+        stale = SharedMemoryCache(
+            "test_shm", self.directory, 10**5, 1024, owner=dead_pid.pid
+        )
+        stale.close()
+        self.assertTrue(os.path.exists(stale.path))
+        self.open().close()
+        self.assertFalse(os.path.exists(stale.path))
+        self.assertTrue(os.path.exists(self.cache.path))
+
+    def test_other_settings_replace_the_file(self):
+        # e.g. workers started by a reload with a new slot size
+        self.cache.set("key", b"old value")
+        new = SharedMemoryCache(
+            "test_shm", self.directory, 10**5, 2048, owner=os.getpid()
+        )
+        other = SharedMemoryCache(
+            "test_shm", self.directory, 10**5, 2048, owner=os.getpid()
+        )
+        try:
+            self.assertIsNone(new.get("key"))
+            new.set("key", b"new value")
+            self.assertEqual(other.get("key"), b"new value")
+            # The workers before the reload keep their own file
+            self.assertEqual(self.cache.get("key"), b"old value")
+        finally:
+            new.close()
+            other.close()
@@ -0,0 +1,91 @@
+import multiprocessing
+import tempfile
+import threading
+import unittest
+import time
+from stamp_service.metrics import SINGLEFLIGHT_CALLS
+from stamp_service.singleflight import SingleFlight, worker_lock
+
+
+def hold_lock(directory, acquired, release):
+    with worker_lock(directory, "key") as locked:
+        acquired.put(locked)
+        release.wait()
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.flights = SingleFlight("test")
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def blocking(self, value):
+        self.calls += 1
+        self.started.set()
+        self.release.wait()
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def run_concurrently(self, value, count=4):
+        results = []
+
+        def call():
+            try:
+                results.append(self.flights.do("key", self.blocking, value))
+            except Exception as e:
+                results.append(e)
+
+        shared = SINGLEFLIGHT_CALLS.labels("test", "shared")
+        waiting = shared._value.get() + count - 1
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        threads[0].start()
+        self.started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        # Wait until every other caller is waiting for the first call
+        while shared._value.get() < waiting:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_result(self):
+        results = self.run_concurrently(b"avro")
+        self.assertEqual(results, [b"avro"] * 4)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flights._calls, {})
+
+    def test_concurrent_calls_share_exception(self):
+        error = FileNotFoundError()
+        results = self.run_concurrently(error)
+        self.assertTrue(all(result is error for result in results))
+        self.assertEqual(self.calls, 1)
+
+    def test_sequential_calls_run_again(self):
+        self.release.set()
+        self.flights.do("key", self.blocking, 1)
+        self.flights.do("key", self.blocking, 2)
+        self.assertEqual(self.calls, 2)
+
+
+class TestWorkerLock(unittest.TestCase):
+    def test_lock_is_exclusive_between_processes(self):
+        context = multiprocessing.get_context("spawn")
+        acquired, release = context.Queue(), context.Event()
+        with tempfile.TemporaryDirectory() as directory:
+            process = context.Process(
+                target=hold_lock, args=(directory, acquired, release)
+            )
+            process.start()
+            self.assertTrue(acquired.get(timeout=10))
+            with worker_lock(directory, "key") as locked:
+                self.assertFalse(locked)
+            with worker_lock(directory, "other") as locked:
+                self.assertTrue(locked)
+            release.set()
+            process.join()
+            with worker_lock(directory, "key") as locked:
+                self.assertTrue(locked)
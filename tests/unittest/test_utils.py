@@ -47,3 +47,47 @@ class TestUtils(unittest.TestCase):
         self.assertIsInstance(stamp_file, utils.io.BytesIO)
         self.assertEqual(mimetype, "image/png")
         self.assertEqual(fname, "oid_123_type.png")
+
+    @mock.patch("stamp_service.fits2png.transform_batch")
+    def test_format_stamps(self, mock_transform_batch):
+        mock_transform_batch.return_value = [b"science", b"difference"]
+        avro = {
+            "cutoutScience": {"stampData": b"science"},
+            "cutoutDifference": {"stampData": b"difference"},
+        }
+        stamps = utils.format_stamps(avro, "png", "oid", 123)
+        mock_transform_batch.assert_called_once_with(
+            [b"science", b"difference"], ["science", "difference"], 2, "numpy"
+        )
+        self.assertEqual(["science", "difference"], list(stamps))
+        self.assertEqual(stamps["science"]["file"], "c2NpZW5jZQ==")
+        self.assertEqual(stamps["science"]["mimetype"], "image/png")
+        self.assertEqual(
+            stamps["difference"]["download_name"], "oid_123_difference.png"
+        )
+
+        stamps = utils.format_stamps(avro, "fits", None, 123)
+        self.assertEqual(stamps["science"]["file"], "c2NpZW5jZQ==")
+        self.assertEqual(stamps["science"]["download_name"], "123_science.fits.gz")
+
+    @mock.patch("stamp_service.fits2png.transform_batch")
+    def test_render_stamps(self, mock_transform_batch):
+        mock_transform_batch.return_value = [b"difference png"]
+        avro = {
+            "cutoutScience": {"stampData": b"science"},
+            "cutoutDifference": {"stampData": b"difference"},
+        }
+        stamps = utils.render_stamps(avro, "png", ["difference", "template"])
+        mock_transform_batch.assert_called_once_with(
+            [b"difference"], ["difference"], 2, "numpy"
+        )
+        self.assertEqual(stamps, [("difference", b"difference png")])
+        stamps = utils.render_stamps(avro, "fits")
+        self.assertEqual(
+            stamps, [("science", b"science"), ("difference", b"difference")]
+        )
+
+    @mock.patch("stamp_service.fits2png.RENDERER_VERSION", 7)
+    def test_stamp_cache_key(self):
+        key = utils.stamp_cache_key("ztf", 123, "science", "png", "numpy")
+        self.assertEqual(key, "ztf/123/science/png/2/numpy-7")
@@ -0,0 +1,85 @@
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from stamp_service.singleflight import worker_lock
+from stamp_service.writeback import S3WriteBack
+from stamp_service.metrics import WRITEBACK_FAILURES, WRITEBACK_QUEUE_DEPTH
+
+
+@mock.patch("stamp_service.writeback.s3_searcher")
+class TestS3WriteBack(unittest.TestCase):
+    def setUp(self):
+        self.writeback = S3WriteBack()
+
+    def uploaded(self, s3_searcher):
+        return [
+            (f.read(), name, survey)
+            for (f, name, survey), _ in s3_searcher.upload_file.call_args_list
+        ]
+
+    def test_sync_by_default(self, s3_searcher):
+        self.assertTrue(self.writeback.submit(b"avro", 123, "ztf"))
+        self.assertEqual(self.uploaded(s3_searcher), [(b"avro", "321.avro", "ztf")])
+
+    def test_sync_failure_is_not_raised(self, s3_searcher):
+        s3_searcher.upload_file.side_effect = Exception("S3 is down")
+        failures = WRITEBACK_FAILURES.labels("upload_error")._value.get()
+        self.assertFalse(self.writeback.submit(b"avro", 123, "ztf"))
+        self.assertEqual(
+            WRITEBACK_FAILURES.labels("upload_error")._value.get(), failures + 1
+        )
+
+    def test_retries(self, s3_searcher):
+        s3_searcher.upload_file.side_effect = [Exception("S3 is down"), None]
+        self.writeback.init({"retries": 1, "backoff": 0.001})
+        self.assertTrue(self.writeback.submit(b"avro", 123, "ztf"))
+        self.assertEqual(s3_searcher.upload_file.call_count, 2)
+
+    def test_unknown_mode(self, s3_searcher):
+        with self.assertRaises(ValueError):
+            self.writeback.init({"mode": "other"})
+
+    def test_async_upload(self, s3_searcher):
+        depth = WRITEBACK_QUEUE_DEPTH._value.get()
+        self.writeback.init({"mode": "async"})
+        self.assertTrue(self.writeback.submit(b"avro", 123, "ztf"))
+        self.assertTrue(self.writeback.join(timeout=5))
+        self.assertEqual(self.uploaded(s3_searcher), [(b"avro", "321.avro", "ztf")])
+        self.assertEqual(self.writeback.nbytes, 0)
+        self.assertEqual(WRITEBACK_QUEUE_DEPTH._value.get(), depth)
+
+    def test_async_deduplicates_and_bounds_the_queue(self, s3_searcher):
+        release = threading.Event()
+        s3_searcher.upload_file.side_effect = lambda *args: release.wait()
+        self.writeback.init({"mode": "async", "max_bytes": 8})
+        self.assertTrue(self.writeback.submit(b"avro", 123, "ztf"))
+        self.assertTrue(self.writeback.submit(b"avro", 123, "ztf"))
+        self.assertFalse(self.writeback.submit(b"other avro", 456, "ztf"))
+        self.assertEqual(self.writeback.nbytes, 4)
+        release.set()
+        self.assertTrue(self.writeback.join(timeout=5))
+        self.assertEqual(s3_searcher.upload_file.call_count, 1)
+
+    def test_upload_locked_by_other_worker_is_skipped(self, s3_searcher):
+        with tempfile.TemporaryDirectory() as directory:
+            self.writeback.init({"lock_dir": directory})
+            with worker_lock(directory, "ztf/123"):
+                self.assertTrue(self.writeback.submit(b"avro", 123, "ztf"))
+            s3_searcher.upload_file.assert_not_called()
+            self.assertTrue(self.writeback.submit(b"avro", 123, "ztf"))
+            s3_searcher.upload_file.assert_called_once()
+
+    def test_lock_errors_release_the_queue(self, s3_searcher):
+        with tempfile.NamedTemporaryFile() as f:
+            # The lock files can't be created under a file
+            lock_dir = f"{f.name}/locks"
+            self.writeback.init({"lock_dir": lock_dir})
+            self.assertFalse(self.writeback.submit(b"avro", 123, "ztf"))
+            self.writeback.init({"mode": "async", "lock_dir": lock_dir})
+            for candid in [123, 456]:
+                self.assertTrue(self.writeback.submit(b"avro", candid, "ztf"))
+                self.assertTrue(self.writeback.join(timeout=5))
+            # The second avro was taken by the same worker thread
+            self.assertEqual(self.writeback.nbytes, 0)
+        s3_searcher.upload_file.assert_not_called()